@@ -12,6 +12,7 @@ from torch.utils.data import Dataset, Sampler
 
 __all__ = [
     "DistributedBucketSampler",
+    "DistributedFrameBucketSampler",
 ]
 
 T_co = TypeVar("T_co", covariant=True)
@@ -147,3 +148,59 @@ class DistributedBucketSampler(Sampler[T_co]):
             epoch (int): Epoch number.
         """
         self.epoch = epoch
+
+
+class DistributedFrameBucketSampler(DistributedBucketSampler):
+    r"""
+    batch sampler with a token budget: every batch holds at most max_tokens
+    padded semantic tokens (batch size x longest sample)
+    sort within buckets and pack greedily
+    shuffle batches across buckets
+    every replica gets the same number of batches
+    """
+
+    def __init__(
+        self,
+        dataset: Dataset,
+        max_tokens: int,
+        num_replicas: Optional[int] = None,
+        rank: Optional[int] = None,
+        shuffle: bool = True,
+        seed: int = 0,
+    ) -> None:
+        super().__init__(dataset, num_replicas=num_replicas, rank=rank, shuffle=shuffle, seed=seed)
+        self.max_tokens = max_tokens
+        self.tokens = {id: round(sec * dataset.hz) for id, sec in self.id_with_length}
+        # packing only depends on the sorted lengths, so the number of batches is the same every epoch
+        self.num_batches = math.ceil(len(self._pack(self.id_buckets)) / self.num_replicas)
+
+    def _pack(self, buckets):
+        batches = []
+        for buc in buckets:
+            batch = []
+            # stable sort keeps the shuffled order of samples with equal length
+            for id in sorted(buc, key=lambda id: self.tokens[id]):
+                if batch and (len(batch) + 1) * self.tokens[id] > self.max_tokens:
+                    batches.append(batch)
+                    batch = []
+                batch.append(id)
+            if batch:
+                batches.append(batch)
+        return batches
+
+    def __iter__(self) -> Iterator[T_co]:
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        buckets = self.id_buckets
+        if self.shuffle:
+            buckets = [[buc[i] for i in torch.randperm(len(buc), generator=g).tolist()] for buc in buckets]
+        batches = self._pack(buckets)
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches), generator=g).tolist()]
+        # repeat batches from the start to make it evenly divisible
+        total_batches = self.num_batches * self.num_replicas
+        batches = (batches * math.ceil(total_batches / len(batches)))[:total_batches]
+        return iter(batches[self.rank :: self.num_replicas])
+
+    def __len__(self) -> int:
+        return self.num_batches
@@ -3,7 +3,7 @@
 from pytorch_lightning import LightningDataModule
 from torch.utils.data import DataLoader
 
-from AR.data.bucket_sampler import DistributedBucketSampler
+from AR.data.bucket_sampler import DistributedBucketSampler, DistributedFrameBucketSampler
 from AR.data.dataset import Text2SemanticDataset
 
 
@@ -49,6 +49,19 @@ class Text2SemanticDataModule(LightningDataModule):
             else self.config["train"]["batch_size"]
         )
         batch_size = max(min(batch_size, len(self._train_dataset) // 4), 1)  # 防止不保存
+        max_tokens = self.config["train"].get("max_tokens_per_batch")
+        if max_tokens:
+            # 按 semantic token 总数动态组 batch, batch_size 不再起作用
+            if self.config["train"].get("if_dpo", False) is True:
+                max_tokens = max_tokens // 2
+            return DataLoader(
+                self._train_dataset,
+                batch_sampler=DistributedFrameBucketSampler(self._train_dataset, max_tokens=max_tokens),
+                collate_fn=self._train_dataset.collate,
+                num_workers=self.num_workers,
+                persistent_workers=True,
+                prefetch_factor=16,
+            )
         sampler = DistributedBucketSampler(self._train_dataset, batch_size=batch_size)
         return DataLoader(
             self._train_dataset,
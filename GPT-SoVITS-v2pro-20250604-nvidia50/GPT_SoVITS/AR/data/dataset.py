@@ -14,6 +14,7 @@ from torch.utils.data import DataLoader, Dataset
 version = os.environ.get("version", None)
 
 from text import cleaned_text_to_sequence
+from feature_store import FeatureStore
 
 # from config import exp_dir
 
@@ -69,6 +70,7 @@ class Text2SemanticDataset(Dataset):
         self.path6 = semantic_path  # "%s/6-name2semantic.tsv"%exp_dir#semantic_path
         assert os.path.exists(self.path2)
         assert os.path.exists(self.path6)
+        self.store3 = FeatureStore(self.path3) if os.path.exists(self.path3) else None
         self.phoneme_data = {}
         with open(self.path2, "r", encoding="utf8") as f:
             lines = f.read().strip("\n").split("\n")
@@ -219,9 +221,8 @@ class Text2SemanticDataset(Dataset):
         semantic_ids_len = len(semantic_ids)
 
         flag = 0
-        path_bert = "%s/%s.pt" % (self.path3, item_name)
-        if os.path.exists(path_bert) == True:
-            bert_feature = torch.load(path_bert, map_location="cpu")
+        if self.store3 is not None and item_name in self.store3:
+            bert_feature = self.store3.load(item_name)
         else:
             flag = 1
         if flag == 1:
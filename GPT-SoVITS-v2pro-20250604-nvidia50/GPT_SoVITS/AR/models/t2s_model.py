@@ -1,6 +1,7 @@
 # modified from https://github.com/yangdongchao/SoundStorm/blob/master/soundstorm/s1/AR/models/t2s_model.py
 # reference: https://github.com/lifeiteng/vall-e
 import math
+from collections import OrderedDict
 from typing import List, Optional
 
 import torch
@@ -220,6 +221,55 @@ class T2SBlock:
         )
         return x, k_cache, v_cache
 
+    def decode_next_token_static(
+        self,
+        x: torch.Tensor,
+        k_cache: torch.Tensor,
+        v_cache: torch.Tensor,
+        cache_len: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        # k_cache/v_cache 为预分配的 buffer [B, capacity, D], 新 token 的 K/V 按下标原地写入, 不再 torch.cat
+        q, k, v = F.linear(x, self.qkv_w, self.qkv_b).chunk(3, dim=-1)
+
+        batch_size = q.shape[0]
+        q_len = q.shape[1]
+        kv_len = cache_len + q_len
+
+        k_cache[:, cache_len:kv_len] = k
+        v_cache[:, cache_len:kv_len] = v
+
+        q = q.view(batch_size, q_len, self.num_heads, -1).transpose(1, 2)
+        k = k_cache[:, :kv_len].view(batch_size, kv_len, self.num_heads, -1).transpose(1, 2)
+        v = v_cache[:, :kv_len].view(batch_size, kv_len, self.num_heads, -1).transpose(1, 2)
+
+        if torch_sdpa:
+            attn = F.scaled_dot_product_attention(q, k, v, (~attn_mask) if attn_mask is not None else None)
+        else:
+            attn = scaled_dot_product_attention(q, k, v, attn_mask)
+
+        attn = attn.transpose(1, 2).reshape(batch_size, q_len, -1)
+        attn = F.linear(attn, self.out_w, self.out_b)
+
+        x = x + attn
+        x = F.layer_norm(
+            x,
+            [self.hidden_dim],
+            self.norm_w1,
+            self.norm_b1,
+            self.norm_eps1,
+        )
+        x = x + self.mlp.forward(x)
+        x = F.layer_norm(
+            x,
+            [self.hidden_dim],
+            self.norm_w2,
+            self.norm_b2,
+            self.norm_eps2,
+        )
+        return x
+
 
 @torch.jit.script
 class T2STransformer:
@@ -256,6 +306,19 @@ class T2STransformer:
             )
         return x, k_cache, v_cache
 
+    def decode_next_token_static(
+        self,
+        x: torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        cache_len: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        for i in range(self.num_blocks):
+            x = self.blocks[i].decode_next_token_static(x, k_cache[i], v_cache[i], cache_len, attn_mask, torch_sdpa)
+        return x
+
 
 class Text2SemanticDecoder(nn.Module):
     def __init__(self, config, norm_first=False, top_k=3):
@@ -352,6 +415,62 @@ class Text2SemanticDecoder(nn.Module):
 
         self.t2s_transformer = T2STransformer(self.num_layers, blocks)
 
+        # 参考文本前缀的 K/V 缓存, key 由调用方给出(参考音频, 参考文本...), 模型实例本身即区分了不同权重
+        self.prefix_kv_cache: OrderedDict = OrderedDict()
+        self.prefix_kv_cache_size: int = 8
+
+    def clear_prefix_kv_cache(self):
+        self.prefix_kv_cache.clear()
+
+    def get_prefix_kv(self, prefix_x: torch.Tensor, cache_key):
+        """
+        prefix_x: [1, prefix_len, hidden_dim], 参考文本(音素+bert)的输入 embedding
+        前缀只在自身内部做双向 attention, 因此各层的 K/V 与目标文本无关, 可以跨请求复用
+        """
+        prefix_len = prefix_x.shape[1]
+        if cache_key in self.prefix_kv_cache:
+            k_prefix, v_prefix = self.prefix_kv_cache[cache_key]
+            if (
+                k_prefix[0].shape[1] == prefix_len
+                and k_prefix[0].dtype == prefix_x.dtype
+                and k_prefix[0].device == prefix_x.device
+            ):
+                self.prefix_kv_cache.move_to_end(cache_key)
+                return k_prefix, v_prefix
+
+        attn_mask = torch.zeros(1, self.num_head, prefix_len, prefix_len, dtype=torch.bool, device=prefix_x.device)
+        _, k_prefix, v_prefix = self.t2s_transformer.process_prompt(prefix_x, attn_mask, None)
+        self.prefix_kv_cache[cache_key] = (k_prefix, v_prefix)
+        while len(self.prefix_kv_cache) > self.prefix_kv_cache_size:
+            self.prefix_kv_cache.popitem(last=False)
+        return k_prefix, v_prefix
+
+    @staticmethod
+    def _alloc_cache_buffer(t: torch.Tensor, valid_len: int, capacity: int, dim: int):
+        shape = list(t.shape)
+        shape[dim] = capacity
+        buf = t.new_zeros(shape)
+        buf.narrow(dim, 0, valid_len).copy_(t.narrow(dim, 0, valid_len))
+        return buf
+
+    def make_static_kv_cache(
+        self,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        attn_mask: Optional[torch.Tensor],
+        cache_len: int,
+        capacity: int,
+    ):
+        """
+        把 K/V 缓存(及对应的 attn_mask)搬到容量为 capacity 的预分配 buffer 中,
+        之后每步按 cache_len 游标原地写入, attn_mask 取 buffer 的前 cache_len+1 列作为视图
+        """
+        k_cache = [self._alloc_cache_buffer(k_item, cache_len, capacity, 1) for k_item in k_cache]
+        v_cache = [self._alloc_cache_buffer(v_item, cache_len, capacity, 1) for v_item in v_cache]
+        if attn_mask is not None:
+            attn_mask = self._alloc_cache_buffer(attn_mask, cache_len, capacity, 3)
+        return k_cache, v_cache, attn_mask
+
     def make_input_data(self, x, x_lens, y, y_lens, bert_feature):
         x = self.ar_text_embedding(x)
         x = x + self.bert_proj(bert_feature.transpose(1, 2))
@@ -580,40 +699,35 @@ class Text2SemanticDecoder(nn.Module):
         # 错位
         return targets[:, :-1], targets
 
-    def infer_panel_batch_infer(
+    def make_batch_infer_input(
         self,
-        x: List[torch.LongTensor],  #####全部文本token
+        x: List[torch.LongTensor],
         x_lens: torch.LongTensor,
-        prompts: torch.LongTensor,  ####参考音频token
+        prompts: torch.LongTensor,
         bert_feature: List[torch.LongTensor],
-        top_k: int = -100,
-        top_p: int = 100,
-        early_stop_num: int = -1,
-        temperature: float = 1.0,
-        repetition_penalty: float = 1.35,
-        **kwargs,
+        max_len: int,
+        prompt_phone_len: int = 0,
+        prefix_cache_key=None,
     ):
-        if prompts is None:
-            print("Warning: Prompt free is not supported batch_infer! switch to naive_infer")
-            return self.infer_panel_naive_batched(
-                x,
-                x_lens,
-                prompts,
-                bert_feature,
-                top_k=top_k,
-                top_p=top_p,
-                early_stop_num=early_stop_num,
-                temperature=temperature,
-                **kwargs,
-            )
-
-        max_len = kwargs.get("max_len", x_lens.max())
+        """
+        构造并行推理首步(prefill)的输入: 左 padding 后的 xy_pos 与 attn_mask [B, H, src_len, src_len]
+        开启前缀缓存时同时返回扩展到 batch 的前缀 K/V, 否则 k_cache/v_cache 为 None
+        """
+        use_prefix_cache = prefix_cache_key is not None and prompt_phone_len > 0
+        prefix_x = None
+        if use_prefix_cache:
+            max_len = max_len - prompt_phone_len
+            x_lens = x_lens - prompt_phone_len
         x_list = []
         for x_item, bert_item in zip(x, bert_feature):
             # max_len = max(max_len, x_item.shape[0], bert_item.shape[1])
             x_item = self.ar_text_embedding(x_item.unsqueeze(0))
             x_item = x_item + self.bert_proj(bert_item.transpose(0, 1).unsqueeze(0))
             x_item = self.ar_text_position(x_item).squeeze(0)
+            if use_prefix_cache:
+                if prefix_x is None:
+                    prefix_x = x_item[:prompt_phone_len].unsqueeze(0)
+                x_item = x_item[prompt_phone_len:]
             # x_item = F.pad(x_item,(0,0,0,max_len-x_item.shape[0]),value=0) if x_item.shape[0]<max_len else x_item  ### padding right
             x_item = (
                 F.pad(x_item, (0, 0, max_len - x_item.shape[0], 0), value=0) if x_item.shape[0] < max_len else x_item
@@ -621,21 +735,13 @@ class Text2SemanticDecoder(nn.Module):
             x_list.append(x_item)
         x: torch.Tensor = torch.stack(x_list, dim=0)
 
-        # AR Decoder
         y = prompts
-
         x_len = x.shape[1]
-        stop = False
 
         k_cache = None
         v_cache = None
-        ###################  first step ##########################
-        assert y is not None, "Error: Prompt free is not supported batch_infer!"
-        ref_free = False
-
         y_emb = self.ar_audio_embedding(y)
         y_len = y_emb.shape[1]
-        prefix_len = y.shape[1]
         y_lens = torch.LongTensor([y_emb.shape[1]] * y_emb.shape[0]).to(x.device)
         y_pos = self.ar_audio_position(y_emb)
         xy_pos = torch.concat([x, y_pos], dim=1)
@@ -682,6 +788,95 @@ class Text2SemanticDecoder(nn.Module):
         attn_mask: torch.Tensor = causal_mask.logical_or(padding_mask)
         attn_mask = attn_mask.unsqueeze(1).expand(-1, self.num_head, -1, -1).bool()
 
+        if use_prefix_cache:
+            k_prefix, v_prefix = self.get_prefix_kv(prefix_x, prefix_cache_key)
+            k_cache = [k_item.expand(bsz, -1, -1) for k_item in k_prefix]
+            v_cache = [v_item.expand(bsz, -1, -1) for v_item in v_prefix]
+            ### 所有 token 都可以看见前缀
+            attn_mask = F.pad(attn_mask, (prompt_phone_len, 0), value=False)
+
+        return xy_pos, attn_mask, k_cache, v_cache
+
+    def prefill_batch_infer(
+        self,
+        x: List[torch.LongTensor],
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,
+        bert_feature: List[torch.LongTensor],
+        max_len: int,
+    ):
+        """
+        连续批处理用的首步: 对一组新请求做 prefill, 返回首个 token 的 logits(已去掉 EOS)、
+        各层 K/V 以及解码阶段使用的 attn_mask [B, H, 1, src_len]
+        """
+        xy_pos, attn_mask, _, _ = self.make_batch_infer_input(x, x_lens, prompts, bert_feature, max_len)
+        xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, attn_mask, None)
+        logits = self.ar_predict_layer(xy_dec[:, -1])[:, :-1]
+        return logits, k_cache, v_cache, attn_mask[:, :, -1].unsqueeze(-2)
+
+    def embed_next_token(self, y: torch.Tensor):
+        """
+        取 y 的最后一个 token 作为下一步输入, 位置编码为其在 y 中的下标
+        """
+        y_emb = self.ar_audio_embedding(y[:, -1:])
+        return y_emb * self.ar_audio_position.x_scale + self.ar_audio_position.alpha * self.ar_audio_position.pe[
+            :, y.shape[1] - 1
+        ].to(dtype=y_emb.dtype, device=y_emb.device)
+
+    def infer_panel_batch_infer(
+        self,
+        x: List[torch.LongTensor],  #####全部文本token
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,  ####参考音频token
+        bert_feature: List[torch.LongTensor],
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        **kwargs,
+    ):
+        if prompts is None:
+            print("Warning: Prompt free is not supported batch_infer! switch to naive_infer")
+            return self.infer_panel_naive_batched(
+                x,
+                x_lens,
+                prompts,
+                bert_feature,
+                top_k=top_k,
+                top_p=top_p,
+                early_stop_num=early_stop_num,
+                temperature=temperature,
+                **kwargs,
+            )
+
+        max_len = kwargs.get("max_len", x_lens.max())
+        ### 前缀缓存模式: 参考文本的前 prompt_phone_len 个 token 作为共享前缀, 其各层 K/V 按 prefix_cache_key 缓存,
+        ### 只对目标文本和 prompt_semantic 做 prefill。前缀不再 attend 目标文本, 结果与默认模式略有差异
+        prefix_cache_key = kwargs.get("prefix_cache_key", None)
+        prompt_phone_len = kwargs.get("prompt_phone_len", 0)
+        use_prefix_cache = prefix_cache_key is not None and prompt_phone_len > 0
+
+        # AR Decoder
+        y = prompts
+        stop = False
+
+        ###################  first step ##########################
+        assert y is not None, "Error: Prompt free is not supported batch_infer!"
+        ref_free = False
+
+        xy_pos, attn_mask, k_cache, v_cache = self.make_batch_infer_input(
+            x,
+            x_lens,
+            y,
+            bert_feature,
+            max_len,
+            prompt_phone_len if use_prefix_cache else 0,
+            prefix_cache_key,
+        )
+        y_len = y.shape[1]
+        prefix_len = y.shape[1]
+
         # 正确的attn_mask应该是这样的：
         # |   pad_len   |  x_len  |  y_len  |
         # [[PAD, PAD, PAD, 1, 2, 3, EOS, EOS, EOS],
@@ -695,21 +890,34 @@ class Text2SemanticDecoder(nn.Module):
         # [PAD, PAD, PAD, 1, 2, 3,   4,   5,   6]]
 
         ###### decode #####
+        ### 首步之后 K/V 缓存改为预分配 buffer + 长度游标, 每步原地写入, 不再随 token 数重新分配和拷贝
+        kv_cache_block_size = kwargs.get("kv_cache_block_size", 1500)
+        cache_len = 0
         y_list = [None] * y.shape[0]
         batch_idx_map = list(range(y.shape[0]))
         idx_list = [None] * y.shape[0]
         for idx in tqdm(range(1500)):
-            if idx == 0:
+            if idx == 0 and not use_prefix_cache:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, attn_mask, None)
-            else:
+            elif idx == 0:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache, attn_mask)
+            else:
+                if cache_len >= k_cache[0].shape[1]:
+                    k_cache, v_cache, attn_mask = self.make_static_kv_cache(
+                        k_cache, v_cache, attn_mask, cache_len, cache_len + kv_cache_block_size
+                    )
+                xy_dec = self.t2s_transformer.decode_next_token_static(
+                    xy_pos, k_cache, v_cache, cache_len, attn_mask[:, :, :, : cache_len + 1]
+                )
+                cache_len += 1
             logits = self.ar_predict_layer(xy_dec[:, -1])
 
             if idx == 0:
-                attn_mask = F.pad(attn_mask[:, :, -1].unsqueeze(-2), (0, 1), value=False)
+                cache_len = k_cache[0].shape[1]
+                k_cache, v_cache, attn_mask = self.make_static_kv_cache(
+                    k_cache, v_cache, attn_mask[:, :, -1].unsqueeze(-2), cache_len, cache_len + kv_cache_block_size
+                )
                 logits = logits[:, :-1]
-            else:
-                attn_mask = F.pad(attn_mask, (0, 1), value=False)
 
             samples = sample(
                 logits, y, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature
@@ -769,12 +977,12 @@ class Text2SemanticDecoder(nn.Module):
             ].to(dtype=y_emb.dtype, device=y_emb.device)
 
         if None in idx_list:
-            for i in range(x.shape[0]):
+            for i in range(len(x)):
                 if idx_list[i] is None:
                     idx_list[i] = 1500 - 1  ###如果没有生成到EOS，就用最大长度代替
 
         if ref_free:
-            return y_list, [0] * x.shape[0]
+            return y_list, [0] * len(x)
         # print(idx_list)
         return y_list, idx_list
 
@@ -875,16 +1083,24 @@ class Text2SemanticDecoder(nn.Module):
             .to(device=x.device, dtype=torch.bool)
         )
 
+        kv_cache_block_size = kwargs.get("kv_cache_block_size", 1500)
+        cache_len = 0
         for idx in tqdm(range(1500)):
             if xy_attn_mask is not None:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
             else:
-                xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache)
+                if cache_len >= k_cache[0].shape[1]:
+                    k_cache, v_cache, _ = self.make_static_kv_cache(
+                        k_cache, v_cache, None, cache_len, cache_len + kv_cache_block_size
+                    )
+                xy_dec = self.t2s_transformer.decode_next_token_static(xy_pos, k_cache, v_cache, cache_len, None)
+                cache_len += 1
 
             logits = self.ar_predict_layer(xy_dec[:, -1])
 
             if idx == 0:
                 xy_attn_mask = None
+                cache_len = k_cache[0].shape[1]
             if idx < 11:  ###至少预测出10个token不然不给停止（0.4s）
                 logits = logits[:, :-1]
 
@@ -0,0 +1,184 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from typing import Callable, Generator
+
+
+class QueueFullError(Exception):
+    """排队任务已满, api 层返回 429"""
+
+    def __init__(self, queue_size: int):
+        super().__init__("inference queue is full (%d)" % queue_size)
+        self.queue_size = queue_size
+
+
+class InferenceTimeout(Exception):
+    """排队加出第一项结果超过了请求的超时时间, api 层返回 504"""
+
+
+class InferenceJob:
+    """
+    一次推理请求。func 是生成器函数, 在推理线程里执行, 每 yield 一项就通过事件循环交给等待的协程;
+    协程一侧用 async for 逐项读取(流式)或 await result() 取第一项(非流式)。
+    """
+
+    def __init__(self, func: Callable[[], Generator], priority: int, timeout: float, loop: asyncio.AbstractEventLoop):
+        self.func = func
+        self.priority = priority
+        self.loop = loop
+        self.enqueue_time: float = time.monotonic()
+        self.deadline: float = self.enqueue_time + timeout if timeout else None
+        self.start_time: float = None
+        self.position: int = 0  # 入队时排在前面的任务数
+        self.cancelled: bool = False
+        self.received: bool = False  # 已拿到第一项, 之后不再计超时, 长的流式输出不会被截断
+        self.results: asyncio.Queue = asyncio.Queue()
+
+    def remaining(self):
+        if self.deadline is None or self.received:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def cancel(self):
+        # 推理线程在两项之间检查该标记, 客户端断开或超时后尽快停止
+        self.cancelled = True
+
+    def headers(self):
+        headers = {"X-Queue-Position": str(self.position)}
+        if self.start_time is not None:
+            headers["X-Queue-Wait"] = "%.3f" % (self.start_time - self.enqueue_time)
+        return headers
+
+    def _push(self, kind, item=None):
+        try:
+            self.loop.call_soon_threadsafe(self.results.put_nowait, (kind, item))
+        except RuntimeError:  # 事件循环已关闭
+            self.cancelled = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            kind, item = await asyncio.wait_for(self.results.get(), self.remaining())
+        except asyncio.TimeoutError:
+            self.cancel()
+            raise InferenceTimeout("inference timeout after %.1fs" % (time.monotonic() - self.enqueue_time))
+        if kind == "end":
+            raise StopAsyncIteration
+        if kind == "error":
+            raise item
+        self.received = True
+        return item
+
+    async def result(self):
+        async for item in self:
+            return item
+        return None
+
+
+class InferenceExecutor:
+    """
+    api 推理执行器: 固定数量的推理线程从有界优先队列取任务, 事件循环只负责排队和等待结果,
+    推理期间 /control、/set_refer_audio 等接口照常响应。
+
+    - priority 越大越先执行, 同优先级先到先得
+    - 排队数达到 max_queue 时 submit 抛出 QueueFullError(force=True 的控制类任务不受限制)
+    - timeout 从入队开始计算到拿到第一项结果(流式为第一段音频), 排队阶段超时的任务不再执行
+    """
+
+    def __init__(self, num_workers: int = 1, max_queue: int = 32, timeout: float = 300):
+        self.num_workers = num_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.heap: list = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.running: int = 0
+        self.closed: bool = False
+        self.workers = [
+            threading.Thread(target=self._worker_loop, name="InferenceWorker-%d" % i, daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, func: Callable[[], Generator], priority: int = 0, timeout: float = None, force: bool = False):
+        """在事件循环中调用, 返回 InferenceJob"""
+        job = InferenceJob(func, priority, self.timeout if timeout is None else timeout, asyncio.get_running_loop())
+        with self.cond:
+            queued = [entry[2] for entry in self.heap if not entry[2].cancelled]
+            if not force and len(queued) >= self.max_queue:
+                raise QueueFullError(len(queued))
+            job.position = sum(1 for other in queued if other.priority >= priority)
+            heapq.heappush(self.heap, (-priority, next(self.counter), job))
+            self.cond.notify()
+        return job
+
+    async def call(self, func: Callable, *args, priority: int = 0, timeout: float = None, force: bool = False):
+        """把一个普通函数放到推理线程里执行并等待返回值, 用于切换权重等需要与推理串行的操作"""
+
+        def run():
+            yield func(*args)
+
+        return await self.submit(run, priority, timeout, force).result()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "queued": sum(1 for entry in self.heap if not entry[2].cancelled),
+                "running": self.running,
+                "workers": self.num_workers,
+                "max_queue": self.max_queue,
+                "timeout": self.timeout,
+            }
+
+    def shutdown(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def _next_job(self):
+        with self.cond:
+            while not self.closed:
+                while self.heap:
+                    job = heapq.heappop(self.heap)[2]
+                    if not job.cancelled:
+                        self.running += 1
+                        return job
+                self.cond.wait()
+            return None
+
+    def _worker_loop(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                self._run_job(job)
+            finally:
+                with self.cond:
+                    self.running -= 1
+
+    def _run_job(self, job: InferenceJob):
+        if job.remaining() == 0:
+            job._push("error", InferenceTimeout("inference timeout while queued"))
+            return
+        job.start_time = time.monotonic()
+        generator = None
+        try:
+            generator = job.func()
+            for item in generator:
+                if job.cancelled:
+                    break
+                job._push("item", item)
+            job._push("end")
+        except Exception as e:
+            traceback.print_exc()
+            job._push("error", e)
+        finally:
+            if generator is not None:
+                generator.close()
@@ -0,0 +1,288 @@
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import Future
+from typing import List
+
+import torch
+
+from AR.models.t2s_model import Text2SemanticDecoder
+from AR.models.utils import sample
+
+
+class T2SRequest:
+    """
+    一次 infer_panel 调用(同一参考音频下的一批句子), 在调度器中作为一个整体加入和退出
+    """
+
+    def __init__(
+        self,
+        x: List[torch.LongTensor],
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,
+        bert_feature: List[torch.LongTensor],
+        max_len: int,
+        top_k: int,
+        top_p: float,
+        temperature: float,
+        repetition_penalty: float,
+        early_stop_num: int,
+    ):
+        self.x = x
+        self.x_lens = x_lens
+        self.prompts = prompts
+        self.bert_feature = bert_feature
+        self.max_len = max_len
+        self.top_k = top_k
+        self.top_p = top_p
+        self.temperature = temperature
+        self.repetition_penalty = repetition_penalty
+        self.early_stop_num = early_stop_num
+
+        self.future: Future = Future()
+        self.prefix_len: int = prompts.shape[1]
+        self.y: torch.Tensor = None
+        self.step: int = 0
+        self.batch_idx_map: List[int] = list(range(len(x)))
+        self.y_list: list = [None] * len(x)
+        self.idx_list: list = [None] * len(x)
+
+    @property
+    def num_rows(self):
+        return len(self.batch_idx_map)
+
+
+class T2SScheduler:
+    """
+    T2S 连续批处理(in-flight batching)调度器。
+
+    多个并发请求共享一个解码 batch: 后台线程每步只做一次 decode_next_token_static,
+    新请求在步与步之间 prefill 后并入, 已生成 EOS 的行立即移出, 不必等待整批结束。
+    各行的 K/V 右对齐到同一个 cache_len 游标, 左侧空位在 attn_mask 中屏蔽;
+    位置编码已在输入端按各行自己的长度计算, 所以并入时移动 K/V 不影响结果。
+    """
+
+    def __init__(self, model: Text2SemanticDecoder, max_batch_size: int = 32, kv_cache_block_size: int = 1500):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.kv_cache_block_size = kv_cache_block_size
+
+        self.pending: deque = deque()
+        self.running: List[T2SRequest] = []
+        self.cond = threading.Condition()
+        self.closed: bool = False
+        self.worker: threading.Thread = None
+
+        self.k_cache: List[torch.Tensor] = None
+        self.v_cache: List[torch.Tensor] = None
+        self.attn_mask: torch.Tensor = None
+        self.cache_len: int = 0
+
+    def submit(
+        self,
+        x: List[torch.LongTensor],
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,
+        bert_feature: List[torch.LongTensor],
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        **kwargs,
+    ) -> Future:
+        assert prompts is not None, "Error: Prompt free is not supported by T2SScheduler!"
+        request = T2SRequest(
+            x,
+            x_lens,
+            prompts,
+            bert_feature,
+            kwargs.get("max_len", x_lens.max()),
+            top_k,
+            top_p,
+            temperature,
+            repetition_penalty,
+            early_stop_num,
+        )
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("T2SScheduler has been shut down")
+            self.pending.append(request)
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._loop, name="T2SScheduler", daemon=True)
+                self.worker.start()
+            self.cond.notify()
+        return request.future
+
+    def infer_panel(self, *args, **kwargs):
+        """
+        与 infer_panel_batch_infer 接口一致, 阻塞到本请求的所有句子解码完成
+        """
+        return self.submit(*args, **kwargs).result()
+
+    def shutdown(self, wait: bool = True):
+        """
+        不再接收新请求, 已提交的请求解码完成后后台线程退出
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        if wait and self.worker is not None:
+            self.worker.join()
+
+    def _loop(self):
+        with torch.no_grad():
+            while True:
+                with self.cond:
+                    while not self.pending and not self.running and not self.closed:
+                        self.cond.wait()
+                    if self.closed and not self.pending and not self.running:
+                        return
+                    admitted = []
+                    num_rows = sum(request.num_rows for request in self.running)
+                    while self.pending and (
+                        num_rows == 0 or num_rows + self.pending[0].num_rows <= self.max_batch_size
+                    ):
+                        request = self.pending.popleft()
+                        num_rows += request.num_rows
+                        admitted.append(request)
+                try:
+                    for request in admitted:
+                        self._admit(request)
+                    if self.running:
+                        self._step()
+                except Exception as e:
+                    traceback.print_exc()
+                    for request in self.running + admitted:
+                        if not request.future.done():
+                            request.future.set_exception(e)
+                    self._reset()
+
+    def _reset(self):
+        self.running = []
+        self.k_cache = None
+        self.v_cache = None
+        self.attn_mask = None
+        self.cache_len = 0
+
+    @staticmethod
+    def _right_align(t: torch.Tensor, valid_len: int, new_len: int, capacity: int, dim: int, fill_value=0):
+        ### 把前 valid_len 个位置移到 [new_len - valid_len, new_len), 其余位置填 fill_value
+        shape = list(t.shape)
+        shape[dim] = capacity
+        buf = t.new_full(shape, fill_value)
+        buf.narrow(dim, new_len - valid_len, valid_len).copy_(t.narrow(dim, 0, valid_len))
+        if fill_value:
+            buf.narrow(dim, new_len, capacity - new_len).fill_(0)
+        return buf
+
+    def _sample(self, request: T2SRequest, logits: torch.Tensor):
+        samples = sample(
+            logits,
+            request.y,
+            top_k=request.top_k,
+            top_p=request.top_p,
+            repetition_penalty=request.repetition_penalty,
+            temperature=request.temperature,
+        )[0]
+        request.y = torch.concat([request.y, samples], dim=1)
+        return samples
+
+    def _admit(self, request: T2SRequest):
+        logits, k_new, v_new, mask_new = self.model.prefill_batch_infer(
+            request.x, request.x_lens, request.prompts, request.bert_feature, request.max_len
+        )
+        request.y = request.prompts
+        self._sample(request, logits)
+        request.x = request.bert_feature = None
+
+        new_cache_len = k_new[0].shape[1]
+        if not self.running:
+            self.cache_len = new_cache_len
+            self.k_cache, self.v_cache, self.attn_mask = self.model.make_static_kv_cache(
+                k_new, v_new, mask_new, new_cache_len, new_cache_len + self.kv_cache_block_size
+            )
+            self.running.append(request)
+            return
+
+        cache_len = max(self.cache_len, new_cache_len)
+        capacity = max(self.k_cache[0].shape[1], cache_len + self.kv_cache_block_size)
+        if cache_len != self.cache_len or capacity != self.k_cache[0].shape[1]:
+            self.k_cache = [self._right_align(k, self.cache_len, cache_len, capacity, 1) for k in self.k_cache]
+            self.v_cache = [self._right_align(v, self.cache_len, cache_len, capacity, 1) for v in self.v_cache]
+            self.attn_mask = self._right_align(self.attn_mask, self.cache_len, cache_len, capacity, 3, True)
+        k_new = [self._right_align(k, new_cache_len, cache_len, capacity, 1) for k in k_new]
+        v_new = [self._right_align(v, new_cache_len, cache_len, capacity, 1) for v in v_new]
+        mask_new = self._right_align(mask_new, new_cache_len, cache_len, capacity, 3, True)
+
+        self.k_cache = [torch.concat([k, k_item], dim=0) for k, k_item in zip(self.k_cache, k_new)]
+        self.v_cache = [torch.concat([v, v_item], dim=0) for v, v_item in zip(self.v_cache, v_new)]
+        self.attn_mask = torch.concat([self.attn_mask, mask_new], dim=0)
+        self.cache_len = cache_len
+        self.running.append(request)
+
+    def _step(self):
+        model = self.model
+        if self.cache_len >= self.k_cache[0].shape[1]:
+            self.k_cache, self.v_cache, self.attn_mask = model.make_static_kv_cache(
+                self.k_cache, self.v_cache, self.attn_mask, self.cache_len, self.cache_len + self.kv_cache_block_size
+            )
+        xy_pos = torch.concat([model.embed_next_token(request.y) for request in self.running], dim=0)
+        xy_dec = model.t2s_transformer.decode_next_token_static(
+            xy_pos, self.k_cache, self.v_cache, self.cache_len, self.attn_mask[:, :, :, : self.cache_len + 1]
+        )
+        self.cache_len += 1
+        logits = model.ar_predict_layer(xy_dec[:, -1])
+
+        reserved_rows = []
+        running = []
+        offset = 0
+        for request in self.running:
+            request.step += 1
+            num_rows = request.num_rows
+            _logits = logits[offset : offset + num_rows]
+            samples = self._sample(request, _logits)
+            tokens = torch.argmax(_logits, dim=-1)
+            finished = (samples[:, 0] == model.EOS).logical_or(tokens == model.EOS).tolist()
+
+            y = request.y
+            keep = []
+            for i, is_finished in enumerate(finished):
+                if is_finished:
+                    batch_index = request.batch_idx_map[i]
+                    request.idx_list[batch_index] = request.step
+                    request.y_list[batch_index] = y[i, :-1]
+                else:
+                    keep.append(i)
+
+            if (
+                request.early_stop_num != -1 and (y.shape[1] - request.prefix_len) > request.early_stop_num
+            ) or request.step == 1499:
+                print("use early stop num:", request.early_stop_num)
+                for i in keep:
+                    batch_index = request.batch_idx_map[i]
+                    request.idx_list[batch_index] = request.step
+                    request.y_list[batch_index] = y[i, :-1]
+                keep = []
+
+            if len(keep) < num_rows:
+                request.batch_idx_map = [request.batch_idx_map[i] for i in keep]
+                request.y = y[keep]
+            reserved_rows.extend(offset + i for i in keep)
+            offset += num_rows
+
+            if keep:
+                running.append(request)
+            else:
+                print(f"T2S Decoding EOS [{request.prefix_len} -> {request.prefix_len + request.step + 1}]")
+                request.future.set_result((request.y_list, request.idx_list))
+
+        if len(reserved_rows) < offset:
+            index = torch.LongTensor(reserved_rows).to(logits.device)
+            self.attn_mask = torch.index_select(self.attn_mask, dim=0, index=index)
+            for i in range(len(self.k_cache)):
+                self.k_cache[i] = torch.index_select(self.k_cache[i], dim=0, index=index)
+                self.v_cache[i] = torch.index_select(self.v_cache[i], dim=0, index=index)
+        self.running = running
+        if not self.running:
+            self._reset()
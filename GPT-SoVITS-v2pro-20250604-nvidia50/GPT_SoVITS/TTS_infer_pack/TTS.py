@@ -3,9 +3,10 @@ import math
 import os
 import random
 import sys
+import threading
 import time
 import traceback
-from copy import deepcopy
+from copy import copy, deepcopy
 
 import torchaudio
 from tqdm import tqdm
@@ -34,6 +35,7 @@ from tools.audio_sr import AP_BWE
 from tools.i18n.i18n import I18nAuto, scan_language_list
 from TTS_infer_pack.text_segmentation_method import splits
 from TTS_infer_pack.TextPreprocessor import TextPreprocessor
+from TTS_infer_pack.T2SScheduler import T2SScheduler
 from sv import SV
 
 resample_transform_dict = {}
@@ -434,13 +436,23 @@ class TTS:
             "overlapped_len": None,
         }
 
+        self.t2s_scheduler: T2SScheduler = None
+        self.prompt_lock = threading.Lock()
+
         self._init_models()
 
         self.text_preprocessor: TextPreprocessor = TextPreprocessor(
             self.bert_model, self.bert_tokenizer, self.configs.device
         )
 
-        self.prompt_cache: dict = {
+        self.prompt_cache: dict = self._empty_prompt_cache()
+
+        self.stop_flag: bool = False
+        self.precision: torch.dtype = torch.float16 if self.configs.is_half else torch.float32
+
+    @staticmethod
+    def _empty_prompt_cache():
+        return {
             "ref_audio_path": None,
             "prompt_semantic": None,
             "refer_spec": [],
@@ -450,11 +462,9 @@ class TTS:
             "bert_features": None,
             "norm_text": None,
             "aux_ref_audio_paths": [],
+            "vocoder_cond": None,
         }
 
-        self.stop_flag: bool = False
-        self.precision: torch.dtype = torch.float16 if self.configs.is_half else torch.float32
-
     def _init_models(
         self,
     ):
@@ -597,6 +607,62 @@ class TTS:
         self.t2s_model = t2s_model
         if self.configs.is_half and str(self.configs.device) != "cpu":
             self.t2s_model = self.t2s_model.half()
+        if self.t2s_scheduler is not None:
+            self.enable_continuous_batching(self.t2s_scheduler.max_batch_size)
+
+    def enable_continuous_batching(self, max_batch_size: int = 32):
+        """
+        开启 T2S 连续批处理: 并发调用 run 时, 各请求的句子在同一个解码 batch 中逐步生成,
+        先结束的请求先返回, 新请求在解码步之间加入。max_batch_size <= 0 时关闭。
+        """
+        if self.t2s_scheduler is not None:
+            self.t2s_scheduler.shutdown()
+            self.t2s_scheduler = None
+        if max_batch_size > 0:
+            self.t2s_scheduler = T2SScheduler(self.t2s_model.model, max_batch_size)
+
+    def fork(self, t2s_weights_path: str, vits_weights_path: str):
+        """
+        以当前实例为模板创建加载另一组 GPT/SoVITS 权重的实例, 用于多个音色同时常驻。
+        BERT、HuBERT、SV、超分模型以及同类型的声码器与当前实例共享; 新实例切换权重不会写回配置文件。
+        """
+        tts = copy(self)
+        tts.configs = copy(self.configs)
+        tts.configs.save_configs = lambda configs_path=None: None
+        tts.vocoder_configs = dict(self.vocoder_configs)
+        tts.t2s_model = None
+        tts.vits_model = None
+        tts.t2s_scheduler = None
+        tts.prompt_lock = threading.Lock()
+        tts.prompt_cache = self._empty_prompt_cache()
+        tts.stop_flag = False
+        _, model_version, _ = get_sovits_version_from_path_fast(vits_weights_path)
+        if model_version != self.configs.version:
+            # 声码器类型可能不同, 新实例单独加载, init_vocoder 释放旧声码器时不能动到共享的那个
+            tts.vocoder = None
+        tts.init_t2s_weights(t2s_weights_path)
+        tts.init_vits_weights(vits_weights_path)
+        if self.t2s_scheduler is not None:
+            tts.enable_continuous_batching(self.t2s_scheduler.max_batch_size)
+        return tts
+
+    def model_memory(self):
+        """本实例独占的 GPT/SoVITS 权重占用的字节数, 供模型池按显存预算淘汰"""
+        size = 0
+        for model in (self.t2s_model, self.vits_model):
+            if model is not None:
+                size += sum(p.numel() * p.element_size() for p in model.parameters())
+        return size
+
+    def release(self):
+        """释放本实例的 GPT/SoVITS 权重和参考音频缓存, 共享的模型不受影响"""
+        if self.t2s_scheduler is not None:
+            self.t2s_scheduler.shutdown()
+            self.t2s_scheduler = None
+        self.t2s_model = None
+        self.vits_model = None
+        self.prompt_cache = self._empty_prompt_cache()
+        self.empty_cache()
 
     def init_vocoder(self, version: str):
         if version == "v3":
@@ -1008,7 +1074,9 @@ class TTS:
                     "parallel_infer": True,       # bool. whether to use parallel inference.
                     "repetition_penalty": 1.35    # float. repetition penalty for T2S model.
                     "sample_steps": 32,           # int. number of sampling steps for VITS model V3.
+                    "cfm_solver": "euler",        # str. ODE solver of the CFM for VITS model V3/V4: euler, midpoint, heun, multistep.
                     "super_sampling": False,       # bool. whether to use super-sampling for audio when using VITS model V3.
+                    "prefix_cache": False,        # bool. whether to reuse the cached K/V of the prompt text in the T2S model (parallel_infer only).
                 }
         returns:
             Tuple[int, np.ndarray]: sampling rate and audio data.
@@ -1037,14 +1105,16 @@ class TTS:
         parallel_infer = inputs.get("parallel_infer", True)
         repetition_penalty = inputs.get("repetition_penalty", 1.35)
         sample_steps = inputs.get("sample_steps", 32)
+        cfm_solver = inputs.get("cfm_solver", None)
         super_sampling = inputs.get("super_sampling", False)
+        prefix_cache = inputs.get("prefix_cache", False)
 
         if parallel_infer:
             print(i18n("并行推理模式已开启"))
-            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_batch_infer
+            infer_panel = self.t2s_model.model.infer_panel_batch_infer
         else:
             print(i18n("并行推理模式已关闭"))
-            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_naive_batched
+            infer_panel = self.t2s_model.model.infer_panel_naive_batched
 
         if return_fragment:
             print(i18n("分段返回模式已开启"))
@@ -1087,41 +1157,50 @@ class TTS:
 
         ###### setting reference audio and prompt text preprocessing ########
         t0 = time.perf_counter()
-        if (ref_audio_path is not None) and (
-            ref_audio_path != self.prompt_cache["ref_audio_path"]
-            or (self.is_v2pro and self.prompt_cache["refer_spec"][0][1] is None)
-        ):
-            if not os.path.exists(ref_audio_path):
-                raise ValueError(f"{ref_audio_path} not exists")
-            self.set_ref_audio(ref_audio_path)
-
-        aux_ref_audio_paths = aux_ref_audio_paths if aux_ref_audio_paths is not None else []
-        paths = set(aux_ref_audio_paths) & set(self.prompt_cache["aux_ref_audio_paths"])
-        if not (len(list(paths)) == len(aux_ref_audio_paths) == len(self.prompt_cache["aux_ref_audio_paths"])):
-            self.prompt_cache["aux_ref_audio_paths"] = aux_ref_audio_paths
-            self.prompt_cache["refer_spec"] = [self.prompt_cache["refer_spec"][0]]
-            for path in aux_ref_audio_paths:
-                if path in [None, ""]:
-                    continue
-                if not os.path.exists(path):
-                    print(i18n("音频文件不存在，跳过："), path)
-                    continue
-                self.prompt_cache["refer_spec"].append(self._get_ref_spec(path))
+        ### 参考音频和参考文本的设置与快照在锁内完成, 并发请求之间互不覆盖 prompt_cache
+        with self.prompt_lock:
+            if (ref_audio_path is not None) and (
+                ref_audio_path != self.prompt_cache["ref_audio_path"]
+                or (self.is_v2pro and self.prompt_cache["refer_spec"][0][1] is None)
+            ):
+                if not os.path.exists(ref_audio_path):
+                    raise ValueError(f"{ref_audio_path} not exists")
+                self.set_ref_audio(ref_audio_path)
+
+            aux_ref_audio_paths = aux_ref_audio_paths if aux_ref_audio_paths is not None else []
+            paths = set(aux_ref_audio_paths) & set(self.prompt_cache["aux_ref_audio_paths"])
+            if not (len(list(paths)) == len(aux_ref_audio_paths) == len(self.prompt_cache["aux_ref_audio_paths"])):
+                self.prompt_cache["aux_ref_audio_paths"] = aux_ref_audio_paths
+                self.prompt_cache["refer_spec"] = [self.prompt_cache["refer_spec"][0]]
+                for path in aux_ref_audio_paths:
+                    if path in [None, ""]:
+                        continue
+                    if not os.path.exists(path):
+                        print(i18n("音频文件不存在，跳过："), path)
+                        continue
+                    self.prompt_cache["refer_spec"].append(self._get_ref_spec(path))
+
+            if not no_prompt_text:
+                prompt_text = prompt_text.strip("\n")
+                if prompt_text[-1] not in splits:
+                    prompt_text += "。" if prompt_lang != "en" else "."
+                print(i18n("实际输入的参考文本:"), prompt_text)
+                if self.prompt_cache["prompt_text"] != prompt_text:
+                    phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
+                        prompt_text, prompt_lang, self.configs.version
+                    )
+                    self.prompt_cache["prompt_text"] = prompt_text
+                    self.prompt_cache["prompt_lang"] = prompt_lang
+                    self.prompt_cache["phones"] = phones
+                    self.prompt_cache["bert_features"] = bert_features
+                    self.prompt_cache["norm_text"] = norm_text
 
-        if not no_prompt_text:
-            prompt_text = prompt_text.strip("\n")
-            if prompt_text[-1] not in splits:
-                prompt_text += "。" if prompt_lang != "en" else "."
-            print(i18n("实际输入的参考文本:"), prompt_text)
-            if self.prompt_cache["prompt_text"] != prompt_text:
-                phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
-                    prompt_text, prompt_lang, self.configs.version
-                )
-                self.prompt_cache["prompt_text"] = prompt_text
-                self.prompt_cache["prompt_lang"] = prompt_lang
-                self.prompt_cache["phones"] = phones
-                self.prompt_cache["bert_features"] = bert_features
-                self.prompt_cache["norm_text"] = norm_text
+            if self.configs.use_vocoder:
+                # 参考一侧的 CFM 条件每个参考只算一次, 随快照带给本次请求
+                self._get_vocoder_cond(self.prompt_cache)
+
+            prompt_cache: dict = dict(self.prompt_cache)
+            prompt_cache["refer_spec"] = list(self.prompt_cache["refer_spec"])
 
         ###### text preprocessing ########
         t1 = time.perf_counter()
@@ -1135,7 +1214,7 @@ class TTS:
             batch_index_list: list = None
             data, batch_index_list = self.to_batch(
                 data,
-                prompt_data=self.prompt_cache if not no_prompt_text else None,
+                prompt_data=prompt_cache if not no_prompt_text else None,
                 batch_size=batch_size,
                 threshold=batch_threshold,
                 split_bucket=split_bucket,
@@ -1154,10 +1233,10 @@ class TTS:
             def make_batch(batch_texts):
                 batch_data = []
                 print(f"############ {i18n('提取文本Bert特征')} ############")
-                for text in tqdm(batch_texts):
-                    phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
-                        text, text_lang, self.configs.version
-                    )
+                features = self.text_preprocessor.extract_features_batched(
+                    [(text, text_lang) for text in batch_texts], self.configs.version
+                )
+                for phones, bert_features, norm_text in features:
                     if phones is None:
                         continue
                     res = {
@@ -1170,7 +1249,7 @@ class TTS:
                     return None
                 batch, _ = self.to_batch(
                     batch_data,
-                    prompt_data=self.prompt_cache if not no_prompt_text else None,
+                    prompt_data=prompt_cache if not no_prompt_text else None,
                     batch_size=batch_size,
                     threshold=batch_threshold,
                     split_bucket=False,
@@ -1208,16 +1287,32 @@ class TTS:
                     prompt = None
                 else:
                     prompt = (
-                        self.prompt_cache["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
+                        prompt_cache["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
+                    )
+
+                if prefix_cache and not no_prompt_text:
+                    prompt_phone_len = len(prompt_cache["phones"])
+                    prefix_cache_key = (
+                        prompt_cache["ref_audio_path"],
+                        prompt_cache["prompt_text"],
+                        prompt_cache["prompt_lang"],
                     )
+                else:
+                    prompt_phone_len = 0
+                    prefix_cache_key = None
+
+                _infer_panel = infer_panel
+                if self.t2s_scheduler is not None and parallel_infer and prompt is not None and prefix_cache_key is None:
+                    _infer_panel = self.t2s_scheduler.infer_panel
 
                 print(f"############ {i18n('预测语义Token')} ############")
-                pred_semantic_list, idx_list = self.t2s_model.model.infer_panel(
+                pred_semantic_list, idx_list = _infer_panel(
                     all_phoneme_ids,
                     all_phoneme_lens,
                     prompt,
                     all_bert_features,
-                    # prompt_phone_len=ph_offset,
+                    prompt_phone_len=prompt_phone_len,
+                    prefix_cache_key=prefix_cache_key,
                     top_k=top_k,
                     top_p=top_p,
                     temperature=temperature,
@@ -1231,7 +1326,7 @@ class TTS:
                 refer_audio_spec = []
                 if self.is_v2pro:
                     sv_emb = []
-                for spec, audio_tensor in self.prompt_cache["refer_spec"]:
+                for spec, audio_tensor in prompt_cache["refer_spec"]:
                     spec = spec.to(dtype=self.precision, device=self.configs.device)
                     refer_audio_spec.append(spec)
                     if self.is_v2pro:
@@ -1300,7 +1395,13 @@ class TTS:
                     if parallel_infer:
                         print(f"{i18n('并行合成中')}...")
                         audio_fragments = self.using_vocoder_synthesis_batched_infer(
-                            idx_list, pred_semantic_list, batch_phones, speed=speed_factor, sample_steps=sample_steps
+                            idx_list,
+                            pred_semantic_list,
+                            batch_phones,
+                            speed=speed_factor,
+                            sample_steps=sample_steps,
+                            prompt_cache=prompt_cache,
+                            solver=cfm_solver,
                         )
                         batch_audio_fragment.extend(audio_fragments)
                     else:
@@ -1310,7 +1411,12 @@ class TTS:
                                 pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
                             )  # .unsqueeze(0)#mq要多unsqueeze一次
                             audio_fragment = self.using_vocoder_synthesis(
-                                _pred_semantic, phones, speed=speed_factor, sample_steps=sample_steps
+                                _pred_semantic,
+                                phones,
+                                speed=speed_factor,
+                                sample_steps=sample_steps,
+                                prompt_cache=prompt_cache,
+                                solver=cfm_solver,
                             )
                             batch_audio_fragment.append(audio_fragment)
 
@@ -1428,42 +1534,81 @@ class TTS:
 
         return sr, audio
 
-    def using_vocoder_synthesis(
-        self, semantic_tokens: torch.Tensor, phones: torch.Tensor, speed: float = 1.0, sample_steps: int = 32
-    ):
-        prompt_semantic_tokens = self.prompt_cache["prompt_semantic"].unsqueeze(0).unsqueeze(0).to(self.configs.device)
-        prompt_phones = torch.LongTensor(self.prompt_cache["phones"]).unsqueeze(0).to(self.configs.device)
-        raw_entry = self.prompt_cache["refer_spec"][0]
+    def _get_vocoder_cond(self, prompt_cache: dict):
+        """
+        v3/v4 参考音频一侧的 CFM 条件(fea_ref, ge, mel2, T_min)只取决于参考音频、参考文本和当前模型,
+        算好后存在 prompt_cache["vocoder_cond"] 里, 之后每句只需要计算目标文本一侧
+        """
+        raw_entry = prompt_cache["refer_spec"][0]
         if isinstance(raw_entry, tuple):
             raw_entry = raw_entry[0]
-        refer_audio_spec = raw_entry.to(dtype=self.precision, device=self.configs.device)
-
-        fea_ref, ge = self.vits_model.decode_encp(prompt_semantic_tokens, prompt_phones, refer_audio_spec)
-        ref_audio: torch.Tensor = self.prompt_cache["raw_audio"]
-        ref_sr = self.prompt_cache["raw_sr"]
-        ref_audio = ref_audio.to(self.configs.device).float()
-        if ref_audio.shape[0] == 2:
-            ref_audio = ref_audio.mean(0).unsqueeze(0)
-
-        # tgt_sr = self.vocoder_configs["sr"]
-        tgt_sr = 24000 if self.configs.version == "v3" else 32000
-        if ref_sr != tgt_sr:
-            ref_audio = resample(ref_audio, ref_sr, tgt_sr, self.configs.device)
-
-        mel2 = mel_fn(ref_audio) if self.configs.version == "v3" else mel_fn_v4(ref_audio)
-        mel2 = norm_spec(mel2)
-        T_min = min(mel2.shape[2], fea_ref.shape[2])
-        mel2 = mel2[:, :, :T_min]
-        fea_ref = fea_ref[:, :, :T_min]
-        T_ref = self.vocoder_configs["T_ref"]
-        T_chunk = self.vocoder_configs["T_chunk"]
-        if T_min > T_ref:
-            mel2 = mel2[:, :, -T_ref:]
-            fea_ref = fea_ref[:, :, -T_ref:]
-            T_min = T_ref
-        chunk_len = T_chunk - T_min
-
-        mel2 = mel2.to(self.precision)
+        sources = (prompt_cache["prompt_semantic"], prompt_cache["phones"], prompt_cache.get("raw_audio"), raw_entry)
+        key = (self.configs.vits_weights_path, self.precision, str(self.configs.device))
+        vocoder_cond = prompt_cache.get("vocoder_cond")
+        if (
+            vocoder_cond is not None
+            and vocoder_cond["key"] == key
+            and all(a is b for a, b in zip(vocoder_cond["sources"], sources))
+        ):
+            return vocoder_cond
+
+        with torch.no_grad():
+            prompt_semantic_tokens = prompt_cache["prompt_semantic"].unsqueeze(0).unsqueeze(0).to(self.configs.device)
+            prompt_phones = torch.LongTensor(prompt_cache["phones"]).unsqueeze(0).to(self.configs.device)
+            refer_audio_spec = raw_entry.to(dtype=self.precision, device=self.configs.device)
+
+            fea_ref, ge = self.vits_model.decode_encp(prompt_semantic_tokens, prompt_phones, refer_audio_spec)
+            ref_audio: torch.Tensor = prompt_cache["raw_audio"]
+            ref_sr = prompt_cache["raw_sr"]
+            ref_audio = ref_audio.to(self.configs.device).float()
+            if ref_audio.shape[0] == 2:
+                ref_audio = ref_audio.mean(0).unsqueeze(0)
+
+            # tgt_sr = self.vocoder_configs["sr"]
+            tgt_sr = 24000 if self.configs.version == "v3" else 32000
+            if ref_sr != tgt_sr:
+                ref_audio = resample(ref_audio, ref_sr, tgt_sr, self.configs.device)
+
+            mel2 = mel_fn(ref_audio) if self.configs.version == "v3" else mel_fn_v4(ref_audio)
+            mel2 = norm_spec(mel2)
+            T_min = min(mel2.shape[2], fea_ref.shape[2])
+            mel2 = mel2[:, :, :T_min]
+            fea_ref = fea_ref[:, :, :T_min]
+            T_ref = self.vocoder_configs["T_ref"]
+            if T_min > T_ref:
+                mel2 = mel2[:, :, -T_ref:]
+                fea_ref = fea_ref[:, :, -T_ref:]
+                T_min = T_ref
+
+            mel2 = mel2.to(self.precision)
+
+        vocoder_cond = {
+            "key": key,
+            "sources": sources,
+            "refer_audio_spec": refer_audio_spec,
+            "fea_ref": fea_ref,
+            "ge": ge,
+            "mel2": mel2,
+            "T_min": T_min,
+        }
+        prompt_cache["vocoder_cond"] = vocoder_cond
+        return vocoder_cond
+
+    def using_vocoder_synthesis(
+        self,
+        semantic_tokens: torch.Tensor,
+        phones: torch.Tensor,
+        speed: float = 1.0,
+        sample_steps: int = 32,
+        prompt_cache: dict = None,
+        solver: str = None,
+    ):
+        prompt_cache = self.prompt_cache if prompt_cache is None else prompt_cache
+        vocoder_cond = self._get_vocoder_cond(prompt_cache)
+        refer_audio_spec = vocoder_cond["refer_audio_spec"]
+        fea_ref, ge = vocoder_cond["fea_ref"], vocoder_cond["ge"]
+        mel2, T_min = vocoder_cond["mel2"], vocoder_cond["T_min"]
+        chunk_len = self.vocoder_configs["T_chunk"] - T_min
         fea_todo, ge = self.vits_model.decode_encp(semantic_tokens, phones, refer_audio_spec, ge, speed)
 
         cfm_resss = []
@@ -1476,7 +1621,12 @@ class TTS:
             fea = torch.cat([fea_ref, fea_todo_chunk], 2).transpose(2, 1)
 
             cfm_res = self.vits_model.cfm.inference(
-                fea, torch.LongTensor([fea.size(1)]).to(fea.device), mel2, sample_steps, inference_cfg_rate=0
+                fea,
+                torch.LongTensor([fea.size(1)]).to(fea.device),
+                mel2,
+                sample_steps,
+                inference_cfg_rate=0,
+                solver=solver,
             )
             cfm_res = cfm_res[:, :, mel2.shape[2] :]
 
@@ -1500,40 +1650,15 @@ class TTS:
         batch_phones: List[torch.Tensor],
         speed: float = 1.0,
         sample_steps: int = 32,
+        prompt_cache: dict = None,
+        solver: str = None,
     ) -> List[torch.Tensor]:
-        prompt_semantic_tokens = self.prompt_cache["prompt_semantic"].unsqueeze(0).unsqueeze(0).to(self.configs.device)
-        prompt_phones = torch.LongTensor(self.prompt_cache["phones"]).unsqueeze(0).to(self.configs.device)
-        raw_entry = self.prompt_cache["refer_spec"][0]
-        if isinstance(raw_entry, tuple):
-            raw_entry = raw_entry[0]
-        refer_audio_spec = raw_entry.to(dtype=self.precision, device=self.configs.device)
-
-        fea_ref, ge = self.vits_model.decode_encp(prompt_semantic_tokens, prompt_phones, refer_audio_spec)
-        ref_audio: torch.Tensor = self.prompt_cache["raw_audio"]
-        ref_sr = self.prompt_cache["raw_sr"]
-        ref_audio = ref_audio.to(self.configs.device).float()
-        if ref_audio.shape[0] == 2:
-            ref_audio = ref_audio.mean(0).unsqueeze(0)
-
-        # tgt_sr = self.vocoder_configs["sr"]
-        tgt_sr = 24000 if self.configs.version == "v3" else 32000
-        if ref_sr != tgt_sr:
-            ref_audio = resample(ref_audio, ref_sr, tgt_sr, self.configs.device)
-
-        mel2 = mel_fn(ref_audio) if self.configs.version == "v3" else mel_fn_v4(ref_audio)
-        mel2 = norm_spec(mel2)
-        T_min = min(mel2.shape[2], fea_ref.shape[2])
-        mel2 = mel2[:, :, :T_min]
-        fea_ref = fea_ref[:, :, :T_min]
-        T_ref = self.vocoder_configs["T_ref"]
-        T_chunk = self.vocoder_configs["T_chunk"]
-        if T_min > T_ref:
-            mel2 = mel2[:, :, -T_ref:]
-            fea_ref = fea_ref[:, :, -T_ref:]
-            T_min = T_ref
-        chunk_len = T_chunk - T_min
-
-        mel2 = mel2.to(self.precision)
+        prompt_cache = self.prompt_cache if prompt_cache is None else prompt_cache
+        vocoder_cond = self._get_vocoder_cond(prompt_cache)
+        refer_audio_spec = vocoder_cond["refer_audio_spec"]
+        fea_ref, ge = vocoder_cond["fea_ref"], vocoder_cond["ge"]
+        mel2, T_min = vocoder_cond["mel2"], vocoder_cond["T_min"]
+        chunk_len = self.vocoder_configs["T_chunk"] - T_min
 
         # #### batched inference
         overlapped_len = self.vocoder_configs["overlapped_len"]
@@ -1575,7 +1700,12 @@ class TTS:
         fea_ref = fea_ref.repeat(bs, 1, 1)
         fea = torch.cat([fea_ref, feat_chunks], 2).transpose(2, 1)
         pred_spec = self.vits_model.cfm.inference(
-            fea, torch.LongTensor([fea.size(1)]).to(fea.device), mel2, sample_steps, inference_cfg_rate=0
+            fea,
+            torch.LongTensor([fea.size(1)]).to(fea.device),
+            mel2,
+            sample_steps,
+            inference_cfg_rate=0,
+            solver=solver,
         )
         pred_spec = pred_spec[:, :, -chunk_len:]
         dd = pred_spec.shape[1]
@@ -2,8 +2,6 @@ import os
 import sys
 import threading
 
-from tqdm import tqdm
-
 now_dir = os.getcwd()
 sys.path.append(now_dir)
 
@@ -14,6 +12,7 @@ from text import chinese
 from typing import Dict, List, Tuple
 from text.cleaner import clean_text
 from text import cleaned_text_to_sequence
+from text.frontend_cache import frontend_cache
 from transformers import AutoModelForMaskedLM, AutoTokenizer
 from TTS_infer_pack.text_segmentation_method import split_big_text, splits, get_method as get_seg_method
 
@@ -55,6 +54,8 @@ class TextPreprocessor:
         self.tokenizer = tokenizer
         self.device = device
         self.bert_lock = threading.RLock()
+        # 批量提取 BERT 特征时每次前向的最大句段数
+        self.bert_batch_size = 16
 
     def preprocess(self, text: str, lang: str, text_split_method: str, version: str = "v2") -> List[Dict]:
         print(f"############ {i18n('切分文本')} ############")
@@ -62,8 +63,8 @@ class TextPreprocessor:
         texts = self.pre_seg_text(text, lang, text_split_method)
         result = []
         print(f"############ {i18n('提取文本Bert特征')} ############")
-        for text in tqdm(texts):
-            phones, bert_features, norm_text = self.segment_and_extract_feature_for_text(text, lang, version)
+        features = self.extract_features_batched([(text, lang) for text in texts], version)
+        for phones, bert_features, norm_text in features:
             if phones is None or norm_text == "":
                 continue
             res = {
@@ -120,88 +121,138 @@ class TextPreprocessor:
         return self.get_phones_and_bert(text, language, version)
 
     def get_phones_and_bert(self, text: str, language: str, version: str, final: bool = False):
-        with self.bert_lock:
-            text = re.sub(r' {2,}', ' ', text)
-            textlist = []
-            langlist = []
-            if language == "all_zh":
-                for tmp in LangSegmenter.getTexts(text,"zh"):
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "all_yue":
-                for tmp in LangSegmenter.getTexts(text,"zh"):
-                    if tmp["lang"] == "zh":
-                        tmp["lang"] = "yue"
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "all_ja":
-                for tmp in LangSegmenter.getTexts(text,"ja"):
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "all_ko":
-                for tmp in LangSegmenter.getTexts(text,"ko"):
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "en":
-                langlist.append("en")
-                textlist.append(text)
-            elif language == "auto":
-                for tmp in LangSegmenter.getTexts(text):
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "auto_yue":
-                for tmp in LangSegmenter.getTexts(text):
-                    if tmp["lang"] == "zh":
-                        tmp["lang"] = "yue"
+        return self.extract_features_batched([(text, language)], version)[0]
+
+    def split_by_language(self, text: str, language: str):
+        text = re.sub(r' {2,}', ' ', text)
+        textlist = []
+        langlist = []
+        if language == "all_zh":
+            for tmp in LangSegmenter.getTexts(text,"zh"):
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "all_yue":
+            for tmp in LangSegmenter.getTexts(text,"zh"):
+                if tmp["lang"] == "zh":
+                    tmp["lang"] = "yue"
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "all_ja":
+            for tmp in LangSegmenter.getTexts(text,"ja"):
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "all_ko":
+            for tmp in LangSegmenter.getTexts(text,"ko"):
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "en":
+            langlist.append("en")
+            textlist.append(text)
+        elif language == "auto":
+            for tmp in LangSegmenter.getTexts(text):
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "auto_yue":
+            for tmp in LangSegmenter.getTexts(text):
+                if tmp["lang"] == "zh":
+                    tmp["lang"] = "yue"
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        else:
+            for tmp in LangSegmenter.getTexts(text):
+                if langlist:
+                    if (tmp["lang"] == "en" and langlist[-1] == "en") or (tmp["lang"] != "en" and langlist[-1] != "en"):
+                        textlist[-1] += tmp["text"]
+                        continue
+                if tmp["lang"] == "en":
                     langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            else:
-                for tmp in LangSegmenter.getTexts(text):
-                    if langlist:
-                        if (tmp["lang"] == "en" and langlist[-1] == "en") or (tmp["lang"] != "en" and langlist[-1] != "en"):
-                            textlist[-1] += tmp["text"]
-                            continue
-                    if tmp["lang"] == "en":
-                        langlist.append(tmp["lang"])
+                else:
+                    # 因无法区别中日韩文汉字,以用户输入为准
+                    langlist.append(language)
+                textlist.append(tmp["text"])
+        return textlist, langlist
+
+    def get_phones(self, text: str, language: str, version: str, final: bool = False):
+        """
+        文本前端(不含BERT): 按语种切分并转音素, 返回 [(phones, word2ph, norm_text, lang), ...]
+        """
+        textlist, langlist = self.split_by_language(text, language)
+        segments = []
+        for i in range(len(textlist)):
+            lang = langlist[i].replace("all_", "")
+            phones, word2ph, norm_text = self.clean_text_inf(textlist[i], lang, version)
+            segments.append((phones, word2ph, norm_text, lang))
+
+        if not final and sum(len(segment[0]) for segment in segments) < 6:
+            return self.get_phones("." + text, language, version, final=True)
+        return segments
+
+    def extract_features_batched(
+        self, items: List[Tuple[str, str]], version: str
+    ) -> List[Tuple[list, torch.Tensor, str]]:
+        """
+        对多条 (text, language) 提取 phones / BERT 特征 / norm_text。
+        命中 frontend_cache 的直接返回, 其余的中文句段合并成 padding 后的 batch 一次前向, 其他语种补零特征。
+        """
+        bert_name = getattr(self.bert_model, "name_or_path", "")
+        keys = [frontend_cache.make_key(text, language, version, bert_name) for text, language in items]
+        results = [None] * len(items)
+        for i, key in enumerate(keys):
+            cached = frontend_cache.get(key)
+            if cached is not None:
+                results[i] = (cached["phones"], cached["bert"].to(self.device).float(), cached["norm_text"])
+        todo = [i for i in range(len(items)) if results[i] is None]
+        if len(todo) == 0:
+            return results
+
+        with self.bert_lock:
+            all_segments = [self.get_phones(items[i][0], items[i][1], version) for i in todo]
+
+            zh_segments = [
+                (norm_text, word2ph)
+                for segments in all_segments
+                for phones, word2ph, norm_text, lang in segments
+                if lang == "zh"
+            ]
+            zh_features = iter(self.get_bert_feature_batched(zh_segments))
+
+            for i, segments in zip(todo, all_segments):
+                bert_list = []
+                for phones, word2ph, norm_text, lang in segments:
+                    if lang == "zh":
+                        bert_list.append(next(zh_features).to(self.device))
                     else:
-                        # 因无法区别中日韩文汉字,以用户输入为准
-                        langlist.append(language)
-                    textlist.append(tmp["text"])
-            # print(textlist)
-            # print(langlist)
-            phones_list = []
-            bert_list = []
-            norm_text_list = []
-            for i in range(len(textlist)):
-                lang = langlist[i]
-                phones, word2ph, norm_text = self.clean_text_inf(textlist[i], lang, version)
-                bert = self.get_bert_inf(phones, word2ph, norm_text, lang)
-                phones_list.append(phones)
-                norm_text_list.append(norm_text)
-                bert_list.append(bert)
-            bert = torch.cat(bert_list, dim=1)
-            phones = sum(phones_list, [])
-            norm_text = "".join(norm_text_list)
-
-            if not final and len(phones) < 6:
-                return self.get_phones_and_bert("." + text, language, version, final=True)
-
-            return phones, bert, norm_text
-
-    def get_bert_feature(self, text: str, word2ph: list) -> torch.Tensor:
-        with torch.no_grad():
-            inputs = self.tokenizer(text, return_tensors="pt")
-            for i in inputs:
-                inputs[i] = inputs[i].to(self.device)
-            res = self.bert_model(**inputs, output_hidden_states=True)
-            res = torch.cat(res["hidden_states"][-3:-2], -1)[0].cpu()[1:-1]
-        assert len(word2ph) == len(text)
-        phone_level_feature = []
-        for i in range(len(word2ph)):
-            repeat_feature = res[i].repeat(word2ph[i], 1)
-            phone_level_feature.append(repeat_feature)
-        phone_level_feature = torch.cat(phone_level_feature, dim=0)
-        return phone_level_feature.T
+                        bert_list.append(torch.zeros((1024, len(phones)), dtype=torch.float32).to(self.device))
+                bert = torch.cat(bert_list, dim=1)
+                phones = sum([segment[0] for segment in segments], [])
+                norm_text = "".join([segment[2] for segment in segments])
+                results[i] = (phones, bert, norm_text)
+                frontend_cache.put(keys[i], phones, [segment[1] for segment in segments], norm_text, bert)
+            return results
+
+    def get_bert_feature_batched(self, segments: List[Tuple[str, list]]) -> List[torch.Tensor]:
+        """
+        segments: [(norm_text, word2ph), ...], 按长度排序后分批做一次 padding 前向,
+        再用 repeat_interleave 展开到音素级, 返回与输入同序的 [1024, n_phones] 特征
+        """
+        features = [None] * len(segments)
+        order = sorted(range(len(segments)), key=lambda i: len(segments[i][0]))
+        for start in range(0, len(order), self.bert_batch_size):
+            batch_idx = order[start : start + self.bert_batch_size]
+            texts = [segments[i][0] for i in batch_idx]
+            with torch.no_grad():
+                inputs = self.tokenizer(texts, return_tensors="pt", padding=True)
+                token_lens = inputs["attention_mask"].sum(dim=1).tolist()
+                for key in inputs:
+                    inputs[key] = inputs[key].to(self.device)
+                res = self.bert_model(**inputs, output_hidden_states=True)
+                res = torch.cat(res["hidden_states"][-3:-2], -1).cpu()
+            for row, i in enumerate(batch_idx):
+                text, word2ph = segments[i]
+                assert len(word2ph) == len(text)
+                char_feature = res[row, 1 : token_lens[row] - 1][: len(word2ph)]
+                features[i] = char_feature.repeat_interleave(torch.tensor(word2ph), dim=0).T
+        return features
 
     def clean_text_inf(self, text: str, language: str, version: str = "v2"):
         language = language.replace("all_", "")
@@ -212,7 +263,7 @@ class TextPreprocessor:
     def get_bert_inf(self, phones: list, word2ph: list, norm_text: str, language: str):
         language = language.replace("all_", "")
         if language == "zh":
-            feature = self.get_bert_feature(norm_text, word2ph).to(self.device)
+            feature = self.get_bert_feature_batched([(norm_text, word2ph)])[0].to(self.device)
         else:
             feature = torch.zeros(
                 (1024, len(phones)),
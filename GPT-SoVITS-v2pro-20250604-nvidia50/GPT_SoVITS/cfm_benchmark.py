@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+v3/v4 CFM 采样器基准: 固定随机种子, 同一段参考音频和文本在不同 solver / 步数下各合成一遍,
+以 euler 32 步为基线计算输出音频的 log-mel L1 距离, 并统计 CFM 耗时(总耗时 / 每次 estimator 调用)。
+最后按质量预算(--budget)给出每个 solver 满足预算的最少步数, 以及其中 CFM 耗时最短的配置。
+
+在项目根目录执行(默认使用 tts_infer.yaml 里的设备, CPU 节点上即可测 CPU 延迟):
+    python GPT_SoVITS/cfm_benchmark.py -r ref.wav -pt "参考文本" -pl zh -t "要合成的文本" -tl zh
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+now_dir = os.getcwd()
+sys.path.append(now_dir)
+sys.path.append("%s/GPT_SoVITS" % (now_dir))
+
+import numpy as np
+import torch
+
+from module.models import CFM_SOLVERS
+from TTS_infer_pack.TTS import TTS, TTS_Config, mel_fn, mel_fn_v4, resample
+
+# 每一步调用 estimator 的次数(不含 cfg)
+SOLVER_NFE = {"euler": 1, "midpoint": 2, "heun": 2, "multistep": 1}
+BASELINE = ("euler", 32)
+
+
+def nfe(solver, steps):
+    return steps * SOLVER_NFE[solver] - (1 if solver == "heun" else 0)
+
+
+class CFMTimer:
+    """
+    包一层 cfm.inference, 累计一次合成里所有 CFM 调用的耗时
+    """
+
+    def __init__(self, cfm, device):
+        self.cfm = cfm
+        self.device = device
+        self.inference = cfm.inference
+        self.elapsed = 0.0
+        cfm.inference = self
+
+    def __call__(self, *args, **kwargs):
+        if "cuda" in str(self.device):
+            torch.cuda.synchronize()
+        t0 = time.perf_counter()
+        res = self.inference(*args, **kwargs)
+        if "cuda" in str(self.device):
+            torch.cuda.synchronize()
+        self.elapsed += time.perf_counter() - t0
+        return res
+
+
+def synthesize(tts, inputs, solver, steps):
+    inputs = dict(inputs, cfm_solver=solver, sample_steps=steps)
+    sr, audio = None, []
+    for sr, fragment in tts.run(inputs):
+        audio.append(fragment)
+    return sr, np.concatenate(audio).astype(np.float32) / 32768
+
+
+def log_mel(tts, audio, sr):
+    version = tts.configs.version
+    tgt_sr = 24000 if version == "v3" else 32000
+    audio = torch.from_numpy(audio).unsqueeze(0).to(tts.configs.device)
+    if sr != tgt_sr:
+        audio = resample(audio, sr, tgt_sr, tts.configs.device)
+    return (mel_fn(audio) if version == "v3" else mel_fn_v4(audio))[0]
+
+
+def mel_distance(mel, mel_ref):
+    T = min(mel.shape[-1], mel_ref.shape[-1])
+    return (mel[:, :T] - mel_ref[:, :T]).abs().mean().item()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPT-SoVITS v3/v4 CFM solver benchmark")
+    parser.add_argument("-c", "--tts_config", type=str, default="GPT_SoVITS/configs/tts_infer.yaml")
+    parser.add_argument("-r", "--ref_audio_path", type=str, required=True)
+    parser.add_argument("-pt", "--prompt_text", type=str, required=True)
+    parser.add_argument("-pl", "--prompt_lang", type=str, default="zh")
+    parser.add_argument("-t", "--text", type=str, required=True, help="多句用换行分隔")
+    parser.add_argument("-tl", "--text_lang", type=str, default="zh")
+    parser.add_argument("-s", "--solvers", type=str, default=",".join(CFM_SOLVERS))
+    parser.add_argument("-n", "--steps", type=str, default="4,8,16,32")
+    parser.add_argument("--budget", type=float, default=0.1, help="相对基线可接受的 log-mel L1 距离")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--repeat", type=int, default=1, help="每个配置重复次数, 耗时取最小值")
+    parser.add_argument("-o", "--output", type=str, default="", help="结果另存为 json")
+    args = parser.parse_args()
+
+    tts = TTS(TTS_Config(args.tts_config))
+    if tts.configs.version not in {"v3", "v4"}:
+        raise ValueError("CFM 只在 v3/v4 模型中使用, 当前版本: %s" % tts.configs.version)
+    timer = CFMTimer(tts.vits_model.cfm, tts.configs.device)
+    inputs = {
+        "text": args.text,
+        "text_lang": args.text_lang,
+        "ref_audio_path": args.ref_audio_path,
+        "prompt_text": args.prompt_text,
+        "prompt_lang": args.prompt_lang,
+        "text_split_method": "cut0",
+        "seed": args.seed,  # 固定种子: T2S 结果和 CFM 初始噪声在各配置之间相同
+        "parallel_infer": False,
+    }
+
+    synthesize(tts, inputs, *BASELINE)  # 预热, 参考音频一侧的特征也在这里缓存好
+    sr, audio_ref = synthesize(tts, inputs, *BASELINE)
+    mel_ref = log_mel(tts, audio_ref, sr)
+
+    solvers = [solver for solver in args.solvers.split(",") if solver]
+    steps_list = sorted(int(steps) for steps in args.steps.split(",") if steps)
+    results = []
+    print("%-10s %6s %5s %10s %10s %12s" % ("solver", "steps", "nfe", "distance", "cfm_ms", "ms_per_nfe"))
+    for solver in solvers:
+        for steps in steps_list:
+            elapsed = []
+            for _ in range(args.repeat):
+                timer.elapsed = 0.0
+                sr, audio = synthesize(tts, inputs, solver, steps)
+                elapsed.append(timer.elapsed)
+            result = {
+                "solver": solver,
+                "steps": steps,
+                "nfe": nfe(solver, steps),
+                "distance": mel_distance(log_mel(tts, audio, sr), mel_ref),
+                "cfm_ms": min(elapsed) * 1000,
+            }
+            result["ms_per_nfe"] = result["cfm_ms"] / result["nfe"]
+            results.append(result)
+            print("%-10s %6d %5d %10.4f %10.1f %12.2f" % tuple(result[k] for k in result))
+
+    print("\n预算: log-mel L1 <= %s (基线 %s %s 步)" % (args.budget, *BASELINE))
+    passed = [result for result in results if result["distance"] <= args.budget]
+    for solver in solvers:
+        steps = [result["steps"] for result in passed if result["solver"] == solver]
+        print("%-10s %s" % (solver, ("最少 %d 步" % min(steps)) if steps else "没有满足预算的步数"))
+    best = min(passed, key=lambda result: result["cfm_ms"]) if passed else None
+    if best is not None:
+        print("推荐: cfm_solver=%s, sample_steps=%d (CFM %.1f ms)" % (best["solver"], best["steps"], best["cfm_ms"]))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            json.dump({"budget": args.budget, "results": results, "best": best}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+训练特征打包存储: 3-bert / 4-cnhubert / 7-sv_cn 目录下原本每条音频一个 .pt,
+改为若干个连续的 fp16 分片(part{i_part}-{k}.bin) + 偏移索引(index-{i_part}.json), 读取时 memmap 零拷贝。
+存储精度可按目录指定(如谱缓存用 fp32), 索引里记录每条的存储 dtype。
+目录里残留的 .pt 仍可读取, 新旧格式可以混用。
+
+打包已有实验的特征:
+    python GPT_SoVITS/feature_store.py logs/xxx/4-cnhubert [--remove]
+"""
+
+import glob
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+import torch
+
+STORE_DTYPE = np.float16
+
+
+class FeatureStoreWriter:
+    """
+    单个 prepare 进程的写入端, 每个进程(i_part)写自己的分片和索引, 互不冲突
+    """
+
+    def __init__(self, store_dir, part="0", shard_size=1 << 30, flush_every=100, dtype=STORE_DTYPE):
+        self.store_dir = store_dir
+        self.dtype = np.dtype(dtype)
+        self.part = str(part)
+        self.shard_size = shard_size
+        self.flush_every = flush_every
+        self.index_path = os.path.join(store_dir, "index-%s.json" % self.part)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf8") as f:
+                self.index = json.load(f)
+        # 续跑时总是开一个新分片, 已有分片保持只读
+        self.shard_id = len(glob.glob(os.path.join(store_dir, "part%s-*.bin" % self.part)))
+        self.lock = threading.Lock()
+        self.file = None
+        self.shard_name = None
+        self.offset = 0
+        self.pending = 0
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def add(self, name, fea):
+        arr = np.ascontiguousarray(fea.detach().cpu().float().numpy().astype(self.dtype))
+        with self.lock:
+            if self.file is None or (self.offset > 0 and self.offset + arr.nbytes > self.shard_size):
+                self._next_shard()
+            self.file.write(arr.tobytes())
+            self.index[name] = [self.shard_name, self.offset, list(arr.shape), str(fea.dtype), self.dtype.name]
+            self.offset += arr.nbytes
+            self.pending += 1
+            if self.pending >= self.flush_every:
+                self._flush()
+
+    def _next_shard(self):
+        if self.file is not None:
+            self._flush()
+            self.file.close()
+        self.shard_name = "part%s-%03d.bin" % (self.part, self.shard_id)
+        self.shard_id += 1
+        self.file = open(os.path.join(self.store_dir, self.shard_name), "wb")
+        self.offset = 0
+
+    def _flush(self):
+        # 先落分片再写索引, 中途被打断时索引只指向已写完的数据
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        tmp_path = "%s.tmp" % self.index_path
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+        self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class FeatureStore:
+    """
+    读取端, 合并目录下所有 index-*.json; 不在索引里的名字回退到 <name>.pt
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.index = {}
+        for index_path in sorted(glob.glob(os.path.join(store_dir, "index-*.json"))):
+            with open(index_path, "r", encoding="utf8") as f:
+                self.index.update(json.load(f))
+        self.shards = {}
+
+    def __getstate__(self):
+        # DataLoader 以 spawn 启动 worker 时不要把 memmap 一起序列化
+        state = self.__dict__.copy()
+        state["shards"] = {}
+        return state
+
+    def names(self):
+        names = set(self.index)
+        for name in os.listdir(self.store_dir):
+            if name.endswith(".pt"):
+                names.add(name[:-3])  # 去除.pt后缀
+        return names
+
+    def __contains__(self, name):
+        return name in self.index or os.path.exists("%s/%s.pt" % (self.store_dir, name))
+
+    def _shard(self, shard_name):
+        if shard_name not in self.shards:
+            # copy-on-write 映射: 各 worker 共享 page cache, 得到的张量可写但不会改到文件
+            self.shards[shard_name] = np.memmap(os.path.join(self.store_dir, shard_name), dtype=np.uint8, mode="c")
+        return self.shards[shard_name]
+
+    def load(self, name):
+        if name not in self.index:
+            return torch.load("%s/%s.pt" % (self.store_dir, name), map_location="cpu")
+        shard_name, offset, shape, dtype = self.index[name][:4]
+        # 旧索引没有第 5 项, 都是按 fp16 存的
+        store_dtype = self.index[name][4] if len(self.index[name]) > 4 else STORE_DTYPE
+        arr = np.ndarray(shape, dtype=store_dtype, buffer=self._shard(shard_name), offset=offset)
+        fea = torch.from_numpy(arr)
+        # 存储精度与原 dtype 不同时(如 fp16 存储的 fp32 BERT)读出时转回原 dtype
+        if str(fea.dtype) != dtype:
+            fea = fea.to(getattr(torch, dtype[len("torch.") :]))
+        return fea
+
+
+def pack(store_dir, remove=False):
+    writer = FeatureStoreWriter(store_dir, part="packed")
+    names = [name[:-3] for name in sorted(os.listdir(store_dir)) if name.endswith(".pt")]
+    for name in names:
+        if name not in writer:
+            writer.add(name, torch.load("%s/%s.pt" % (store_dir, name), map_location="cpu"))
+    writer.close()
+    if remove:
+        for name in names:
+            os.remove("%s/%s.pt" % (store_dir, name))
+    print("packed %s features into %s" % (len(names), store_dir))
+
+
+if __name__ == "__main__":
+    pack(sys.argv[1], remove="--remove" in sys.argv[2:])
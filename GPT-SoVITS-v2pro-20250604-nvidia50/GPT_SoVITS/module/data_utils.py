@@ -1,3 +1,4 @@
+import math
 import os
 import random
 import traceback
@@ -8,11 +9,27 @@ from tqdm import tqdm
 from module.mel_processing import spectrogram_torch, spec_to_mel_torch
 from text import cleaned_text_to_sequence
 import torch.nn.functional as F
+import numpy as np
+from scipy.io import wavfile
 from tools.my_utils import load_audio
+from feature_store import FeatureStore
+from module.spec_cache import SpecCache, get_spec_params
 
 version = os.environ.get("version", None)
 
 
+def load_wav(filename, sampling_rate):
+    # 5-wav32k 是 prepare 阶段写出的 32k int16 单声道 wav, 直接 mmap 读取, 省掉每个 epoch 的 ffmpeg 子进程
+    if sampling_rate == 32000:
+        try:
+            sr, data = wavfile.read(filename, mmap=True)
+        except ValueError:
+            sr = None
+        if sr == 32000 and data.dtype == np.int16 and data.ndim == 1:
+            return data.astype(np.float32) / 32768
+    return load_audio(filename, sampling_rate)
+
+
 # ZeroDivisionError fixed by Tybost (https://github.com/RVC-Boss/GPT-SoVITS/issues/79)
 class TextAudioSpeakerLoader(torch.utils.data.Dataset):
     """
@@ -33,10 +50,12 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
         if self.is_v2Pro:
             self.path7 = "%s/7-sv_cn" % exp_dir
             assert os.path.exists(self.path7)
-        names4 = set([name[:-3] for name in list(os.listdir(self.path4))])  # 去除.pt后缀
+        self.store4 = FeatureStore(self.path4)
+        names4 = self.store4.names()
         names5 = set(os.listdir(self.path5))
         if self.is_v2Pro:
-            names6 = set([name[:-3] for name in list(os.listdir(self.path7))])  # 去除.pt后缀
+            self.store7 = FeatureStore(self.path7)
+            names6 = self.store7.names()
         self.phoneme_data = {}
         with open(self.path2, "r", encoding="utf8") as f:
             lines = f.read().strip("\n").split("\n")
@@ -105,6 +124,7 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
         assert len(audiopaths_sid_text_new) > 1  # 至少能凑够batch size，这里todo
         self.audiopaths_sid_text = audiopaths_sid_text_new
         self.lengths = lengths
+        self.spec_cache = SpecCache(exp_dir, get_spec_params(self))
 
     def get_audio_text_speaker_pair(self, audiopath_sid_text):
         audiopath, phoneme_ids = audiopath_sid_text
@@ -112,13 +132,13 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
         try:
             spec, wav = self.get_audio("%s/%s" % (self.path5, audiopath))
             with torch.no_grad():
-                ssl = torch.load("%s/%s.pt" % (self.path4, audiopath), map_location="cpu")
+                ssl = self.store4.load(audiopath)
                 if ssl.shape[-1] != spec.shape[-1]:
                     typee = ssl.dtype
                     ssl = F.pad(ssl.float(), (0, 1), mode="replicate").to(typee)
                 ssl.requires_grad = False
                 if self.is_v2Pro:
-                    sv_emb = torch.load("%s/%s.pt" % (self.path7, audiopath), map_location="cpu")
+                    sv_emb = self.store7.load(audiopath)
         except:
             traceback.print_exc()
             spec = torch.zeros(1025, 100)
@@ -134,10 +154,13 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
             return (ssl, spec, wav, text)
 
     def get_audio(self, filename):
-        audio_array = load_audio(filename, self.sampling_rate)  # load_audio的方法是已经归一化到-1~1之间的，不用再/32768
+        audio_array = load_wav(filename, self.sampling_rate)  # load_audio的方法是已经归一化到-1~1之间的，不用再/32768
         audio = torch.FloatTensor(audio_array)  # /32768
         audio_norm = audio
         audio_norm = audio_norm.unsqueeze(0)
+        cached = self.spec_cache.load(filename)
+        if cached is not None:
+            return cached[0], audio_norm
         spec = spectrogram_torch(
             audio_norm, self.filter_length, self.sampling_rate, self.hop_length, self.win_length, center=False
         )
@@ -291,7 +314,8 @@ class TextAudioSpeakerLoaderV3(torch.utils.data.Dataset):
         assert os.path.exists(self.path2)
         assert os.path.exists(self.path4)
         assert os.path.exists(self.path5)
-        names4 = set([name[:-3] for name in list(os.listdir(self.path4))])  # 去除.pt后缀
+        self.store4 = FeatureStore(self.path4)
+        names4 = self.store4.names()
         names5 = set(os.listdir(self.path5))
         self.phoneme_data = {}
         with open(self.path2, "r", encoding="utf8") as f:
@@ -368,6 +392,7 @@ class TextAudioSpeakerLoaderV3(torch.utils.data.Dataset):
         self.sampling_rate_mel = 24000
         self.mel_fmin = 0
         self.mel_fmax = None
+        self.spec_cache = SpecCache(exp_dir, get_spec_params(self))
 
     def norm_spec(self, x):
         return (x - self.spec_min) / (self.spec_max - self.spec_min) * 2 - 1
@@ -378,7 +403,7 @@ class TextAudioSpeakerLoaderV3(torch.utils.data.Dataset):
         try:
             spec, mel = self.get_audio("%s/%s" % (self.path5, audiopath))
             with torch.no_grad():
-                ssl = torch.load("%s/%s.pt" % (self.path4, audiopath), map_location="cpu")
+                ssl = self.store4.load(audiopath)
                 if ssl.shape[-1] != spec.shape[-1]:
                     typee = ssl.dtype
                     ssl = F.pad(ssl.float(), (0, 1), mode="replicate").to(typee)
@@ -394,7 +419,10 @@ class TextAudioSpeakerLoaderV3(torch.utils.data.Dataset):
         return (ssl, spec, mel, text)
 
     def get_audio(self, filename):
-        audio_array = load_audio(filename, self.sampling_rate)  # load_audio的方法是已经归一化到-1~1之间的，不用再/32768
+        cached = self.spec_cache.load(filename)
+        if cached is not None:
+            return cached
+        audio_array = load_wav(filename, self.sampling_rate)  # load_audio的方法是已经归一化到-1~1之间的，不用再/32768
         audio = torch.FloatTensor(audio_array)  # /32768
         audio_norm = audio
         audio_norm = audio_norm.unsqueeze(0)
@@ -529,7 +557,8 @@ class TextAudioSpeakerLoaderV4(torch.utils.data.Dataset):
         assert os.path.exists(self.path2)
         assert os.path.exists(self.path4)
         assert os.path.exists(self.path5)
-        names4 = set([name[:-3] for name in list(os.listdir(self.path4))])  # 去除.pt后缀
+        self.store4 = FeatureStore(self.path4)
+        names4 = self.store4.names()
         names5 = set(os.listdir(self.path5))
         self.phoneme_data = {}
         with open(self.path2, "r", encoding="utf8") as f:
@@ -606,6 +635,7 @@ class TextAudioSpeakerLoaderV4(torch.utils.data.Dataset):
         self.sampling_rate_mel = 32000
         self.mel_fmin = 0
         self.mel_fmax = None
+        self.spec_cache = SpecCache(exp_dir, get_spec_params(self))
 
     def norm_spec(self, x):
         return (x - self.spec_min) / (self.spec_max - self.spec_min) * 2 - 1
@@ -616,7 +646,7 @@ class TextAudioSpeakerLoaderV4(torch.utils.data.Dataset):
         try:
             spec, mel = self.get_audio("%s/%s" % (self.path5, audiopath))
             with torch.no_grad():
-                ssl = torch.load("%s/%s.pt" % (self.path4, audiopath), map_location="cpu")
+                ssl = self.store4.load(audiopath)
                 if ssl.shape[-1] != spec.shape[-1]:
                     typee = ssl.dtype
                     ssl = F.pad(ssl.float(), (0, 1), mode="replicate").to(typee)
@@ -632,7 +662,10 @@ class TextAudioSpeakerLoaderV4(torch.utils.data.Dataset):
         return (ssl, spec, mel, text)
 
     def get_audio(self, filename):
-        audio_array = load_audio(filename, self.sampling_rate)  # load_audio的方法是已经归一化到-1~1之间的，不用再/32768
+        cached = self.spec_cache.load(filename)
+        if cached is not None:
+            return cached
+        audio_array = load_wav(filename, self.sampling_rate)  # load_audio的方法是已经归一化到-1~1之间的，不用再/32768
         audio = torch.FloatTensor(audio_array)  # /32768
         audio_norm = audio
         audio_norm = audio_norm.unsqueeze(0)
@@ -740,7 +773,8 @@ class TextAudioSpeakerLoaderV3b(torch.utils.data.Dataset):
         assert os.path.exists(self.path2)
         assert os.path.exists(self.path4)
         assert os.path.exists(self.path5)
-        names4 = set([name[:-3] for name in list(os.listdir(self.path4))])  # 去除.pt后缀
+        self.store4 = FeatureStore(self.path4)
+        names4 = self.store4.names()
         names5 = set(os.listdir(self.path5))
         self.phoneme_data = {}
         with open(self.path2, "r", encoding="utf8") as f:
@@ -817,6 +851,7 @@ class TextAudioSpeakerLoaderV3b(torch.utils.data.Dataset):
         self.sampling_rate_mel = 24000
         self.mel_fmin = 0
         self.mel_fmax = None
+        self.spec_cache = SpecCache(exp_dir, get_spec_params(self))
 
     def norm_spec(self, x):
         return (x - self.spec_min) / (self.spec_max - self.spec_min) * 2 - 1
@@ -827,7 +862,7 @@ class TextAudioSpeakerLoaderV3b(torch.utils.data.Dataset):
         try:
             spec, mel, wav = self.get_audio("%s/%s" % (self.path5, audiopath))
             with torch.no_grad():
-                ssl = torch.load("%s/%s.pt" % (self.path4, audiopath), map_location="cpu")
+                ssl = self.store4.load(audiopath)
                 if ssl.shape[-1] != spec.shape[-1]:
                     typee = ssl.dtype
                     ssl = F.pad(ssl.float(), (0, 1), mode="replicate").to(typee)
@@ -843,10 +878,13 @@ class TextAudioSpeakerLoaderV3b(torch.utils.data.Dataset):
         return (ssl, spec, wav, mel, text)
 
     def get_audio(self, filename):
-        audio_array = load_audio(filename, self.sampling_rate)  # load_audio的方法是已经归一化到-1~1之间的，不用再/32768
+        audio_array = load_wav(filename, self.sampling_rate)  # load_audio的方法是已经归一化到-1~1之间的，不用再/32768
         audio = torch.FloatTensor(audio_array)  # /32768
         audio_norm = audio
         audio_norm = audio_norm.unsqueeze(0)
+        cached = self.spec_cache.load(filename)
+        if cached is not None:
+            return cached[0], cached[1], audio_norm
         audio_array24 = load_audio(
             filename, 24000
         )  # load_audio的方法是已经归一化到-1~1之间的，不用再/32768######这里可以用GPU重采样加速
@@ -981,17 +1019,24 @@ class DistributedBucketSampler(torch.utils.data.distributed.DistributedSampler):
 
     It removes samples which are not included in the boundaries.
     Ex) boundaries = [b1, b2, b3] -> any x s.t. length(x) <= b1 or length(x) > b3 are discarded.
+
+    max_frames 不为空时改为按帧数预算组 batch: 每个 batch 的 条数 x 最长谱帧数 不超过 max_frames(batch_size 不再起作用),
+    短音频的 batch 自动变大, 长音频的自动变小; 桶内按长度排序后装箱, batch 在所有桶之间打乱, 各卡分到的 batch 数相同。
     """
 
-    def __init__(self, dataset, batch_size, boundaries, num_replicas=None, rank=None, shuffle=True):
+    def __init__(self, dataset, batch_size, boundaries, num_replicas=None, rank=None, shuffle=True, max_frames=None):
         super().__init__(dataset, num_replicas=num_replicas, rank=rank, shuffle=shuffle)
         self.lengths = dataset.lengths
         self.batch_size = batch_size
         self.boundaries = boundaries
+        self.max_frames = max_frames
 
         self.buckets, self.num_samples_per_bucket = self._create_buckets()
         self.total_size = sum(self.num_samples_per_bucket)
         self.num_samples = self.total_size // self.num_replicas
+        if self.max_frames:
+            # 装箱只取决于排好序的长度序列, 每个 epoch 的 batch 数不变
+            self.num_batches = math.ceil(len(self._pack_by_frames(self.buckets)) / self.num_replicas)
 
     def _create_buckets(self):
         buckets = [[] for _ in range(len(self.boundaries) - 1)]
@@ -1019,6 +1064,8 @@ class DistributedBucketSampler(torch.utils.data.distributed.DistributedSampler):
     def __iter__(self):
         g = torch.Generator()
         g.manual_seed(self.epoch)
+        if self.max_frames:
+            return self._iter_by_frames(g)
 
         indices = []
         if self.shuffle:
@@ -1052,6 +1099,33 @@ class DistributedBucketSampler(torch.utils.data.distributed.DistributedSampler):
         assert len(self.batches) * self.batch_size == self.num_samples
         return iter(self.batches)
 
+    def _pack_by_frames(self, buckets):
+        batches = []
+        for bucket in buckets:
+            batch = []
+            # sorted 是稳定排序, 同长度样本保持传入(已打乱)的顺序
+            for idx in sorted(bucket, key=lambda idx: self.lengths[idx]):
+                if batch and (len(batch) + 1) * self.lengths[idx] > self.max_frames:
+                    batches.append(batch)
+                    batch = []
+                batch.append(idx)
+            if batch:
+                batches.append(batch)
+        return batches
+
+    def _iter_by_frames(self, g):
+        buckets = self.buckets
+        if self.shuffle:
+            buckets = [[bucket[i] for i in torch.randperm(len(bucket), generator=g).tolist()] for bucket in buckets]
+        batches = self._pack_by_frames(buckets)
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches), generator=g).tolist()]
+        # 重复开头的 batch 补齐到卡数的整数倍, 保证各卡步数一致
+        total_batches = self.num_batches * self.num_replicas
+        batches = (batches * math.ceil(total_batches / len(batches)))[:total_batches]
+        self.batches = batches[self.rank :: self.num_replicas]
+        return iter(self.batches)
+
     def _bisect(self, x, lo=0, hi=None):
         if hi is None:
             hi = len(self.boundaries) - 1
@@ -1068,4 +1142,6 @@ class DistributedBucketSampler(torch.utils.data.distributed.DistributedSampler):
             return -1
 
     def __len__(self):
+        if self.max_frames:
+            return self.num_batches
         return self.num_samples // self.batch_size
@@ -1010,6 +1010,9 @@ class SynthesizerTrn(nn.Module):
         return codes.transpose(0, 1)
 
 
+CFM_SOLVERS = ["euler", "midpoint", "heun", "multistep"]
+
+
 class CFM(torch.nn.Module):
     def __init__(self, in_channels, dit):
         super().__init__()
@@ -1023,9 +1026,22 @@ class CFM(torch.nn.Module):
 
         self.use_conditioner_cache = True
 
+        self.solver = "euler"
+
     @torch.inference_mode()
-    def inference(self, mu, x_lens, prompt, n_timesteps, temperature=1.0, inference_cfg_rate=0):
-        """Forward diffusion"""
+    def inference(self, mu, x_lens, prompt, n_timesteps, temperature=1.0, inference_cfg_rate=0, solver=None):
+        """Forward diffusion
+
+        solver(默认取 self.solver):
+            euler      每步 1 次 estimator, 与原实现一致
+            midpoint   二阶中点法, 每步 2 次
+            heun       二阶 Heun 法, 每步 2 次(最后一步退化为 euler)
+            multistep  二阶 Adams-Bashforth 多步法, 复用上一步的速度, 每步 1 次
+        模型以步长 d 为条件(shortcut), 同一步内的各次估计都以该步步长 d 为条件
+        """
+        solver = solver or self.solver
+        if solver not in CFM_SOLVERS:
+            raise ValueError("unknown CFM solver: %s, choose from %s" % (solver, CFM_SOLVERS))
         B, T = mu.size(0), mu.size(1)
         x = torch.randn([B, self.in_channels, T], device=mu.device, dtype=mu.dtype) * temperature
         prompt_len = prompt.size(-1)
@@ -1035,11 +1051,10 @@ class CFM(torch.nn.Module):
         mu = mu.transpose(2, 1)
         t = 0
         d = 1 / n_timesteps
-        text_cache = None
-        text_cfg_cache = None
-        dt_cache = None
+        cache = {"text": None, "text_cfg": None, "dt": None}
         d_tensor = torch.ones(x.shape[0], device=x.device, dtype=mu.dtype) * d
-        for j in range(n_timesteps):
+
+        def velocity(x, t):
             t_tensor = torch.ones(x.shape[0], device=x.device, dtype=mu.dtype) * t
             # v_pred = model(x, t_tensor, d_tensor, **extra_args)
             v_pred, text_emb, dt = self.estimator(
@@ -1053,13 +1068,13 @@ class CFM(torch.nn.Module):
                 drop_audio_cond=False,
                 drop_text=False,
                 infer=True,
-                text_cache=text_cache,
-                dt_cache=dt_cache,
+                text_cache=cache["text"],
+                dt_cache=cache["dt"],
             )
             v_pred = v_pred.transpose(2, 1)
             if self.use_conditioner_cache:
-                text_cache = text_emb
-                dt_cache = dt
+                cache["text"] = text_emb
+                cache["dt"] = dt
             if inference_cfg_rate > 1e-5:
                 neg, text_cfg_emb, _ = self.estimator(
                     x,
@@ -1072,13 +1087,30 @@ class CFM(torch.nn.Module):
                     drop_audio_cond=True,
                     drop_text=True,
                     infer=True,
-                    text_cache=text_cfg_cache,
-                    dt_cache=dt_cache,
+                    text_cache=cache["text_cfg"],
+                    dt_cache=cache["dt"],
                 )
                 neg = neg.transpose(2, 1)
                 if self.use_conditioner_cache:
-                    text_cfg_cache = text_cfg_emb
+                    cache["text_cfg"] = text_cfg_emb
                 v_pred = v_pred + (v_pred - neg) * inference_cfg_rate
+            return v_pred
+
+        v_prev = None
+        for j in range(n_timesteps):
+            v_pred = velocity(x, t)
+            if solver == "midpoint":
+                x_mid = x + d / 2 * v_pred
+                x_mid[:, :, :prompt_len] = 0
+                v_pred = velocity(x_mid, t + d / 2)
+            elif solver == "heun" and j < n_timesteps - 1:
+                x_next = x + d * v_pred
+                x_next[:, :, :prompt_len] = 0
+                v_pred = (v_pred + velocity(x_next, t + d)) / 2
+            elif solver == "multistep" and v_prev is not None:
+                v_prev, v_pred = v_pred, 1.5 * v_pred - 0.5 * v_prev
+            else:
+                v_prev = v_pred
             x = x + d * v_pred
             t = t + d
             x[:, :, :prompt_len] = 0
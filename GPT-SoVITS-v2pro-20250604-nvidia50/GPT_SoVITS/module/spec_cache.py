@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+SoVITS 训练用的线性谱 / 归一化 mel 缓存, 由 prepare_datasets/4-get-spec-cache.py 生成(可选步骤)。
+
+目录: <exp_dir>/8-spec_cache/v{版本}-{参数hash}/{spec,mel}, 分片格式同 feature_store.py, 按 fp32 存储,
+读出的谱与现场计算的完全一致
+    - 谱参数(采样率/帧长/帧移/mel 参数等)变化后 hash 不同, 自动换目录, 旧缓存不会被误用
+    - 每条记录对应 wav 的 size+mtime, 读取时不一致则视为失效, 回退到现场计算
+"""
+
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from feature_store import FeatureStore, FeatureStoreWriter
+
+SPEC_CACHE_VERSION = 2  # 2: 改为 fp32 存储, 旧的 fp16 缓存自动作废
+SPEC_CACHE_DIR = "8-spec_cache"
+SPEC_KEYS = ["sampling_rate", "filter_length", "hop_length", "win_length"]
+MEL_KEYS = [
+    "sampling_rate_mel",
+    "filter_length_mel",
+    "hop_length_mel",
+    "win_length_mel",
+    "n_mel_channels",
+    "mel_fmin",
+    "mel_fmax",
+    "spec_min",
+    "spec_max",
+]
+
+
+def get_spec_params(loader):
+    """
+    从 TextAudioSpeakerLoader* 上取出决定谱内容的参数, 有 mel 参数的(v3/v4)一并带上
+    """
+    keys = SPEC_KEYS + (MEL_KEYS if hasattr(loader, "filter_length_mel") else [])
+    params = {key: getattr(loader, key) for key in keys}
+    params["loader"] = type(loader).__name__.replace("V3b", "V3")
+    return params
+
+
+def get_cache_dir(exp_dir, params):
+    params_hash = hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(exp_dir, SPEC_CACHE_DIR, "v%s-%s" % (SPEC_CACHE_VERSION, params_hash))
+
+
+def wav_signature(path):
+    stat = os.stat(path)
+    return "%s-%s" % (stat.st_size, stat.st_mtime_ns)
+
+
+def batch_spectrogram(wavs, n_fft, hop_size, win_size, device="cpu"):
+    """
+    与 spectrogram_torch 结果一致的批量版本: 先对每条单独做 reflect pad, 再右侧补零拼 batch,
+    每条只保留不受补零影响的帧
+    """
+    pad = int((n_fft - hop_size) / 2)
+    wavs = [F.pad(wav.view(1, 1, -1).to(device), (pad, pad), mode="reflect").view(-1) for wav in wavs]
+    lengths = [wav.shape[-1] for wav in wavs]
+    y = torch.stack([F.pad(wav, (0, max(lengths) - wav.shape[-1])) for wav in wavs])
+    spec = torch.stft(
+        y,
+        n_fft,
+        hop_length=hop_size,
+        win_length=win_size,
+        window=torch.hann_window(win_size).to(dtype=y.dtype, device=y.device),
+        center=False,
+        pad_mode="reflect",
+        normalized=False,
+        onesided=True,
+        return_complex=False,
+    )
+    spec = torch.sqrt(spec.pow(2).sum(-1) + 1e-8)
+    return [spec[i, :, : (length - n_fft) // hop_size + 1] for i, length in enumerate(lengths)]
+
+
+class SpecCache:
+    """
+    data loader 读取端, 缓存不存在/参数不符/wav 已变化时返回 None
+    """
+
+    def __init__(self, exp_dir, params):
+        self.cache_dir = get_cache_dir(exp_dir, params)
+        self.has_mel = "filter_length_mel" in params
+        self.signatures = {}
+        self.spec = self.mel = None
+        if not os.path.exists(os.path.join(self.cache_dir, "meta.json")):
+            return
+        for path in sorted(glob.glob(os.path.join(self.cache_dir, "signatures-*.json"))):
+            with open(path, "r", encoding="utf8") as f:
+                self.signatures.update(json.load(f))
+        self.spec = FeatureStore(os.path.join(self.cache_dir, "spec"))
+        if self.has_mel:
+            self.mel = FeatureStore(os.path.join(self.cache_dir, "mel"))
+        print("spec cache: %s, %s items" % (self.cache_dir, len(self.signatures)))
+
+    def load(self, wav_path):
+        """
+        命中返回 (spec, mel), 没有 mel 的版本 mel 为 None
+        """
+        name = os.path.basename(wav_path)
+        if self.spec is None or name not in self.signatures or name not in self.spec.index:
+            return None
+        if self.signatures[name] != wav_signature(wav_path):
+            return None
+        spec = self.spec.load(name).float()
+        mel = self.mel.load(name).float() if self.has_mel else None
+        return spec, mel
+
+
+class SpecCacheWriter:
+    def __init__(self, exp_dir, params, part="0"):
+        self.cache_dir = get_cache_dir(exp_dir, params)
+        self.has_mel = "filter_length_mel" in params
+        self.part = str(part)
+        os.makedirs(os.path.join(self.cache_dir, "spec"), exist_ok=True)
+        if self.has_mel:
+            os.makedirs(os.path.join(self.cache_dir, "mel"), exist_ok=True)
+        with open(os.path.join(self.cache_dir, "meta.json"), "w", encoding="utf8") as f:
+            json.dump({"version": SPEC_CACHE_VERSION, "params": params}, f, ensure_ascii=False, indent=2)
+        self.signatures_path = os.path.join(self.cache_dir, "signatures-%s.json" % self.part)
+        self.signatures = {}
+        if os.path.exists(self.signatures_path):
+            with open(self.signatures_path, "r", encoding="utf8") as f:
+                self.signatures = json.load(f)
+        self.spec = FeatureStoreWriter(os.path.join(self.cache_dir, "spec"), self.part, dtype=np.float32)
+        self.mel = None
+        if self.has_mel:
+            self.mel = FeatureStoreWriter(os.path.join(self.cache_dir, "mel"), self.part, dtype=np.float32)
+
+    def is_valid(self, name, signature):
+        return self.signatures.get(name) == signature and name in self.spec
+
+    def add(self, name, signature, spec, mel=None):
+        self.spec.add(name, spec)
+        if self.mel is not None:
+            self.mel.add(name, mel)
+        self.signatures[name] = signature
+
+    def close(self):
+        self.spec.close()
+        if self.mel is not None:
+            self.mel.close()
+        # 签名最后写, 只有特征都落盘的条目才会被 loader 认为有效
+        tmp_path = "%s.tmp" % self.signatures_path
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump(self.signatures, f, ensure_ascii=False)
+        os.replace(tmp_path, self.signatures_path)
@@ -15,11 +15,14 @@ import torch
 
 is_half = eval(os.environ.get("is_half", "True")) and torch.cuda.is_available()
 version = os.environ.get("version", None)
+# 特征写入打包分片(见 feature_store.py), 设为 False 时仍按每条一个 .pt 保存
+use_feature_store = eval(os.environ.get("feature_store", "True"))
 import traceback
 import os.path
 from text.cleaner import clean_text
 from transformers import AutoModelForMaskedLM, AutoTokenizer
 from tools.my_utils import clean_path
+from feature_store import FeatureStoreWriter
 
 # inp_text=sys.argv[1]
 # inp_wav_dir=sys.argv[2]
@@ -48,6 +51,7 @@ if os.path.exists(txt_path) == False:
     bert_dir = "%s/3-bert" % (opt_dir)
     os.makedirs(opt_dir, exist_ok=True)
     os.makedirs(bert_dir, exist_ok=True)
+    store_writer = FeatureStoreWriter(bert_dir, i_part) if use_feature_store else None
     if torch.cuda.is_available():
         device = "cuda:0"
     # elif torch.backends.mps.is_available():
@@ -91,11 +95,15 @@ if os.path.exists(txt_path) == False:
                 print(name)
                 phones, word2ph, norm_text = clean_text(text.replace("%", "-").replace("￥", ","), lan, version)
                 path_bert = "%s/%s.pt" % (bert_dir, name)
-                if os.path.exists(path_bert) == False and lan == "zh":
+                has_bert = os.path.exists(path_bert) or (store_writer is not None and name in store_writer)
+                if has_bert == False and lan == "zh":
                     bert_feature = get_bert_feature(norm_text, word2ph)
                     assert bert_feature.shape[-1] == len(phones)
                     # torch.save(bert_feature, path_bert)
-                    my_save(bert_feature, path_bert)
+                    if store_writer is not None:
+                        store_writer.add(name, bert_feature)
+                    else:
+                        my_save(bert_feature, path_bert)
                 phones = " ".join(phones)
                 # res.append([name,phones])
                 res.append([name, phones, word2ph, norm_text])
@@ -136,6 +144,8 @@ if os.path.exists(txt_path) == False:
             print(line, traceback.format_exc())
 
     process(todo, res)
+    if store_writer is not None:
+        store_writer.close()
     opt = []
     for name, phones, word2ph, norm_text in res:
         opt.append("%s\t%s\t%s\t%s" % (name, phones, word2ph, norm_text))
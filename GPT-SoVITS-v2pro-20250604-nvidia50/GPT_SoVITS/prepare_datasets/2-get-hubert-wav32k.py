@@ -26,6 +26,8 @@ import librosa
 now_dir = os.getcwd()
 sys.path.append(now_dir)
 from tools.my_utils import load_audio, clean_path
+from tools.prepare_pipeline import AsyncWriter, bucket_batches, pad_stack, prefetch
+from feature_store import FeatureStoreWriter
 
 # from config import cnhubert_base_path
 # cnhubert.cnhubert_base_path=cnhubert_base_path
@@ -38,18 +40,6 @@ from tools.my_utils import load_audio, clean_path
 # cnhubert.cnhubert_base_path=sys.argv[7]
 # opt_dir="/data/docker/liujing04/gpt-vits/fine_tune_dataset/%s"%exp_name
 
-from time import time as ttime
-import shutil
-
-
-def my_save(fea, path):  #####fix issue: torch.save doesn't support chinese path
-    dir = os.path.dirname(path)
-    name = os.path.basename(path)
-    # tmp_path="%s/%s%s.pth"%(dir,ttime(),i_part)
-    tmp_path = "%s%s.pth" % (ttime(), i_part)
-    torch.save(fea, tmp_path)
-    shutil.move(tmp_path, "%s/%s" % (dir, name))
-
 
 hubert_dir = "%s/4-cnhubert" % (opt_dir)
 wav32dir = "%s/5-wav32k" % (opt_dir)
@@ -73,41 +63,74 @@ else:
     model = model.to(device)
 
 nan_fails = []
-
-
-def name2go(wav_name, wav_path):
-    hubert_path = "%s/%s.pt" % (hubert_dir, wav_name)
-    if os.path.exists(hubert_path):
-        return
+# 解码线程数 / hubert 每批条数。默认 batch_size=1, 与逐条处理结果完全一致(训练使用的就是这样的特征)
+# hubert 前向没有 attention mask, 特征提取层还带 GroupNorm, 补零会改变特征, 因此批处理需显式开启(hubert_batch_size>1),
+# 开启后也只把长度相差不超过 max_pad_ratio 的片段拼在一起
+num_workers = int(os.environ.get("prepare_num_workers", "4"))
+batch_size = int(os.environ.get("hubert_batch_size", "1"))
+max_pad_ratio = 0.1
+writer = AsyncWriter(tag=i_part)
+# 特征写入打包分片(见 feature_store.py), 设为 False 时仍按每条一个 .pt 保存
+use_feature_store = eval(os.environ.get("feature_store", "True"))
+store_writer = FeatureStoreWriter(hubert_dir, i_part) if use_feature_store else None
+
+
+def load_wav(item):
+    wav_name, wav_path = item
     tmp_audio = load_audio(wav_path, 32000)
     tmp_max = np.abs(tmp_audio).max()
     if tmp_max > 2.2:
         print("%s-filtered,%s" % (wav_name, tmp_max))
-        return
+        return None
     tmp_audio32 = (tmp_audio / tmp_max * (maxx * alpha * 32768)) + ((1 - alpha) * 32768) * tmp_audio
     tmp_audio32b = (tmp_audio / tmp_max * (maxx * alpha * 1145.14)) + ((1 - alpha) * 1145.14) * tmp_audio
     tmp_audio = librosa.resample(tmp_audio32b, orig_sr=32000, target_sr=16000)  # 不是重采样问题
-    tensor_wav16 = torch.from_numpy(tmp_audio)
+    return tmp_audio32, torch.from_numpy(tmp_audio)
+
+
+def name2go_batch(batch):
+    tensor_wav16, lengths = pad_stack([sample[3] for sample in batch])
     if is_half == True:
         tensor_wav16 = tensor_wav16.half().to(device)
     else:
         tensor_wav16 = tensor_wav16.to(device)
-    ssl = model.model(tensor_wav16.unsqueeze(0))["last_hidden_state"].transpose(1, 2).cpu()  # torch.Size([1, 768, 215])
-    if np.isnan(ssl.detach().numpy()).sum() != 0:
-        nan_fails.append((wav_name, wav_path))
-        print("nan filtered:%s" % wav_name)
-        return
-    wavfile.write(
-        "%s/%s" % (wav32dir, wav_name),
-        32000,
-        tmp_audio32.astype("int16"),
-    )
-    my_save(ssl, hubert_path)
+    with torch.no_grad():
+        ssl = model.model(tensor_wav16)["last_hidden_state"].transpose(1, 2).cpu()  # torch.Size([B, 768, 215])
+    for (wav_name, wav_path, tmp_audio32, _), length, ssl_item in zip(batch, lengths, ssl):
+        ssl_item = ssl_item[:, : int(model.model._get_feat_extract_output_lengths(length))].unsqueeze(0).clone()
+        if np.isnan(ssl_item.float().numpy()).sum() != 0:
+            nan_fails.append((wav_name, wav_path))
+            print("nan filtered:%s" % wav_name)
+            continue
+        writer.submit(wavfile.write, "%s/%s" % (wav32dir, wav_name), 32000, tmp_audio32.astype("int16"))
+        if store_writer is not None:
+            writer.submit(store_writer.add, wav_name, ssl_item)
+        else:
+            writer.save(ssl_item, "%s/%s.pt" % (hubert_dir, wav_name))
+
+
+def iter_samples(items):
+    for (wav_name, wav_path), result, error in prefetch(load_wav, items, num_workers=num_workers):
+        if error is not None:
+            print(wav_name, error)
+        elif result is not None:
+            yield (wav_name, wav_path) + result
+
+
+def run(items, batch_size):
+    for batch in bucket_batches(
+        iter_samples(items), lambda sample: sample[3].shape[-1], batch_size=batch_size, max_pad_ratio=max_pad_ratio
+    ):
+        try:
+            name2go_batch(batch)
+        except:
+            print([sample[0] for sample in batch], traceback.format_exc())
 
 
 with open(inp_text, "r", encoding="utf8") as f:
     lines = f.read().strip("\n").split("\n")
 
+items = []
 for line in lines[int(i_part) :: int(all_parts)]:
     try:
         # wav_name,text=line.split("\t")
@@ -120,15 +143,22 @@ for line in lines[int(i_part) :: int(all_parts)]:
         else:
             wav_path = wav_name
             wav_name = os.path.basename(wav_name)
-        name2go(wav_name, wav_path)
+        if os.path.exists("%s/%s.pt" % (hubert_dir, wav_name)):
+            continue
+        if store_writer is not None and wav_name in store_writer:
+            continue
+        items.append((wav_name, wav_path))
     except:
         print(line, traceback.format_exc())
 
+run(items, batch_size)
+
 if len(nan_fails) > 0 and is_half == True:
     is_half = False
     model = model.float()
-    for wav in nan_fails:
-        try:
-            name2go(wav[0], wav[1])
-        except:
-            print(wav_name, traceback.format_exc())
+    items, nan_fails = nan_fails, []
+    run(items, 1)
+
+writer.close()
+if store_writer is not None:
+    store_writer.close()
@@ -22,23 +22,14 @@ import torchaudio
 
 now_dir = os.getcwd()
 sys.path.append(now_dir)
+sys.path.append(f"{now_dir}/GPT_SoVITS")
 sys.path.append(f"{now_dir}/GPT_SoVITS/eres2net")
 from tools.my_utils import clean_path
-from time import time as ttime
-import shutil
+from tools.prepare_pipeline import AsyncWriter, prefetch
+from feature_store import FeatureStoreWriter
 from ERes2NetV2 import ERes2NetV2
 import kaldi as Kaldi
 
-
-def my_save(fea, path):  #####fix issue: torch.save doesn't support chinese path
-    dir = os.path.dirname(path)
-    name = os.path.basename(path)
-    # tmp_path="%s/%s%s.pth"%(dir,ttime(),i_part)
-    tmp_path = "%s%s.pth" % (ttime(), i_part)
-    torch.save(fea, tmp_path)
-    shutil.move(tmp_path, "%s/%s" % (dir, name))
-
-
 sv_cn_dir = "%s/7-sv_cn" % (opt_dir)
 wav32dir = "%s/5-wav32k" % (opt_dir)
 os.makedirs(opt_dir, exist_ok=True)
@@ -82,34 +73,57 @@ class SV:
 
 
 sv = SV(device, is_half)
+# ERes2NetV2 对整段做统计池化, 补零会改变说话人向量, 所以这里不拼 batch, 只把读音频和落盘与前向重叠
+num_workers = int(os.environ.get("prepare_num_workers", "4"))
+writer = AsyncWriter(tag=i_part)
+# 特征写入打包分片(见 feature_store.py), 设为 False 时仍按每条一个 .pt 保存
+use_feature_store = eval(os.environ.get("feature_store", "True"))
+store_writer = FeatureStoreWriter(sv_cn_dir, i_part) if use_feature_store else None
 
 
-def name2go(wav_name, wav_path):
-    sv_cn_path = "%s/%s.pt" % (sv_cn_dir, wav_name)
-    if os.path.exists(sv_cn_path):
-        return
+def load_wav(wav_name):
     wav_path = "%s/%s" % (wav32dir, wav_name)
     wav32k, sr0 = torchaudio.load(wav_path)
     assert sr0 == 32000
+    return wav32k
+
+
+def name2go(wav_name, wav32k):
+    sv_cn_path = "%s/%s.pt" % (sv_cn_dir, wav_name)
     wav32k = wav32k.to(device)
     emb = sv.compute_embedding3(wav32k).cpu()  # torch.Size([1, 20480])
-    my_save(emb, sv_cn_path)
+    if store_writer is not None:
+        writer.submit(store_writer.add, wav_name, emb)
+    else:
+        writer.save(emb, sv_cn_path)
 
 
 with open(inp_text, "r", encoding="utf8") as f:
     lines = f.read().strip("\n").split("\n")
 
+wav_names = []
 for line in lines[int(i_part) :: int(all_parts)]:
     try:
         wav_name, spk_name, language, text = line.split("|")
         wav_name = clean_path(wav_name)
-        if inp_wav_dir != "" and inp_wav_dir != None:
-            wav_name = os.path.basename(wav_name)
-            wav_path = "%s/%s" % (inp_wav_dir, wav_name)
-
-        else:
-            wav_path = wav_name
-            wav_name = os.path.basename(wav_name)
-        name2go(wav_name, wav_path)
+        wav_name = os.path.basename(wav_name)
+        if os.path.exists("%s/%s.pt" % (sv_cn_dir, wav_name)):
+            continue
+        if store_writer is not None and wav_name in store_writer:
+            continue
+        wav_names.append(wav_name)
     except:
         print(line, traceback.format_exc())
+
+for wav_name, wav32k, error in prefetch(load_wav, wav_names, num_workers=num_workers):
+    if error is not None:
+        print(wav_name, error)
+        continue
+    try:
+        name2go(wav_name, wav32k)
+    except:
+        print(wav_name, traceback.format_exc())
+
+writer.close()
+if store_writer is not None:
+    store_writer.close()
@@ -42,6 +42,8 @@ if version != "v3":
 else:
     from module.models import SynthesizerTrnV3 as SynthesizerTrn
 from tools.my_utils import clean_path
+from tools.prepare_pipeline import bucket_batches, pad_stack, prefetch
+from feature_store import FeatureStore
 
 logging.getLogger("numba").setLevel(logging.WARNING)
 # from config import pretrained_s2G
@@ -86,23 +88,40 @@ if os.path.exists(semantic_path) == False:
         )
     )
 
-    def name2go(wav_name, lines):
-        hubert_path = "%s/%s.pt" % (hubert_dir, wav_name)
-        if os.path.exists(hubert_path) == False:
-            return
-        ssl_content = torch.load(hubert_path, map_location="cpu")
+    # ssl_proj 是局部卷积, 量化逐帧进行, 右侧补零后截掉多出的帧, 结果与逐条提取一致
+    num_workers = int(os.environ.get("prepare_num_workers", "4"))
+    batch_size = int(os.environ.get("semantic_batch_size", "32"))
+    kernel_size, stride = vq_model.ssl_proj.kernel_size[0], vq_model.ssl_proj.stride[0]
+    hubert_store = FeatureStore(hubert_dir)
+
+    def load_hubert(wav_name):
+        if wav_name not in hubert_store:
+            return None
+        return hubert_store.load(wav_name)[0]
+
+    def iter_samples(wav_names):
+        for wav_name, ssl_content, error in prefetch(load_hubert, wav_names, num_workers=num_workers):
+            if error is not None:
+                print(wav_name, error)
+            elif ssl_content is not None:
+                yield wav_name, ssl_content
+
+    def name2go_batch(batch, name2semantic):
+        ssl_content, lengths = pad_stack([sample[1] for sample in batch])
         if is_half == True:
             ssl_content = ssl_content.half().to(device)
         else:
             ssl_content = ssl_content.to(device)
-        codes = vq_model.extract_latent(ssl_content)
-        semantic = " ".join([str(i) for i in codes[0, 0, :].tolist()])
-        lines.append("%s\t%s" % (wav_name, semantic))
+        with torch.no_grad():
+            codes = vq_model.extract_latent(ssl_content)
+        for (wav_name, _), length, code in zip(batch, lengths, codes[:, 0].cpu()):
+            semantic = " ".join([str(i) for i in code[: (length - kernel_size) // stride + 1].tolist()])
+            name2semantic[wav_name] = semantic
 
     with open(inp_text, "r", encoding="utf8") as f:
         lines = f.read().strip("\n").split("\n")
 
-    lines1 = []
+    wav_names = []
     for line in lines[int(i_part) :: int(all_parts)]:
         # print(line)
         try:
@@ -110,9 +129,18 @@ if os.path.exists(semantic_path) == False:
             wav_name, spk_name, language, text = line.split("|")
             wav_name = clean_path(wav_name)
             wav_name = os.path.basename(wav_name)
-            # name2go(name,lines1)
-            name2go(wav_name, lines1)
+            wav_names.append(wav_name)
         except:
             print(line, traceback.format_exc())
+
+    name2semantic = {}
+    for batch in bucket_batches(
+        iter_samples(wav_names), lambda sample: sample[1].shape[-1], batch_size=batch_size, max_pad_ratio=1.0
+    ):
+        try:
+            name2go_batch(batch, name2semantic)
+        except:
+            print([sample[0] for sample in batch], traceback.format_exc())
+    lines1 = ["%s\t%s" % (wav_name, name2semantic[wav_name]) for wav_name in wav_names if wav_name in name2semantic]
     with open(semantic_path, "w", encoding="utf8") as f:
         f.write("\n".join(lines1))
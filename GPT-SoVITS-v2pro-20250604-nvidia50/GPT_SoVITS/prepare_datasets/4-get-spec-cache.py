@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+可选步骤: 在 1~3 步完成并合并出 2-name2text.txt 之后运行, 为 SoVITS 训练预先算好线性谱(v3/v4 还有归一化 mel),
+训练时 data loader 直接读缓存, 不再每个 epoch 重新解码和做 STFT。不运行本步骤时训练行为不变。
+
+在项目根目录执行:
+    opt_dir=logs/xxx s2config_path=GPT_SoVITS/configs/s2.json version=v2 python -s GPT_SoVITS/prepare_datasets/4-get-spec-cache.py
+"""
+
+import os
+
+opt_dir = os.environ.get("opt_dir")
+s2config_path = os.environ.get("s2config_path")
+version = os.environ.get("version", "v2")
+i_part = os.environ.get("i_part", "0")
+all_parts = os.environ.get("all_parts", "1")
+if "_CUDA_VISIBLE_DEVICES" in os.environ:
+    os.environ["CUDA_VISIBLE_DEVICES"] = os.environ["_CUDA_VISIBLE_DEVICES"]
+import sys
+import traceback
+
+import torch
+
+now_dir = os.getcwd()
+sys.path.append(now_dir)
+sys.path.append(f"{now_dir}/GPT_SoVITS")
+import utils
+from module.data_utils import TextAudioSpeakerLoader, TextAudioSpeakerLoaderV3, TextAudioSpeakerLoaderV4, load_wav
+from module.mel_processing import spec_to_mel_torch
+from module.spec_cache import SpecCacheWriter, batch_spectrogram, get_spec_params, wav_signature
+from tools.my_utils import load_audio
+from tools.prepare_pipeline import bucket_batches, prefetch
+
+if torch.cuda.is_available():
+    device = "cuda:0"
+else:
+    device = "cpu"
+num_workers = int(os.environ.get("prepare_num_workers", "4"))
+batch_size = int(os.environ.get("spec_batch_size", "16"))
+
+hps = utils.get_hparams_from_file(s2config_path)
+hps.data.exp_dir = opt_dir
+if version == "v3":
+    loader = TextAudioSpeakerLoaderV3(hps.data)
+elif version == "v4":
+    loader = TextAudioSpeakerLoaderV4(hps.data)
+else:
+    loader = TextAudioSpeakerLoader(hps.data, version=version)
+has_mel = hasattr(loader, "filter_length_mel")
+writer = SpecCacheWriter(opt_dir, get_spec_params(loader), i_part)
+
+
+def load_item(name):
+    wav_path = "%s/%s" % (loader.path5, name)
+    signature = wav_signature(wav_path)
+    wav = torch.FloatTensor(load_wav(wav_path, loader.sampling_rate))
+    wav_mel = None
+    if has_mel:
+        if loader.sampling_rate_mel == loader.sampling_rate:
+            wav_mel = wav
+        else:
+            wav_mel = torch.FloatTensor(load_audio(wav_path, loader.sampling_rate_mel))
+    return signature, wav, wav_mel
+
+
+def process(batch):
+    specs = batch_spectrogram(
+        [sample[2] for sample in batch], loader.filter_length, loader.hop_length, loader.win_length, device
+    )
+    mels = [None] * len(batch)
+    if has_mel:
+        specs_mel = batch_spectrogram(
+            [sample[3] for sample in batch],
+            loader.filter_length_mel,
+            loader.hop_length_mel,
+            loader.win_length_mel,
+            device,
+        )
+        mels = [
+            loader.norm_spec(
+                spec_to_mel_torch(
+                    spec,
+                    loader.filter_length_mel,
+                    loader.n_mel_channels,
+                    loader.sampling_rate_mel,
+                    loader.mel_fmin,
+                    loader.mel_fmax,
+                )
+            ).cpu()
+            for spec in specs_mel
+        ]
+    for (name, signature, _, _), spec, mel in zip(batch, specs, mels):
+        writer.add(name, signature, spec.cpu(), mel)
+
+
+def iter_samples(names):
+    for name, result, error in prefetch(load_item, names, num_workers=num_workers):
+        if error is not None:
+            print(name, error)
+        else:
+            yield (name,) + result
+
+
+names = sorted(set(audiopath for audiopath, _ in loader.audiopaths_sid_text))[int(i_part) :: int(all_parts)]
+names = [name for name in names if not writer.is_valid(name, wav_signature("%s/%s" % (loader.path5, name)))]
+print("spec cache todo:", len(names))
+with torch.no_grad():
+    for batch in bucket_batches(
+        iter_samples(names), lambda sample: sample[2].shape[-1], batch_size=batch_size, max_pad_ratio=1.0
+    ):
+        try:
+            process(batch)
+        except:
+            print([sample[0] for sample in batch], traceback.format_exc())
+writer.close()
@@ -116,6 +116,7 @@ def run(rank, n_gpus, hps):
         num_replicas=n_gpus,
         rank=rank,
         shuffle=True,
+        max_frames=hps.train.max_frames_per_batch if "max_frames_per_batch" in hps.train else None,
     )
     collate_fn = TextAudioSpeakerCollate()
     train_loader = DataLoader(
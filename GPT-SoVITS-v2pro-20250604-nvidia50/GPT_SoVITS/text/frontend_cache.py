@@ -0,0 +1,144 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+class FrontendCache:
+    """
+    文本前端结果缓存: (句子, 语种, 版本, BERT模型) -> (phones, word2ph, norm_text, BERT特征)
+    内存LRU淘汰, BERT特征以 fp16 存在 CPU 上, 可选落盘。api.py / api_v2.py / TTS_infer_pack 共用同一个实例
+    落盘的文件单独按LRU限制条数(max_disk_size), 启动时按修改时间接上之前的顺序, 超出的删除文件
+    """
+
+    def __init__(self, max_size=1024, cache_dir="", max_disk_size=4096):
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.disk = OrderedDict()  # 落盘的 key, 按最近使用排序
+        self.cache_dir = ""
+        self.hits = 0
+        self.misses = 0
+        self.configure(max_size, cache_dir, max_disk_size)
+
+    def configure(self, max_size=None, cache_dir=None, max_disk_size=None):
+        with self.lock:
+            if max_size is not None:
+                self.max_size = max_size
+            if max_disk_size is not None:
+                self.max_disk_size = max_disk_size
+            if cache_dir is not None and cache_dir != self.cache_dir:
+                self.cache_dir = cache_dir
+                self.disk.clear()
+                if self.cache_dir:
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    self._scan_disk()
+            self._evict()
+
+    def _scan_disk(self):
+        paths = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                if name.endswith(".tmp"):
+                    os.remove(path)  # 上次中断时留下的临时文件
+                elif name.endswith(".pt"):
+                    paths.append((os.path.getmtime(path), name[:-3]))
+            except OSError:
+                pass
+        for _, key in sorted(paths):
+            self.disk[key] = None
+
+    @staticmethod
+    def make_key(text, language, version, bert_model=""):
+        """bert_model 为 BERT 模型路径/名称, 换了 BERT 模型后旧特征不会被误用"""
+        text = re.sub(r" {2,}", " ", text).strip()
+        key = "|".join([str(version), str(language), str(bert_model), text])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """命中返回 dict(phones, word2ph, norm_text, bert), bert 为 CPU 上的 fp16 张量"""
+        if self.max_size <= 0:
+            return None
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key]
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, "%s.pt" % key)
+            if os.path.exists(path):
+                try:
+                    item = torch.load(path, map_location="cpu", weights_only=False)
+                except Exception as e:
+                    print(f"文本前端缓存读取失败, 将重新提取: {e}")
+                else:
+                    with self.lock:
+                        self.hits += 1
+                        if key in self.disk:
+                            self.disk.move_to_end(key)
+                        self._put(key, item)
+                    return item
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, phones, word2ph, norm_text, bert):
+        if self.max_size <= 0:
+            return
+        item = {
+            "phones": list(phones),
+            "word2ph": word2ph,
+            "norm_text": norm_text,
+            "bert": bert.detach().to("cpu", torch.float16),
+        }
+        with self.lock:
+            self._put(key, item)
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, "%s.pt" % key)
+            tmp_path = "%s.%d.tmp" % (path, threading.get_ident())
+            torch.save(item, tmp_path)
+            os.replace(tmp_path, path)
+            with self.lock:
+                self.disk[key] = None
+                self.disk.move_to_end(key)
+                self._evict()
+
+    def _put(self, key, item):
+        self.cache[key] = item
+        self.cache.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        while len(self.cache) > max(self.max_size, 0):
+            self.cache.popitem(last=False)
+        while len(self.disk) > max(self.max_disk_size, 0):
+            key = self.disk.popitem(last=False)[0]
+            try:
+                os.remove(os.path.join(self.cache_dir, "%s.pt" % key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.cache),
+                "max_size": self.max_size,
+                "disk_size": len(self.disk),
+                "max_disk_size": self.max_disk_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+frontend_cache = FrontendCache()
@@ -43,6 +43,15 @@ class G2PWPinyin(Pinyin):
     def get_seg(self, **kwargs):
         return simple_seg
 
+    def prefetch(self, sentences):
+        """
+        把多句中的汉字片段合并成一个 batch 做多音字推理, 结果写入 memo,
+        之后逐句调用 lazy_pinyin 时直接命中, 不再单独跑 onnx
+        """
+        hans = [words for sent in sentences for words in simple_seg(sent) if RE_HANS.match(words)]
+        if hans:
+            self._g2pw(hans)
+
 
 class Converter(UltimateConverter):
     def __init__(self, g2pw_instance, v_to_u=False, neutral_tone_with_five=False, tone_sandhi=False, **kwargs):
@@ -3,8 +3,11 @@
 
 import json
 import os
+import threading
 import warnings
 import zipfile
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Any, Dict, List, Tuple
 
 import numpy as np
@@ -29,21 +32,27 @@ warnings.filterwarnings("ignore")
 
 model_version = "1.1"
 
+# onnx 输入名 -> prepare_onnx_input 输出的键
+ONNX_INPUT_NAMES = {
+    "input_ids": "input_ids",
+    "token_type_ids": "token_type_ids",
+    "attention_mask": "attention_masks",
+    "phoneme_mask": "phoneme_masks",
+    "char_ids": "char_ids",
+    "position_ids": "position_ids",
+}
+
 
 def predict(session, onnx_input: Dict[str, Any], labels: List[str]) -> Tuple[List[str], List[float]]:
     all_preds = []
     all_confidences = []
-    probs = session.run(
-        [],
-        {
-            "input_ids": onnx_input["input_ids"],
-            "token_type_ids": onnx_input["token_type_ids"],
-            "attention_mask": onnx_input["attention_masks"],
-            "phoneme_mask": onnx_input["phoneme_masks"],
-            "char_ids": onnx_input["char_ids"],
-            "position_ids": onnx_input["position_ids"],
-        },
-    )[0]
+    # IOBinding 直接绑定 numpy 内存, 省去 session.run 对每个输入的拷贝
+    io_binding = session.io_binding()
+    for name, key in ONNX_INPUT_NAMES.items():
+        io_binding.bind_cpu_input(name, np.ascontiguousarray(onnx_input[key]))
+    io_binding.bind_output(session.get_outputs()[0].name)
+    session.run_with_iobinding(io_binding)
+    probs = io_binding.copy_outputs_to_cpu()[0]
 
     preds = np.argmax(probs, axis=1).tolist()
     max_probs = []
@@ -79,6 +88,13 @@ def download_and_decompress(model_dir: str = "G2PWModel/"):
     return model_dir
 
 
+@lru_cache(maxsize=4096)
+def _simplified_pinyin(sent: str) -> List[List[str]]:
+    # pypinyin works well for Simplified Chinese than Traditional Chinese
+    sent_s = tranditional_to_simplified(sent)
+    return pinyin(sent_s, neutral_tone_with_five=True, style=Style.TONE3)
+
+
 class G2PWOnnxConverter:
     def __init__(
         self,
@@ -86,7 +102,15 @@ class G2PWOnnxConverter:
         style: str = "bopomofo",
         model_source: str = None,
         enable_non_tradional_chinese: bool = False,
+        batch_size: int = 64,
+        memo_size: int = 20000,
     ):
+        self.batch_size = batch_size
+        # (句子, 字下标) -> 多音字预测结果
+        self.memo_size = memo_size
+        self.memo = OrderedDict()
+        self.memo_lock = threading.Lock()
+
         uncompress_path = download_and_decompress(model_dir)
 
         sess_options = onnxruntime.SessionOptions()
@@ -186,8 +210,12 @@ class G2PWOnnxConverter:
             return None
 
     def __call__(self, sentences: List[str]) -> List[List[str]]:
+        """
+        可一次传入多句, 所有句子中未命中缓存的多音字合并成 batch 推理
+        """
         if isinstance(sentences, str):
             sentences = [sentences]
+        raw_sentences = sentences
 
         if self.enable_opencc:
             translated_sentences = []
@@ -197,50 +225,76 @@ class G2PWOnnxConverter:
                 translated_sentences.append(translated_sent)
             sentences = translated_sentences
 
-        texts, query_ids, sent_ids, partial_results = self._prepare_data(sentences=sentences)
+        texts, query_ids, sent_ids, partial_results = self._prepare_data(
+            sentences=sentences, raw_sentences=raw_sentences
+        )
         if len(texts) == 0:
             # sentences no polyphonic words
             return partial_results
 
-        onnx_input = prepare_onnx_input(
-            tokenizer=self.tokenizer,
-            labels=self.labels,
-            char2phonemes=self.char2phonemes,
-            chars=self.chars,
-            texts=texts,
-            query_ids=query_ids,
-            use_mask=self.config.use_mask,
-            window_size=None,
-        )
+        # 按长度排序后分块, 减少 padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        results = partial_results
+        for start in range(0, len(order), self.batch_size):
+            chunk = order[start : start + self.batch_size]
+            onnx_input = prepare_onnx_input(
+                tokenizer=self.tokenizer,
+                labels=self.labels,
+                char2phonemes=self.char2phonemes,
+                chars=self.chars,
+                texts=[texts[i] for i in chunk],
+                query_ids=[query_ids[i] for i in chunk],
+                use_mask=self.config.use_mask,
+                window_size=None,
+            )
+            if not onnx_input:
+                continue
 
-        preds, confidences = predict(session=self.session_g2pW, onnx_input=onnx_input, labels=self.labels)
-        if self.config.use_char_phoneme:
-            preds = [pred.split(" ")[1] for pred in preds]
+            preds, confidences = predict(session=self.session_g2pW, onnx_input=onnx_input, labels=self.labels)
+            if self.config.use_char_phoneme:
+                preds = [pred.split(" ")[1] for pred in preds]
 
-        results = partial_results
-        for sent_id, query_id, pred in zip(sent_ids, query_ids, preds):
-            results[sent_id][query_id] = self.style_convert_func(pred)
+            with self.memo_lock:
+                for i, pred in zip(chunk, preds):
+                    result = self.style_convert_func(pred)
+                    results[sent_ids[i]][query_ids[i]] = result
+                    self.memo[(raw_sentences[sent_ids[i]], query_ids[i])] = result
+                while len(self.memo) > self.memo_size:
+                    self.memo.popitem(last=False)
 
         return results
 
-    def _prepare_data(self, sentences: List[str]) -> Tuple[List[str], List[int], List[int], List[List[str]]]:
+    def _prepare_data(
+        self, sentences: List[str], raw_sentences: List[str] = None
+    ) -> Tuple[List[str], List[int], List[int], List[List[str]]]:
+        if raw_sentences is None:
+            raw_sentences = sentences
         texts, query_ids, sent_ids, partial_results = [], [], [], []
-        for sent_id, sent in enumerate(sentences):
-            # pypinyin works well for Simplified Chinese than Traditional Chinese
-            sent_s = tranditional_to_simplified(sent)
-            pypinyin_result = pinyin(sent_s, neutral_tone_with_five=True, style=Style.TONE3)
+        for sent_id, (sent, raw_sent) in enumerate(zip(sentences, raw_sentences)):
+            pypinyin_result = None
             partial_result = [None] * len(sent)
             for i, char in enumerate(sent):
                 if char in self.polyphonic_chars_new:
-                    texts.append(sent)
-                    query_ids.append(i)
-                    sent_ids.append(sent_id)
+                    key = (raw_sent, i)
+                    with self.memo_lock:
+                        hit = key in self.memo
+                        if hit:
+                            self.memo.move_to_end(key)
+                            partial_result[i] = self.memo[key]
+                    if not hit:
+                        texts.append(sent)
+                        query_ids.append(i)
+                        sent_ids.append(sent_id)
                 elif char in self.monophonic_chars_dict:
                     partial_result[i] = self.style_convert_func(self.monophonic_chars_dict[char])
                 elif char in self.char_bopomofo_dict:
+                    if pypinyin_result is None:
+                        pypinyin_result = _simplified_pinyin(sent)
                     partial_result[i] = pypinyin_result[i][0]
                     # partial_result[i] =  self.style_convert_func(self.char_bopomofo_dict[char][0])
                 else:
+                    if pypinyin_result is None:
+                        pypinyin_result = _simplified_pinyin(sent)
                     partial_result[i] = pypinyin_result[i][0]
 
             partial_results.append(partial_result)
@@ -25,6 +25,12 @@
 
 `-hb` - `cnhubert路径`
 `-b` - `bert路径`
+`-rcs` - `参考音频特征缓存条数, 默认16`
+`-rcd` - `参考音频特征缓存落盘目录, 默认不落盘, 指定后重启可直接复用`
+`-fcs` - `文本前端(phones/BERT)缓存条数, 默认1024, 0为关闭`
+`-fcd` - `文本前端缓存落盘目录, 默认不落盘`
+`-mm` - `最多常驻的 (GPT, SoVITS) 模型组数, 默认4, 切换到已常驻的模型不重新加载`
+`-mmb` - `常驻模型的显存预算(GB), 默认0不限, 超出时淘汰最久未使用的模型`
 
 ## 调用:
 
@@ -88,9 +94,13 @@ POST:
     "top_p": 0.6,
     "temperature": 0.6,
     "speed": 1,
-    "inp_refs": ["456.wav","789.wav"]
+    "inp_refs": ["456.wav","789.wav"],
+    "seed": 42
 }
 ```
+`seed` 为 -1(默认) 时不固定随机种子, 指定后同样的参数得到同样的结果
+`streaming_mode` / `media_type` 可按次覆盖启动参数 `-sm` / `-mt`, 例如 `streaming_mode=true&media_type=raw` 逐句返回 PCM, 采样率见响应头 `X-Sample-Rate`
+`gpt_model_path` / `sovits_model_path` 可按次指定模型, 不填则使用 `/set_model` 设置的默认模型; 未常驻的模型在后台加载后常驻
 
 RESP:
 成功: 直接返回 wav 音频流， http code 200
@@ -138,12 +148,26 @@ POST:
 
 RESP: 无
 
+
+### 文本前端缓存统计
+
+endpoint: `/frontend_cache`
+
+GET:
+    `http://127.0.0.1:9880/frontend_cache`
+
+RESP:
+json, 包含 size / max_size / hits / misses / hit_rate
+
 """
 
 import argparse
+import asyncio
 import os
+import random
 import re
 import sys
+import threading
 
 now_dir = os.getcwd()
 sys.path.append(now_dir)
@@ -163,15 +187,19 @@ from transformers import AutoModelForMaskedLM, AutoTokenizer
 import numpy as np
 from feature_extractor import cnhubert
 from io import BytesIO
-from module.models import Generator, SynthesizerTrn, SynthesizerTrnV3
+from module.models import CFM_SOLVERS, Generator, SynthesizerTrn, SynthesizerTrnV3
 from peft import LoraConfig, get_peft_model
 from AR.models.t2s_lightning_module import Text2SemanticLightningModule
 from text import cleaned_text_to_sequence
 from text.cleaner import clean_text
+from text.frontend_cache import frontend_cache
+from tools.model_pool import ModelPool
 from module.mel_processing import spectrogram_torch
 import config as global_config
 import logging
 import subprocess
+import hashlib
+from collections import OrderedDict
 
 
 class DefaultRefer:
@@ -361,6 +389,8 @@ class Speaker:
         self.name = name
         self.sovits = sovits
         self.gpt = gpt
+        self.gpt_path = gpt.path
+        self.key = (gpt.path, sovits.path)
         self.phones = phones
         self.bert = bert
         self.prompt = prompt
@@ -370,9 +400,10 @@ speaker_list = {}
 
 
 class Sovits:
-    def __init__(self, vq_model, hps):
+    def __init__(self, vq_model, hps, path=""):
         self.vq_model = vq_model
         self.hps = hps
+        self.path = path
 
 
 from process_ckpt import get_sovits_version_from_path_fast, load_sovits_new
@@ -425,9 +456,10 @@ def get_sovits_weights(sovits_path):
             n_speakers=hps.data.n_speakers,
             **model_params_dict,
         )
-        if model_version == "v3":
+        # 声码器与模型无关, 多个 v3/v4 模型常驻时共用一份
+        if model_version == "v3" and bigvgan_model is None:
             init_bigvgan()
-        if model_version == "v4":
+        if model_version == "v4" and hifigan_model is None:
             init_hifigan()
 
     model_version = hps.model.version
@@ -460,14 +492,15 @@ def get_sovits_weights(sovits_path):
         # torch.save(vq_model.state_dict(),"merge_win.pth")
         vq_model.eval()
 
-    sovits = Sovits(vq_model, hps)
+    sovits = Sovits(vq_model, hps, sovits_path)
     return sovits
 
 
 class Gpt:
-    def __init__(self, max_sec, t2s_model):
+    def __init__(self, max_sec, t2s_model, path=""):
         self.max_sec = max_sec
         self.t2s_model = t2s_model
+        self.path = path
 
 
 global hz
@@ -487,18 +520,46 @@ def get_gpt_weights(gpt_path):
     # total = sum([param.nelement() for param in t2s_model.parameters()])
     # logger.info("Number of parameter: %.2fM" % (total / 1e6))
 
-    gpt = Gpt(max_sec, t2s_model)
+    gpt = Gpt(max_sec, t2s_model, gpt_path)
     return gpt
 
 
+def load_speaker(key):
+    gpt_path, sovits_path = key
+    return Speaker(name="default", gpt=get_gpt_weights(gpt_path), sovits=get_sovits_weights(sovits_path))
+
+
+def speaker_memory(speaker):
+    models = (speaker.gpt.t2s_model, speaker.sovits.vq_model)
+    return sum(p.numel() * p.element_size() for model in models for p in model.parameters())
+
+
+def release_speaker(speaker):
+    # 正在推理的请求仍持有引用, 结束后才真正释放
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+async def get_speaker(gpt_path, sovits_path):
+    """按次指定的模型, 未常驻时在模型池后台线程中加载; 都不指定时返回 None 使用默认模型"""
+    if gpt_path in [None, ""] and sovits_path in [None, ""]:
+        return None
+    default = speaker_list["default"]
+    key = (gpt_path or default.gpt_path, sovits_path or default.sovits.path)
+    return await asyncio.wrap_future(speaker_pool.load(key))
+
+
 def change_gpt_sovits_weights(gpt_path, sovits_path):
+    key = (gpt_path, sovits_path)
     try:
-        gpt = get_gpt_weights(gpt_path)
-        sovits = get_sovits_weights(sovits_path)
+        speaker = speaker_pool.get(key)
     except Exception as e:
         return JSONResponse({"code": 400, "message": str(e)}, status_code=400)
 
-    speaker_list["default"] = Speaker(name="default", gpt=gpt, sovits=sovits)
+    if "default" in speaker_list and speaker_list["default"].key != key:
+        speaker_pool.unpin(speaker_list["default"].key)
+    speaker_pool.pin(key)
+    speaker_list["default"] = speaker
     return JSONResponse({"code": 0, "message": "Success"}, status_code=200)
 
 
@@ -543,6 +604,13 @@ from text import chinese
 
 
 def get_phones_and_bert(text, language, version, final=False):
+    dtype = torch.float16 if is_half == True else torch.float32
+    cache_key = frontend_cache.make_key(text, language, version, bert_path)
+    if not final:
+        cached = frontend_cache.get(cache_key)
+        if cached is not None:
+            return cached["phones"], cached["bert"].to(device, dtype), cached["norm_text"]
+
     text = re.sub(r' {2,}', ' ', text)
     textlist = []
     langlist = []
@@ -592,6 +660,7 @@ def get_phones_and_bert(text, language, version, final=False):
     phones_list = []
     bert_list = []
     norm_text_list = []
+    word2ph_list = []
     for i in range(len(textlist)):
         lang = langlist[i]
         phones, word2ph, norm_text = clean_text_inf(textlist[i], lang, version)
@@ -599,14 +668,19 @@ def get_phones_and_bert(text, language, version, final=False):
         phones_list.append(phones)
         norm_text_list.append(norm_text)
         bert_list.append(bert)
+        word2ph_list.append(word2ph)
     bert = torch.cat(bert_list, dim=1)
     phones = sum(phones_list, [])
     norm_text = "".join(norm_text_list)
 
     if not final and len(phones) < 6:
-        return get_phones_and_bert("." + text, language, version, final=True)
+        phones, bert, norm_text = get_phones_and_bert("." + text, language, version, final=True)
+        frontend_cache.put(cache_key, phones, None, norm_text, bert)
+        return phones, bert, norm_text
 
-    return phones, bert.to(torch.float16 if is_half == True else torch.float32), norm_text
+    if not final:
+        frontend_cache.put(cache_key, phones, word2ph_list, norm_text, bert)
+    return phones, bert.to(dtype), norm_text
 
 
 class DictToAttrRecursive(dict):
@@ -667,10 +741,154 @@ def get_spepc(hps, filename, dtype, device, is_v2pro=False):
     return spec, audio
 
 
-def pack_audio(audio_bytes, data, rate):
-    if media_type == "ogg":
+class ReferCache:
+    """参考音频特征缓存, 以音频内容哈希为键, 内存LRU淘汰, 可选落盘; 多个请求线程共用, 读写加锁"""
+
+    def __init__(self, max_size=16, cache_dir=""):
+        self.lock = threading.Lock()
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.cache = OrderedDict()
+        self.file_hash = {}
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def hash_file(self, filename):
+        stat = os.stat(filename)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            cached = self.file_hash.get(filename)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        sha = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with self.lock:
+            self.file_hash[filename] = (stamp, digest)
+        return digest
+
+    def make_key(self, filename, *items):
+        key = "|".join([self.hash_file(filename)] + [str(item) for item in items])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, "%s.pt" % key)
+            if os.path.exists(path):
+                try:
+                    item = torch.load(path, map_location="cpu", weights_only=False)
+                except Exception as e:
+                    logger.warning(f"参考音频缓存读取失败, 将重新提取: {e}")
+                    return None
+                item = {k: v.to(device) if isinstance(v, torch.Tensor) else v for k, v in item.items()}
+                self._put(key, item)
+                return item
+        return None
+
+    def put(self, key, item):
+        self._put(key, item)
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, "%s.pt" % key)
+            tmp_path = "%s.%d.tmp" % (path, threading.get_ident())
+            # 只落盘张量; 内存里附带的 v3/v4 参考条件(vocoder_cond)依赖参考文本, 不落盘
+            torch.save({k: v.cpu() for k, v in item.items() if isinstance(v, torch.Tensor)}, tmp_path)
+            os.replace(tmp_path, path)
+
+    def _put(self, key, item):
+        with self.lock:
+            self.cache[key] = item
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+
+def get_refer_feature(filename, infer_sovits, dtype, is_v2pro=False, with_prompt=True):
+    """提取参考音频的 prompt_semantic / refer spec / 16k音频 / sv embedding, 命中缓存时跳过全部模型计算"""
+    vq_model = infer_sovits.vq_model
+    # 模型权重有几百 MB, 不在请求路径上做全文件哈希, 以 路径+大小+修改时间 区分
+    if os.path.exists(infer_sovits.path):
+        stat = os.stat(infer_sovits.path)
+        sovits_hash = "%s|%s|%s" % (os.path.abspath(infer_sovits.path), stat.st_size, stat.st_mtime_ns)
+    else:
+        sovits_hash = infer_sovits.path
+    key = refer_cache.make_key(filename, sovits_hash, vq_model.version, dtype, is_v2pro)
+    item = refer_cache.get(key)
+    updated = False
+    if item is None:
+        item = {}
+        refer, audio_tensor = get_spepc(infer_sovits.hps, filename, dtype, device, is_v2pro)
+        item["refer"] = refer
+        if is_v2pro:
+            if sv_cn_model == None:
+                init_sv_cn()
+            item["audio_16k"] = audio_tensor
+            item["sv_emb"] = sv_cn_model.compute_embedding3(audio_tensor)
+        updated = True
+    if with_prompt and "prompt" not in item:
+        zero_wav = torch.zeros(int(infer_sovits.hps.data.sampling_rate * 0.3), dtype=dtype, device=device)
+        wav16k, sr = librosa.load(filename, sr=16000)
+        wav16k = torch.from_numpy(wav16k).to(dtype).to(device)
+        wav16k = torch.cat([wav16k, zero_wav])
+        ssl_content = ssl_model.model(wav16k.unsqueeze(0))["last_hidden_state"].transpose(1, 2)  # .float()
+        codes = vq_model.extract_latent(ssl_content)
+        item["prompt"] = codes[0, 0].unsqueeze(0).to(device)
+        updated = True
+    if updated:
+        refer_cache.put(key, item)
+    return item
+
+
+def get_vocoder_cond(ref_wav_path, refer_feature, phones1, vq_model, dtype):
+    """
+    v3/v4 参考一侧的 CFM 条件(fea_ref, ge, mel2, T_min)与目标文本无关,
+    按参考文本挂在参考音频缓存条目上, 同一参考的后续句子和请求直接复用
+    """
+    version = vq_model.version
+    key = (tuple(phones1), dtype)
+    if refer_feature.get("vocoder_cond") is not None and refer_feature["vocoder_cond"][0] == key:
+        return refer_feature["vocoder_cond"][1]
+    with torch.no_grad():
+        phoneme_ids0 = torch.LongTensor(phones1).to(device).unsqueeze(0)
+        fea_ref, ge = vq_model.decode_encp(refer_feature["prompt"].unsqueeze(0), phoneme_ids0, refer_feature["refer"])
+        ref_audio, sr = torchaudio.load(ref_wav_path)
+        ref_audio = ref_audio.to(device).float()
+        if ref_audio.shape[0] == 2:
+            ref_audio = ref_audio.mean(0).unsqueeze(0)
+
+        tgt_sr = 24000 if version == "v3" else 32000
+        if sr != tgt_sr:
+            ref_audio = resample(ref_audio, sr, tgt_sr, device)
+        mel2 = mel_fn(ref_audio) if version == "v3" else mel_fn_v4(ref_audio)
+        mel2 = norm_spec(mel2)
+        T_min = min(mel2.shape[2], fea_ref.shape[2])
+        mel2 = mel2[:, :, :T_min]
+        fea_ref = fea_ref[:, :, :T_min]
+        Tref = 468 if version == "v3" else 500
+        if T_min > Tref:
+            mel2 = mel2[:, :, -Tref:]
+            fea_ref = fea_ref[:, :, -Tref:]
+            T_min = Tref
+        mel2 = mel2.to(dtype)
+    vocoder_cond = (fea_ref, ge, mel2, T_min)
+    refer_feature["vocoder_cond"] = (key, vocoder_cond)
+    return vocoder_cond
+
+
+def pack_audio(audio_bytes, data, rate, fmt=None):
+    fmt = media_type if fmt is None else fmt
+    if fmt == "ogg":
         audio_bytes = pack_ogg(audio_bytes, data, rate)
-    elif media_type == "aac":
+    elif fmt == "aac":
         audio_bytes = pack_aac(audio_bytes, data, rate)
     else:
         # wav无法流式, 先暂存raw
@@ -827,6 +1045,25 @@ splits = {
 }
 
 
+def set_seed(seed):
+    seed = int(seed)
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    if torch.cuda.is_available():
+        torch.cuda.manual_seed_all(seed)
+
+
+# 合成期间会重设全局随机种子(set_seed)并读写共享的模型状态, 多个请求线程同时合成时结果不可复现,
+# 整个 get_tts_wav 迭代期间持有该锁, 请求按到达顺序逐个合成
+synth_lock = threading.Lock()
+
+
+def serialized(generator):
+    with synth_lock:
+        yield from generator
+
+
 def get_tts_wav(
     ref_wav_path,
     prompt_text,
@@ -841,13 +1078,24 @@ def get_tts_wav(
     sample_steps=32,
     if_sr=False,
     spk="default",
+    seed=-1,
+    streaming=None,
+    fmt=None,
+    speaker=None,
 ):
-    infer_sovits = speaker_list[spk].sovits
+    # streaming / fmt 为单次请求覆盖的流式模式和编码格式, 默认使用启动参数
+    _stream_mode = stream_mode if streaming is None else ("normal" if streaming else "close")
+    _media_type = media_type if fmt is None else fmt
+    if seed not in [-1, None]:
+        set_seed(seed)
+    # speaker 为按次指定的模型, 默认使用 speaker_list 中的模型
+    speaker = speaker_list[spk] if speaker is None else speaker
+    infer_sovits = speaker.sovits
     vq_model = infer_sovits.vq_model
     hps = infer_sovits.hps
     version = vq_model.version
 
-    infer_gpt = speaker_list[spk].gpt
+    infer_gpt = speaker.gpt
     t2s_model = infer_gpt.t2s_model
     max_sec = infer_gpt.max_sec
 
@@ -869,50 +1117,37 @@ def get_tts_wav(
     dtype = torch.float16 if is_half == True else torch.float32
     zero_wav = np.zeros(int(hps.data.sampling_rate * 0.3), dtype=np.float16 if is_half == True else np.float32)
     with torch.no_grad():
-        wav16k, sr = librosa.load(ref_wav_path, sr=16000)
-        wav16k = torch.from_numpy(wav16k)
-        zero_wav_torch = torch.from_numpy(zero_wav)
-        if is_half == True:
-            wav16k = wav16k.half().to(device)
-            zero_wav_torch = zero_wav_torch.half().to(device)
-        else:
-            wav16k = wav16k.to(device)
-            zero_wav_torch = zero_wav_torch.to(device)
-        wav16k = torch.cat([wav16k, zero_wav_torch])
-        ssl_content = ssl_model.model(wav16k.unsqueeze(0))["last_hidden_state"].transpose(1, 2)  # .float()
-        codes = vq_model.extract_latent(ssl_content)
-        prompt_semantic = codes[0, 0]
-        prompt = prompt_semantic.unsqueeze(0).to(device)
-
         is_v2pro = version in {"v2Pro", "v2ProPlus"}
+        refer_feature = get_refer_feature(ref_wav_path, infer_sovits, dtype, is_v2pro)
+        prompt = refer_feature["prompt"]
+
         if version not in {"v3", "v4"}:
             refers = []
             if is_v2pro:
                 sv_emb = []
-                if sv_cn_model == None:
-                    init_sv_cn()
             if inp_refs:
                 for path in inp_refs:
                     try:  #####这里加上提取sv的逻辑，要么一堆sv一堆refer，要么单个sv单个refer
-                        refer, audio_tensor = get_spepc(hps, path.name, dtype, device, is_v2pro)
-                        refers.append(refer)
+                        inp_feature = get_refer_feature(path.name, infer_sovits, dtype, is_v2pro, with_prompt=False)
+                        refers.append(inp_feature["refer"])
                         if is_v2pro:
-                            sv_emb.append(sv_cn_model.compute_embedding3(audio_tensor))
+                            sv_emb.append(inp_feature["sv_emb"])
                     except Exception as e:
                         logger.error(e)
             if len(refers) == 0:
-                refers, audio_tensor = get_spepc(hps, ref_wav_path, dtype, device, is_v2pro)
-                refers = [refers]
+                refers = [refer_feature["refer"]]
                 if is_v2pro:
-                    sv_emb = [sv_cn_model.compute_embedding3(audio_tensor)]
+                    sv_emb = [refer_feature["sv_emb"]]
         else:
-            refer, audio_tensor = get_spepc(hps, ref_wav_path, dtype, device)
+            refer = refer_feature["refer"]
 
     t1 = ttime()
     # os.environ['version'] = version
     prompt_language = dict_language[prompt_language.lower()]
     text_language = dict_language[text_language.lower()]
     phones1, bert1, norm_text1 = get_phones_and_bert(prompt_text, prompt_language, version)
+    if version in {"v3", "v4"}:
+        vocoder_cond = get_vocoder_cond(ref_wav_path, refer_feature, phones1, vq_model, dtype)
     texts = text.split("\n")
     audio_bytes = BytesIO()
 
@@ -970,31 +1205,11 @@ def get_tts_wav(
                     .numpy()[0, 0]
                 )
         else:
-            phoneme_ids0 = torch.LongTensor(phones1).to(device).unsqueeze(0)
             phoneme_ids1 = torch.LongTensor(phones2).to(device).unsqueeze(0)
 
-            fea_ref, ge = vq_model.decode_encp(prompt.unsqueeze(0), phoneme_ids0, refer)
-            ref_audio, sr = torchaudio.load(ref_wav_path)
-            ref_audio = ref_audio.to(device).float()
-            if ref_audio.shape[0] == 2:
-                ref_audio = ref_audio.mean(0).unsqueeze(0)
-
-            tgt_sr = 24000 if version == "v3" else 32000
-            if sr != tgt_sr:
-                ref_audio = resample(ref_audio, sr, tgt_sr, device)
-            mel2 = mel_fn(ref_audio) if version == "v3" else mel_fn_v4(ref_audio)
-            mel2 = norm_spec(mel2)
-            T_min = min(mel2.shape[2], fea_ref.shape[2])
-            mel2 = mel2[:, :, :T_min]
-            fea_ref = fea_ref[:, :, :T_min]
-            Tref = 468 if version == "v3" else 500
+            fea_ref, ge, mel2, T_min = vocoder_cond
             Tchunk = 934 if version == "v3" else 1000
-            if T_min > Tref:
-                mel2 = mel2[:, :, -Tref:]
-                fea_ref = fea_ref[:, :, -Tref:]
-                T_min = Tref
             chunk_len = Tchunk - T_min
-            mel2 = mel2.to(dtype)
             fea_todo, ge = vq_model.decode_encp(pred_semantic, phoneme_ids1, refer, ge, speed)
             cfm_resss = []
             idx = 0
@@ -1005,7 +1220,12 @@ def get_tts_wav(
                 idx += chunk_len
                 fea = torch.cat([fea_ref, fea_todo_chunk], 2).transpose(2, 1)
                 cfm_res = vq_model.cfm.inference(
-                    fea, torch.LongTensor([fea.size(1)]).to(fea.device), mel2, sample_steps, inference_cfg_rate=0
+                    fea,
+                    torch.LongTensor([fea.size(1)]).to(fea.device),
+                    mel2,
+                    sample_steps,
+                    inference_cfg_rate=0,
+                    solver=cfm_solver,
                 )
                 cfm_res = cfm_res[:, :, mel2.shape[2] :]
                 mel2 = cfm_res[:, :, -T_min:]
@@ -1048,16 +1268,16 @@ def get_tts_wav(
             sr = 48000
 
         if is_int32:
-            audio_bytes = pack_audio(audio_bytes, (audio_opt * 2147483647).astype(np.int32), sr)
+            audio_bytes = pack_audio(audio_bytes, (audio_opt * 2147483647).astype(np.int32), sr, _media_type)
         else:
-            audio_bytes = pack_audio(audio_bytes, (audio_opt * 32768).astype(np.int16), sr)
+            audio_bytes = pack_audio(audio_bytes, (audio_opt * 32768).astype(np.int16), sr, _media_type)
         # logger.info("%.3f\t%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, t3 - t2, t4 - t3))
-        if stream_mode == "normal":
+        if _stream_mode == "normal":
             audio_bytes, audio_chunk = read_clean_buffer(audio_bytes)
             yield audio_chunk
 
-    if not stream_mode == "normal":
-        if media_type == "wav":
+    if not _stream_mode == "normal":
+        if _media_type == "wav":
             if version in {"v1", "v2", "v2Pro", "v2ProPlus"}:
                 sr = 32000
             elif version == "v3":
@@ -1111,6 +1331,10 @@ def handle(
     inp_refs,
     sample_steps,
     if_sr,
+    seed=-1,
+    streaming_mode=None,
+    req_media_type=None,
+    speaker=None,
 ):
     if (
         refer_wav_path == ""
@@ -1133,22 +1357,43 @@ def handle(
     else:
         text = cut_text(text, cut_punc)
 
+    _media_type = media_type if req_media_type in [None, ""] else req_media_type
+    if _media_type not in ["wav", "ogg", "aac", "raw"]:
+        return JSONResponse({"code": 400, "message": f"不支持的编码格式: {_media_type}"}, status_code=400)
+    headers = None
+    if _media_type == "raw":
+        # raw PCM 没有文件头, 通过响应头告知采样率
+        version = (speaker or speaker_list["default"]).sovits.vq_model.version
+        if version in {"v1", "v2", "v2Pro", "v2ProPlus"}:
+            sr = 32000
+        elif version == "v3":
+            sr = 48000 if if_sr else 24000
+        else:
+            sr = 48000  # v4
+        headers = {"X-Sample-Rate": str(sr), "X-Sample-Width": "4" if is_int32 else "2"}
+
+    generator = get_tts_wav(
+        refer_wav_path,
+        prompt_text,
+        prompt_language,
+        text,
+        text_language,
+        top_k,
+        top_p,
+        temperature,
+        speed,
+        inp_refs,
+        sample_steps,
+        if_sr,
+        seed=seed,
+        streaming=streaming_mode,
+        fmt=req_media_type or None,
+        speaker=speaker,
+    )
     return StreamingResponse(
-        get_tts_wav(
-            refer_wav_path,
-            prompt_text,
-            prompt_language,
-            text,
-            text_language,
-            top_k,
-            top_p,
-            temperature,
-            speed,
-            inp_refs,
-            sample_steps,
-            if_sr,
-        ),
-        media_type="audio/" + media_type,
+        serialized(generator),
+        media_type="audio/" + _media_type,
+        headers=headers,
     )
 
 
@@ -1213,6 +1458,18 @@ parser.add_argument("-cp", "--cut_punc", type=str, default="", help="文本切
 # 切割常用分句符为 `python ./api.py -cp ".?!。？！"`
 parser.add_argument("-hb", "--hubert_path", type=str, default=g_config.cnhubert_path, help="覆盖config.cnhubert_path")
 parser.add_argument("-b", "--bert_path", type=str, default=g_config.bert_path, help="覆盖config.bert_path")
+parser.add_argument("-rcs", "--refer_cache_size", type=int, default=16, help="参考音频特征缓存条数, default: 16")
+parser.add_argument("-rcd", "--refer_cache_dir", type=str, default="", help="参考音频特征缓存落盘目录, 默认不落盘")
+parser.add_argument("-fcs", "--frontend_cache_size", type=int, default=1024, help="文本前端缓存条数, default: 1024")
+parser.add_argument("-fcd", "--frontend_cache_dir", type=str, default="", help="文本前端缓存落盘目录, 默认不落盘")
+parser.add_argument(
+    "-fcds", "--frontend_cache_disk_size", type=int, default=4096, help="文本前端缓存落盘条数上限, default: 4096"
+)
+parser.add_argument(
+    "-cs", "--cfm_solver", type=str, default="euler", choices=CFM_SOLVERS, help="v3/v4 CFM 采样器, default: euler"
+)
+parser.add_argument("-mm", "--max_models", type=int, default=4, help="最多常驻的 (GPT, SoVITS) 模型组数, default: 4")
+parser.add_argument("-mmb", "--model_memory", type=float, default=0, help="常驻模型的显存预算(GB), 0为不限")
 
 args = parser.parse_args()
 sovits_path = args.sovits_path
@@ -1223,6 +1480,16 @@ host = args.bind_addr
 cnhubert_base_path = args.hubert_path
 bert_path = args.bert_path
 default_cut_punc = args.cut_punc
+refer_cache = ReferCache(args.refer_cache_size, args.refer_cache_dir)
+frontend_cache.configure(args.frontend_cache_size, args.frontend_cache_dir, args.frontend_cache_disk_size)
+cfm_solver = args.cfm_solver
+speaker_pool = ModelPool(
+    load_speaker,
+    args.max_models,
+    int(args.model_memory * 1024**3),
+    size_fn=speaker_memory,
+    on_evict=release_speaker,
+)
 
 # 应用参数配置
 default_refer = DefaultRefer(args.default_refer_path, args.default_refer_text, args.default_refer_language)
@@ -1301,9 +1568,7 @@ app = FastAPI()
 @app.post("/set_model")
 async def set_model(request: Request):
     json_post_raw = await request.json()
-    return change_gpt_sovits_weights(
-        gpt_path=json_post_raw.get("gpt_model_path"), sovits_path=json_post_raw.get("sovits_model_path")
-    )
+    return await set_default_model(json_post_raw.get("gpt_model_path"), json_post_raw.get("sovits_model_path"))
 
 
 @app.get("/set_model")
@@ -1311,7 +1576,21 @@ async def set_model(
     gpt_model_path: str = None,
     sovits_model_path: str = None,
 ):
-    return change_gpt_sovits_weights(gpt_path=gpt_model_path, sovits_path=sovits_model_path)
+    return await set_default_model(gpt_model_path, sovits_model_path)
+
+
+async def set_default_model(gpt_path, sovits_path):
+    try:
+        # 先在后台加载好, 加载期间其他请求照常使用原来的默认模型
+        await asyncio.wrap_future(speaker_pool.load((gpt_path, sovits_path)))
+    except Exception as e:
+        return JSONResponse({"code": 400, "message": str(e)}, status_code=400)
+    return change_gpt_sovits_weights(gpt_path=gpt_path, sovits_path=sovits_path)
+
+
+@app.get("/models")
+async def models_stats():
+    return JSONResponse({"default": list(speaker_list["default"].key), **speaker_pool.stats()}, status_code=200)
 
 
 @app.post("/control")
@@ -1338,9 +1617,18 @@ async def change_refer(refer_wav_path: str = None, prompt_text: str = None, prom
     return handle_change(refer_wav_path, prompt_text, prompt_language)
 
 
+@app.get("/frontend_cache")
+async def frontend_cache_stats():
+    return JSONResponse(frontend_cache.stats(), status_code=200)
+
+
 @app.post("/")
 async def tts_endpoint(request: Request):
     json_post_raw = await request.json()
+    try:
+        speaker = await get_speaker(json_post_raw.get("gpt_model_path"), json_post_raw.get("sovits_model_path"))
+    except Exception as e:
+        return JSONResponse({"code": 400, "message": str(e)}, status_code=400)
     return handle(
         json_post_raw.get("refer_wav_path"),
         json_post_raw.get("prompt_text"),
@@ -1355,6 +1643,10 @@ async def tts_endpoint(request: Request):
         json_post_raw.get("inp_refs", []),
         json_post_raw.get("sample_steps", 32),
         json_post_raw.get("if_sr", False),
+        json_post_raw.get("seed", -1),
+        json_post_raw.get("streaming_mode"),
+        json_post_raw.get("media_type"),
+        speaker,
     )
 
 
@@ -1373,7 +1665,16 @@ async def tts_endpoint(
     inp_refs: list = Query(default=[]),
     sample_steps: int = 32,
     if_sr: bool = False,
+    seed: int = -1,
+    streaming_mode: bool = None,
+    media_type: str = None,
+    gpt_model_path: str = None,
+    sovits_model_path: str = None,
 ):
+    try:
+        speaker = await get_speaker(gpt_model_path, sovits_model_path)
+    except Exception as e:
+        return JSONResponse({"code": 400, "message": str(e)}, status_code=400)
     return handle(
         refer_wav_path,
         prompt_text,
@@ -1388,6 +1689,10 @@ async def tts_endpoint(
         inp_refs,
         sample_steps,
         if_sr,
+        seed,
+        streaming_mode,
+        media_type,
+        speaker,
     )
 
 
@@ -7,6 +7,9 @@
     `-a` - `绑定地址, 默认"127.0.0.1"`
     `-p` - `绑定端口, 默认9880`
     `-c` - `TTS配置文件路径, 默认"GPT_SoVITS/configs/tts_infer.yaml"`
+    `-cb` - `T2S连续批处理的最大batch, 默认0(关闭)。开启后并发请求在同一个解码batch中逐步生成`
+    `-fcs` - `文本前端(phones/BERT)缓存条数, 默认1024, 0为关闭`
+    `-fcd` - `文本前端缓存落盘目录, 默认不落盘`
 
 ## 调用:
 
@@ -40,13 +43,22 @@ POST:
     "parallel_infer": True,       # bool. whether to use parallel inference.
     "repetition_penalty": 1.35,   # float. repetition penalty for T2S model.
     "sample_steps": 32,           # int. number of sampling steps for VITS model V3.
-    "super_sampling": False       # bool. whether to use super-sampling for audio when using VITS model V3.
+    "cfm_solver": "euler",        # str. ODE solver for VITS model V3/V4: "euler", "midpoint", "heun", "multistep".
+    "super_sampling": False,      # bool. whether to use super-sampling for audio when using VITS model V3.
+    "prefix_cache": False,        # bool. whether to reuse the cached K/V of the prompt text in the T2S model.
+    "priority": 0,                # int. queue priority, larger runs first.
+    "timeout": None,              # float. seconds from queueing to the first chunk (whole result if not streaming), default: --request_timeout.
+    "gpt_weights_path": "",       # str.(optional) GPT weights of the voice to use, default: the current default model.
+    "sovits_weights_path": ""     # str.(optional) SoVITS weights of the voice to use, default: the current default model.
 }
 ```
 
 RESP:
-成功: 直接返回 wav 音频流， http code 200
+成功: 直接返回 wav 音频流， http code 200, 响应头 X-Queue-Position / X-Queue-Wait 为入队时前面的任务数和排队耗时(秒)
 失败: 返回包含错误信息的 json, http code 400
+指定的音色未常驻时在后台加载, 加载完成后再排队合成, 不影响其他音色的请求
+排队已满: 返回包含队列状态的 json, http code 429
+超时: 返回包含错误信息的 json, http code 504
 
 ### 命令控制
 
@@ -74,6 +86,8 @@ RESP: 无
 
 endpoint: `/set_gpt_weights`
 
+切换的是默认音色, 已常驻的权重不会重新加载
+
 GET:
 ```
 http://127.0.0.1:9880/set_gpt_weights?weights_path=GPT_SoVITS/pretrained_models/s1bert25hz-2kh-longer-epoch=68e-step=50232.ckpt
@@ -96,18 +110,54 @@ RESP:
 成功: 返回"success", http code 200
 失败: 返回包含错误信息的 json, http code 400
 
+### 文本前端缓存统计
+
+endpoint: `/frontend_cache`
+
+GET:
+```
+http://127.0.0.1:9880/frontend_cache
+```
+
+RESP:
+返回包含 size / max_size / hits / misses / hit_rate 的 json, http code 200
+
+### 推理队列状态
+
+endpoint: `/queue`
+
+GET:
+```
+http://127.0.0.1:9880/queue
+```
+
+RESP:
+返回包含 queued / running / workers / max_queue / timeout 的 json, http code 200
+
+### 常驻模型
+
+endpoint: `/models`
+
+GET:
+```
+http://127.0.0.1:9880/models
+```
+
+RESP:
+返回默认音色和模型池状态(常驻模型 / 加载中 / 占用显存 / 命中次数)的 json, http code 200
+
 """
 
 import os
 import sys
 import traceback
-from typing import Generator
 
 now_dir = os.getcwd()
 sys.path.append(now_dir)
 sys.path.append("%s/GPT_SoVITS" % (now_dir))
 
 import argparse
+import asyncio
 import subprocess
 import wave
 import signal
@@ -119,7 +169,11 @@ import uvicorn
 from io import BytesIO
 from tools.i18n.i18n import I18nAuto
 from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
+from GPT_SoVITS.TTS_infer_pack.InferenceExecutor import InferenceExecutor, InferenceTimeout, QueueFullError
 from GPT_SoVITS.TTS_infer_pack.text_segmentation_method import get_method_names as get_cut_method_names
+from text.frontend_cache import frontend_cache
+from module.models import CFM_SOLVERS
+from tools.model_pool import ModelPool
 from pydantic import BaseModel
 
 # print(sys.path)
@@ -130,6 +184,23 @@ parser = argparse.ArgumentParser(description="GPT-SoVITS api")
 parser.add_argument("-c", "--tts_config", type=str, default="GPT_SoVITS/configs/tts_infer.yaml", help="tts_infer路径")
 parser.add_argument("-a", "--bind_addr", type=str, default="127.0.0.1", help="default: 127.0.0.1")
 parser.add_argument("-p", "--port", type=int, default="9880", help="default: 9880")
+parser.add_argument(
+    "-cb", "--continuous_batching", type=int, default=0, help="T2S连续批处理的最大batch, 0为关闭, default: 0"
+)
+parser.add_argument("-fcs", "--frontend_cache_size", type=int, default=1024, help="文本前端缓存条数, default: 1024")
+parser.add_argument("-fcd", "--frontend_cache_dir", type=str, default="", help="文本前端缓存落盘目录, 默认不落盘")
+parser.add_argument(
+    "-fcds", "--frontend_cache_disk_size", type=int, default=4096, help="文本前端缓存落盘条数上限, default: 4096"
+)
+parser.add_argument(
+    "-iw", "--infer_workers", type=int, default=0, help="推理线程数, 0为自动(连续批处理时等于其batch, 否则为1)"
+)
+parser.add_argument("-mq", "--max_queue", type=int, default=32, help="最大排队请求数, 超出返回429, default: 32")
+parser.add_argument(
+    "-rt", "--request_timeout", type=float, default=300, help="排队加出第一段音频的超时(秒), 0为不限, default: 300"
+)
+parser.add_argument("-mm", "--max_models", type=int, default=4, help="最多常驻的 (GPT, SoVITS) 音色数, default: 4")
+parser.add_argument("-mmb", "--model_memory", type=float, default=0, help="常驻音色权重的显存预算(GB), 0为不限")
 args = parser.parse_args()
 config_path = args.tts_config
 # device = args.device
@@ -140,9 +211,33 @@ argv = sys.argv
 if config_path in [None, ""]:
     config_path = "GPT-SoVITS/configs/tts_infer.yaml"
 
+frontend_cache.configure(args.frontend_cache_size, args.frontend_cache_dir, args.frontend_cache_disk_size)
+
 tts_config = TTS_Config(config_path)
 print(tts_config)
 tts_pipeline = TTS(tts_config)
+if args.continuous_batching > 0:
+    tts_pipeline.enable_continuous_batching(args.continuous_batching)
+### 推理和切换权重都在执行器的线程里进行, 事件循环只负责排队和收发数据
+### 未开启连续批处理时只用一个推理线程, 请求按优先级依次合成
+infer_workers = args.infer_workers or max(1, args.continuous_batching)
+executor = InferenceExecutor(infer_workers, args.max_queue, args.request_timeout)
+
+
+def load_tts(key):
+    tts = tts_pipeline.fork(*key)
+    if args.continuous_batching > 0 and tts.t2s_scheduler is None:
+        tts.enable_continuous_batching(args.continuous_batching)
+    return tts
+
+
+### 多音色常驻: 以 (gpt, sovits) 权重路径为键缓存 TTS 实例, 共享 BERT / HuBERT 等模型, 按显存预算 LRU 淘汰
+model_pool = ModelPool(
+    load_tts, args.max_models, int(args.model_memory * 1024**3), size_fn=TTS.model_memory, on_evict=TTS.release
+)
+default_model = (tts_config.t2s_weights_path, tts_config.vits_weights_path)
+model_pool.put(default_model, tts_pipeline)
+model_pool.pin(default_model)
 
 APP = FastAPI()
 
@@ -169,7 +264,13 @@ class TTS_Request(BaseModel):
     parallel_infer: bool = True
     repetition_penalty: float = 1.35
     sample_steps: int = 32
+    cfm_solver: str = "euler"
     super_sampling: bool = False
+    prefix_cache: bool = False
+    priority: int = 0
+    timeout: float = None
+    gpt_weights_path: str = None
+    sovits_weights_path: str = None
 
 
 ### modify from https://github.com/RVC-Boss/GPT-SoVITS/pull/894/files
@@ -257,7 +358,19 @@ def handle_control(command: str):
         exit(0)
 
 
-def check_params(req: dict):
+def set_default_model(key):
+    """切换默认音色, 并像原来切换权重一样写回配置文件"""
+    global default_model
+    tts = model_pool.get(key)
+    model_pool.pin(key)
+    if key != default_model:
+        model_pool.unpin(default_model)
+    default_model = key
+    # fork 出来的实例不写配置文件, 这里显式调用一次
+    TTS_Config.save_configs(tts.configs)
+
+
+def check_params(req: dict, configs: TTS_Config):
     text: str = req.get("text", "")
     text_lang: str = req.get("text_lang", "")
     ref_audio_path: str = req.get("ref_audio_path", "")
@@ -265,6 +378,7 @@ def check_params(req: dict):
     media_type: str = req.get("media_type", "wav")
     prompt_lang: str = req.get("prompt_lang", "")
     text_split_method: str = req.get("text_split_method", "cut5")
+    cfm_solver: str = req.get("cfm_solver", "euler")
 
     if ref_audio_path in [None, ""]:
         return JSONResponse(status_code=400, content={"message": "ref_audio_path is required"})
@@ -272,17 +386,17 @@ def check_params(req: dict):
         return JSONResponse(status_code=400, content={"message": "text is required"})
     if text_lang in [None, ""]:
         return JSONResponse(status_code=400, content={"message": "text_lang is required"})
-    elif text_lang.lower() not in tts_config.languages:
+    elif text_lang.lower() not in configs.languages:
         return JSONResponse(
             status_code=400,
-            content={"message": f"text_lang: {text_lang} is not supported in version {tts_config.version}"},
+            content={"message": f"text_lang: {text_lang} is not supported in version {configs.version}"},
         )
     if prompt_lang in [None, ""]:
         return JSONResponse(status_code=400, content={"message": "prompt_lang is required"})
-    elif prompt_lang.lower() not in tts_config.languages:
+    elif prompt_lang.lower() not in configs.languages:
         return JSONResponse(
             status_code=400,
-            content={"message": f"prompt_lang: {prompt_lang} is not supported in version {tts_config.version}"},
+            content={"message": f"prompt_lang: {prompt_lang} is not supported in version {configs.version}"},
         )
     if media_type not in ["wav", "raw", "ogg", "aac"]:
         return JSONResponse(status_code=400, content={"message": f"media_type: {media_type} is not supported"})
@@ -293,6 +407,8 @@ def check_params(req: dict):
         return JSONResponse(
             status_code=400, content={"message": f"text_split_method:{text_split_method} is not supported"}
         )
+    if cfm_solver not in CFM_SOLVERS:
+        return JSONResponse(status_code=400, content={"message": f"cfm_solver:{cfm_solver} is not supported"})
 
     return None
 
@@ -325,7 +441,13 @@ async def tts_handle(req: dict):
                 "parallel_infer": True,       # bool.(optional) whether to use parallel inference.
                 "repetition_penalty": 1.35    # float.(optional) repetition penalty for T2S model.
                 "sample_steps": 32,           # int. number of sampling steps for VITS model V3.
+                "cfm_solver": "euler",        # str. ODE solver for VITS model V3/V4: "euler", "midpoint", "heun", "multistep".
                 "super_sampling": False,       # bool. whether to use super-sampling for audio when using VITS model V3.
+                "prefix_cache": False,        # bool. whether to reuse the cached K/V of the prompt text in the T2S model.
+                "priority": 0,                # int. queue priority, larger runs first.
+                "timeout": None,              # float. seconds from queueing to the first audio chunk.
+                "gpt_weights_path": "",       # str.(optional) GPT weights of the voice, default: the default model.
+                "sovits_weights_path": "",    # str.(optional) SoVITS weights of the voice, default: the default model.
             }
     returns:
         StreamingResponse: audio stream response.
@@ -335,42 +457,82 @@ async def tts_handle(req: dict):
     return_fragment = req.get("return_fragment", False)
     media_type = req.get("media_type", "wav")
 
-    check_res = check_params(req)
+    model_key = (
+        req.get("gpt_weights_path") or default_model[0],
+        req.get("sovits_weights_path") or default_model[1],
+    )
+    for weights_path in model_key:
+        if not os.path.exists(weights_path):
+            return JSONResponse(status_code=400, content={"message": f"{weights_path} not exists"})
+    try:
+        ### 未常驻的音色在模型池的后台线程中加载, 事件循环只等待其完成
+        tts = await asyncio.wrap_future(model_pool.load(model_key))
+    except Exception as e:
+        return JSONResponse(status_code=400, content={"message": "load model failed", "Exception": str(e)})
+
+    check_res = check_params(req, tts.configs)
     if check_res is not None:
         return check_res
 
     if streaming_mode or return_fragment:
         req["return_fragment"] = True
 
-    try:
-        tts_generator = tts_pipeline.run(req)
-
-        if streaming_mode:
-
-            def streaming_generator(tts_generator: Generator, media_type: str):
-                if_frist_chunk = True
+    def run_streaming():
+        with model_pool.acquire(model_key) as tts:
+            tts_generator = tts.run(req)
+            try:
+                chunk_media_type = media_type
                 for sr, chunk in tts_generator:
-                    if if_frist_chunk and media_type == "wav":
+                    if chunk_media_type == "wav":
                         yield wave_header_chunk(sample_rate=sr)
-                        media_type = "raw"
-                        if_frist_chunk = False
-                    yield pack_audio(BytesIO(), chunk, sr, media_type).getvalue()
-
-            # _media_type = f"audio/{media_type}" if not (streaming_mode and media_type in ["wav", "raw"]) else f"audio/x-{media_type}"
-            return StreamingResponse(
-                streaming_generator(
-                    tts_generator,
-                    media_type,
-                ),
-                media_type=f"audio/{media_type}",
-            )
-
-        else:
-            sr, audio_data = next(tts_generator)
-            audio_data = pack_audio(BytesIO(), audio_data, sr, media_type).getvalue()
-            return Response(audio_data, media_type=f"audio/{media_type}")
+                        chunk_media_type = "raw"
+                    yield pack_audio(BytesIO(), chunk, sr, chunk_media_type).getvalue()
+            finally:
+                tts_generator.close()
+
+    def run():
+        with model_pool.acquire(model_key) as tts:
+            sr, audio_data = next(tts.run(req))
+        yield pack_audio(BytesIO(), audio_data, sr, media_type).getvalue()
+
+    try:
+        job = executor.submit(run_streaming if streaming_mode else run, req.get("priority") or 0, req.get("timeout"))
+    except QueueFullError as e:
+        return JSONResponse(
+            status_code=429,
+            content={"message": "too many requests", "Exception": str(e), **executor.stats()},
+            headers={"Retry-After": "1"},
+        )
+
+    try:
+        ### 等到第一段音频再返回响应, 排队和合成阶段的错误仍能以 json 返回
+        audio_data = await job.result()
+    except InferenceTimeout as e:
+        return JSONResponse(status_code=504, content={"message": "tts timeout", "Exception": str(e)})
     except Exception as e:
+        job.cancel()
         return JSONResponse(status_code=400, content={"message": "tts failed", "Exception": str(e)})
+    except BaseException:
+        ### 客户端在排队或等第一段音频时断开(CancelledError), 不再为其合成剩余句段
+        job.cancel()
+        raise
+
+    if not streaming_mode:
+        return Response(audio_data, media_type=f"audio/{media_type}", headers=job.headers())
+
+    async def streaming_generator():
+        try:
+            yield audio_data
+            async for chunk in job:
+                yield chunk
+        except Exception:
+            traceback.print_exc()
+        finally:
+            ### 客户端断开或超时后推理线程不再继续合成
+            job.cancel()
+
+    # _media_type = f"audio/{media_type}" if not (streaming_mode and media_type in ["wav", "raw"]) else f"audio/x-{media_type}"
+    return StreamingResponse(streaming_generator(), media_type=f"audio/{media_type}", headers=job.headers())
 
 
 @APP.get("/control")
@@ -403,7 +565,13 @@ async def tts_get_endpoint(
     parallel_infer: bool = True,
     repetition_penalty: float = 1.35,
     sample_steps: int = 32,
+    cfm_solver: str = "euler",
     super_sampling: bool = False,
+    prefix_cache: bool = False,
+    priority: int = 0,
+    timeout: float = None,
+    gpt_weights_path: str = None,
+    sovits_weights_path: str = None,
 ):
     req = {
         "text": text,
@@ -427,7 +595,13 @@ async def tts_get_endpoint(
         "parallel_infer": parallel_infer,
         "repetition_penalty": float(repetition_penalty),
         "sample_steps": int(sample_steps),
+        "cfm_solver": cfm_solver,
         "super_sampling": super_sampling,
+        "prefix_cache": prefix_cache,
+        "priority": priority,
+        "timeout": timeout,
+        "gpt_weights_path": gpt_weights_path,
+        "sovits_weights_path": sovits_weights_path,
     }
     return await tts_handle(req)
 
@@ -440,8 +614,12 @@ async def tts_post_endpoint(request: TTS_Request):
 
 @APP.get("/set_refer_audio")
 async def set_refer_aduio(refer_audio_path: str = None):
+    def set_ref_audio():
+        with model_pool.acquire(default_model) as tts:
+            tts.set_ref_audio(refer_audio_path)
+
     try:
-        tts_pipeline.set_ref_audio(refer_audio_path)
+        await executor.call(set_ref_audio, priority=1, force=True)
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "set refer audio failed", "Exception": str(e)})
     return JSONResponse(status_code=200, content={"message": "success"})
@@ -471,7 +649,9 @@ async def set_gpt_weights(weights_path: str = None):
     try:
         if weights_path in ["", None]:
             return JSONResponse(status_code=400, content={"message": "gpt weight path is required"})
-        tts_pipeline.init_t2s_weights(weights_path)
+        key = (weights_path, default_model[1])
+        await asyncio.wrap_future(model_pool.load(key))
+        set_default_model(key)
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "change gpt weight failed", "Exception": str(e)})
 
@@ -483,12 +663,29 @@ async def set_sovits_weights(weights_path: str = None):
     try:
         if weights_path in ["", None]:
             return JSONResponse(status_code=400, content={"message": "sovits weight path is required"})
-        tts_pipeline.init_vits_weights(weights_path)
+        key = (default_model[0], weights_path)
+        await asyncio.wrap_future(model_pool.load(key))
+        set_default_model(key)
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "change sovits weight failed", "Exception": str(e)})
     return JSONResponse(status_code=200, content={"message": "success"})
 
 
+@APP.get("/frontend_cache")
+async def frontend_cache_stats():
+    return JSONResponse(status_code=200, content=frontend_cache.stats())
+
+
+@APP.get("/queue")
+async def queue_stats():
+    return JSONResponse(status_code=200, content=executor.stats())
+
+
+@APP.get("/models")
+async def models_stats():
+    return JSONResponse(status_code=200, content={"default": list(default_model), **model_pool.stats()})
+
+
 if __name__ == "__main__":
     try:
         if host == "None":  # 在调用时使用 -a None 参数，可以让api监听双栈
@@ -0,0 +1,123 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.slicer2 import Slicer, get_rms
+
+
+def reference_sil_tags(slicer, samples):
+    """向量化之前的逐帧循环, 作为切点的基准"""
+    rms_list = get_rms(y=samples, frame_length=slicer.win_size, hop_length=slicer.hop_size).squeeze(0)
+    sil_tags = []
+    silence_start = None
+    clip_start = 0
+    for i, rms in enumerate(rms_list):
+        if rms < slicer.threshold:
+            if silence_start is None:
+                silence_start = i
+            continue
+        if silence_start is None:
+            continue
+        is_leading_silence = silence_start == 0 and i > slicer.max_sil_kept
+        need_slice_middle = i - silence_start >= slicer.min_interval and i - clip_start >= slicer.min_length
+        if not is_leading_silence and not need_slice_middle:
+            silence_start = None
+            continue
+        if i - silence_start <= slicer.max_sil_kept:
+            pos = rms_list[silence_start : i + 1].argmin() + silence_start
+            if silence_start == 0:
+                sil_tags.append((0, pos))
+            else:
+                sil_tags.append((pos, pos))
+            clip_start = pos
+        elif i - silence_start <= slicer.max_sil_kept * 2:
+            pos = rms_list[i - slicer.max_sil_kept : silence_start + slicer.max_sil_kept + 1].argmin()
+            pos += i - slicer.max_sil_kept
+            pos_l = rms_list[silence_start : silence_start + slicer.max_sil_kept + 1].argmin() + silence_start
+            pos_r = rms_list[i - slicer.max_sil_kept : i + 1].argmin() + i - slicer.max_sil_kept
+            if silence_start == 0:
+                sil_tags.append((0, pos_r))
+                clip_start = pos_r
+            else:
+                sil_tags.append((min(pos_l, pos), max(pos_r, pos)))
+                clip_start = max(pos_r, pos)
+        else:
+            pos_l = rms_list[silence_start : silence_start + slicer.max_sil_kept + 1].argmin() + silence_start
+            pos_r = rms_list[i - slicer.max_sil_kept : i + 1].argmin() + i - slicer.max_sil_kept
+            if silence_start == 0:
+                sil_tags.append((0, pos_r))
+            else:
+                sil_tags.append((pos_l, pos_r))
+            clip_start = pos_r
+        silence_start = None
+    total_frames = rms_list.shape[0]
+    if silence_start is not None and total_frames - silence_start >= slicer.min_interval:
+        silence_end = min(total_frames, silence_start + slicer.max_sil_kept)
+        pos = rms_list[silence_start : silence_end + 1].argmin() + silence_start
+        sil_tags.append((pos, total_frames + 1))
+    return sil_tags, total_frames
+
+
+def reference_chunks(slicer, samples):
+    if samples.shape[0] <= slicer.min_length:
+        return [(0, samples.shape[0])]
+    sil_tags, total_frames = reference_sil_tags(slicer, samples)
+    hop = slicer.hop_size
+    if not sil_tags:
+        return [(0, total_frames * hop)]
+    bounds = []
+    if sil_tags[0][0] > 0:
+        bounds.append((0, sil_tags[0][0] * hop))
+    for i in range(len(sil_tags) - 1):
+        bounds.append((sil_tags[i][1] * hop, sil_tags[i + 1][0] * hop))
+    if sil_tags[-1][1] < total_frames:
+        bounds.append((sil_tags[-1][1] * hop, total_frames * hop))
+    return bounds
+
+
+def synth_audio(sr, segments, seed=0):
+    """segments: [(秒, 是否有声)], 静音段带有随机的微弱噪声, 让 argmin 的位置有区分度"""
+    rng = np.random.default_rng(seed)
+    parts = []
+    for seconds, voiced in segments:
+        n = int(sr * seconds)
+        if voiced:
+            t = np.arange(n) / sr
+            parts.append(0.5 * np.sin(2 * np.pi * 220 * t) * (1 + 0.3 * rng.standard_normal(n)))
+        else:
+            parts.append(1e-4 * rng.standard_normal(n))
+    return np.concatenate(parts).astype(np.float32)
+
+
+CASES = [
+    # 结尾静音短于 max_sil_kept(webui 默认 300ms / 500ms 下的常见情况)
+    [(0.4, False), (6.0, True), (0.6, False), (5.5, True), (0.35, False)],
+    # 结尾静音长于 max_sil_kept, 中间有长静音
+    [(1.2, False), (5.5, True), (1.5, False), (6.0, True), (0.8, False), (5.2, True), (2.0, False)],
+    # 中间静音介于 max_sil_kept 与 2 * max_sil_kept 之间, 无结尾静音
+    [(5.2, True), (0.8, False), (5.2, True), (0.45, False), (5.5, True)],
+]
+
+
+@pytest.mark.parametrize("segments", CASES)
+@pytest.mark.parametrize("block_size", [997, 32000])
+def test_slice_matches_reference(segments, block_size):
+    sr = 32000
+    slicer = Slicer(sr=sr, threshold=-34, min_length=4000, min_interval=300, hop_size=10, max_sil_kept=500)
+    samples = synth_audio(sr, segments)
+    expected = reference_chunks(slicer, samples)
+
+    chunks = slicer.slice(samples)
+    assert [(start, end) for _, start, end in chunks] == expected
+    for chunk, start, end in chunks:
+        np.testing.assert_array_equal(chunk, samples[start : min(end, samples.shape[0])])
+
+    blocks = (samples[i : i + block_size] for i in range(0, samples.shape[0], block_size))
+    stream_chunks = list(slicer.slice_stream(blocks))
+    assert [(start, end) for _, start, end in stream_chunks] == expected
+    for chunk, start, end in stream_chunks:
+        np.testing.assert_array_equal(chunk, samples[start : min(end, samples.shape[0])])
@@ -3,15 +3,26 @@ import os
 import time
 import traceback
 
+import numpy as np
 import torch
-from faster_whisper import WhisperModel
+from faster_whisper import WhisperModel, decode_audio
 from huggingface_hub import snapshot_download
 from huggingface_hub.errors import LocalEntryNotFoundError
 from tqdm import tqdm
 
 from tools.asr.config import get_models
-from tools.asr.funasr_asr import only_asr
+from tools.asr.funasr_asr import batch_asr
+from tools.asr.list_writer import ListWriter
 from tools.my_utils import load_cudnn
+from tools.prepare_pipeline import prefetch
+
+try:
+    from faster_whisper import BatchedInferencePipeline
+except ImportError:  # faster-whisper<1.1 没有批量推理, 逐条识别
+    BatchedInferencePipeline = None
+
+SAMPLING_RATE = 16000
+CHUNK_SAMPLES = 30 * SAMPLING_RATE  # whisper 一次最多处理 30 秒
 
 # fmt: off
 language_code_list = [
@@ -81,50 +92,123 @@ def download_model(model_size: str):
     return model_path
 
 
-def execute_asr(input_folder, output_folder, model_path, language, precision):
+def detect_language(model, audio):
+    """
+    只对前 30 秒做一次语种检测
+    """
+    audio = audio[:CHUNK_SAMPLES]
+    if hasattr(model, "detect_language"):
+        return model.detect_language(audio=audio)[0]
+    _, info = model.transcribe(audio, beam_size=1)  # 不迭代 segments, 只做语种检测
+    return info.language
+
+
+def transcribe_one(model, audio, language):
+    segments, _ = model.transcribe(
+        audio=audio,
+        beam_size=5,
+        vad_filter=True,
+        vad_parameters=dict(min_silence_duration_ms=700),
+        language=language,
+    )
+    return "".join(segment.text for segment in segments)
+
+
+def transcribe_whisper(model, pipeline, audios, language):
+    """
+    不超过 30 秒的切片首尾拼接, 每条切片作为一个 clip_timestamps 区间, 一次批量推理后按时间映射回各条;
+    更长的切片或没有批量推理时逐条识别
+    """
+    texts = [""] * len(audios)
+    short = [i for i, audio in enumerate(audios) if 0 < len(audio) <= CHUNK_SAMPLES] if pipeline is not None else []
+    for i in range(len(audios)):
+        if i not in short:
+            texts[i] = transcribe_one(model, audios[i], language)
+    if short:
+        clip_timestamps, starts, offset = [], [], 0
+        for i in short:
+            clip_timestamps.append({"start": offset, "end": offset + len(audios[i])})
+            starts.append(offset / SAMPLING_RATE)
+            offset += len(audios[i])
+        segments, _ = pipeline.transcribe(
+            np.concatenate([audios[i] for i in short]),
+            language=language,
+            beam_size=5,
+            batch_size=len(short),
+            clip_timestamps=clip_timestamps,
+        )
+        for segment in segments:
+            j = int(np.searchsorted(starts, (segment.start + segment.end) / 2, side="right")) - 1
+            texts[short[max(j, 0)]] += segment.text
+    return texts
+
+
+def transcribe_batch(model, pipeline, file_paths, language):
+    """
+    一个 batch 只检测一次语种, 中文整批交给 FunASR, 其余语种整批交给 faster whisper;
+    返回 [(音频路径, 语种, 文本)], 解码失败的音频不返回, 下次运行会重试
+    """
+    audios = {}
+    for file_path in file_paths:
+        try:
+            audios[file_path] = decode_audio(file_path, sampling_rate=SAMPLING_RATE)
+        except Exception:
+            print(file_path, traceback.format_exc())
+    file_paths = [file_path for file_path in file_paths if file_path in audios]
+    if not file_paths:
+        return []
+    if language is None:
+        language = detect_language(model, np.concatenate([audios[file_path] for file_path in file_paths]))
+
+    texts = [""] * len(file_paths)
+    if language == "zh":
+        print("检测为中文文本, 转 FunASR 处理")
+        texts = [text or "" for text in batch_asr(file_paths, language=language)]
+    # FunASR 没识别出内容的再交给 faster whisper
+    rest = [i for i, text in enumerate(texts) if text == ""]
+    if rest:
+        rest_texts = transcribe_whisper(model, pipeline, [audios[file_paths[i]] for i in rest], language)
+        for i, text in zip(rest, rest_texts):
+            texts[i] = text
+    return [(file_path, language.upper(), text) for file_path, text in zip(file_paths, texts)]
+
+
+def execute_asr(input_folder, output_folder, model_path, language, precision, batch_size=8, num_workers=1):
     if language == "auto":
         language = None  # 不设置语种由模型自动输出概率最高的语种
     print("loading faster whisper model:", model_path, model_path)
     device = "cuda" if torch.cuda.is_available() else "cpu"
-    model = WhisperModel(model_path, device=device, compute_type=precision)
+    # num_workers>1 时 CTranslate2 允许多个线程并发调用同一个模型
+    model = WhisperModel(model_path, device=device, compute_type=precision, num_workers=num_workers)
+    pipeline = BatchedInferencePipeline(model=model) if BatchedInferencePipeline is not None else None
 
     input_file_names = os.listdir(input_folder)
     input_file_names.sort()
 
-    output = []
     output_file_name = os.path.basename(input_folder)
-
-    for file_name in tqdm(input_file_names):
-        try:
-            file_path = os.path.join(input_folder, file_name)
-            segments, info = model.transcribe(
-                audio=file_path,
-                beam_size=5,
-                vad_filter=True,
-                vad_parameters=dict(min_silence_duration_ms=700),
-                language=language,
-            )
-            text = ""
-
-            if info.language == "zh":
-                print("检测为中文文本, 转 FunASR 处理")
-                text = only_asr(file_path, language=info.language.lower())
-
-            if text == "":
-                for segment in segments:
-                    text += segment.text
-            output.append(f"{file_path}|{output_file_name}|{info.language.upper()}|{text}")
-        except Exception as e:
-            print(e)
-            traceback.print_exc()
-
     output_folder = output_folder or "output/asr_opt"
     os.makedirs(output_folder, exist_ok=True)
     output_file_path = os.path.abspath(f"{output_folder}/{output_file_name}.list")
 
-    with open(output_file_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(output))
-        print(f"ASR 任务完成->标注文件路径: {output_file_path}\n")
+    writer = ListWriter(output_file_path)
+    file_paths = [os.path.join(input_folder, file_name) for file_name in input_file_names]
+    file_paths = [file_path for file_path in file_paths if file_path not in writer]
+    batches = [file_paths[i : i + batch_size] for i in range(0, len(file_paths), batch_size)]
+
+    def run_batch(batch):
+        return transcribe_batch(model, pipeline, batch, language)
+
+    with tqdm(total=len(file_paths)) as progress_bar:
+        for batch, results, error in prefetch(run_batch, batches, num_workers=num_workers, max_pending=num_workers):
+            if error is not None:
+                print(error)
+            else:
+                for file_path, lang, text in results:
+                    writer.write(file_path, output_file_name, lang, text)
+            progress_bar.update(len(batch))
+
+    writer.close()
+    print(f"ASR 任务完成->标注文件路径: {output_file_path}\n")
     return output_file_path
 
 
@@ -155,6 +239,8 @@ if __name__ == "__main__":
         choices=["float16", "float32", "int8"],
         help="fp16, int8 or fp32",
     )
+    parser.add_argument("-b", "--batch_size", type=int, default=8, help="Number of clips per batch.")
+    parser.add_argument("-w", "--num_workers", type=int, default=1, help="Number of batches transcribed in parallel.")
 
     cmd = parser.parse_args()
     model_size = cmd.model_size
@@ -167,4 +253,6 @@ if __name__ == "__main__":
         model_path=model_path,
         language=cmd.language,
         precision=cmd.precision,
+        batch_size=cmd.batch_size,
+        num_workers=cmd.num_workers,
     )
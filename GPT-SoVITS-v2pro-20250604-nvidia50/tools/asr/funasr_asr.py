@@ -2,6 +2,7 @@
 
 import argparse
 import os
+import threading
 import traceback
 
 # from funasr.utils import version_checker
@@ -9,7 +10,10 @@ import traceback
 from funasr import AutoModel
 from tqdm import tqdm
 
+from tools.asr.list_writer import ListWriter
+
 funasr_models = {}  # 存储模型避免重复加载
+funasr_lock = threading.Lock()  # faster whisper 多线程标注时共用同一个 FunASR 模型
 
 
 def only_asr(input_file, language):
@@ -22,6 +26,28 @@ def only_asr(input_file, language):
     return text
 
 
+def batch_asr(input_files, language):
+    """
+    一批音频一次交给 FunASR 识别; 整批失败时逐条重试, 仍失败的返回 None
+    """
+    with funasr_lock:
+        model = create_model(language)
+        try:
+            res = model.generate(input=list(input_files))
+            if len(res) == len(input_files):
+                return [item["text"] for item in res]
+        except:
+            print(traceback.format_exc())
+        texts = []
+        for input_file in input_files:
+            try:
+                texts.append(model.generate(input=input_file)[0]["text"])
+            except:
+                texts.append(None)
+                print(input_file, traceback.format_exc())
+        return texts
+
+
 def create_model(language="zh"):
     path_vad = "tools/asr/models/speech_fsmn_vad_zh-cn-16k-common-pytorch"
     path_punc = "tools/asr/models/punc_ct-transformer_zh-cn-common-vocab272727-pytorch"
@@ -68,31 +94,31 @@ def create_model(language="zh"):
         return model
 
 
-def execute_asr(input_folder, output_folder, model_size, language):
+def execute_asr(input_folder, output_folder, model_size, language, batch_size=16):
     input_file_names = os.listdir(input_folder)
     input_file_names.sort()
 
-    output = []
     output_file_name = os.path.basename(input_folder)
-
-    model = create_model(language)
-
-    for file_name in tqdm(input_file_names):
-        try:
-            print("\n" + file_name)
-            file_path = os.path.join(input_folder, file_name)
-            text = model.generate(input=file_path)[0]["text"]
-            output.append(f"{file_path}|{output_file_name}|{language.upper()}|{text}")
-        except:
-            print(traceback.format_exc())
-
     output_folder = output_folder or "output/asr_opt"
     os.makedirs(output_folder, exist_ok=True)
     output_file_path = os.path.abspath(f"{output_folder}/{output_file_name}.list")
 
-    with open(output_file_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(output))
-        print(f"ASR 任务完成->标注文件路径: {output_file_path}\n")
+    writer = ListWriter(output_file_path)
+    file_paths = [os.path.join(input_folder, file_name) for file_name in input_file_names]
+    file_paths = [file_path for file_path in file_paths if file_path not in writer]
+
+    create_model(language)
+
+    with tqdm(total=len(file_paths)) as progress_bar:
+        for i in range(0, len(file_paths), batch_size):
+            batch = file_paths[i : i + batch_size]
+            for file_path, text in zip(batch, batch_asr(batch, language)):
+                if text is not None:
+                    writer.write(file_path, output_file_name, language.upper(), text)
+            progress_bar.update(len(batch))
+
+    writer.close()
+    print(f"ASR 任务完成->标注文件路径: {output_file_path}\n")
     return output_file_path
 
 
@@ -109,10 +135,12 @@ if __name__ == "__main__":
     parser.add_argument(
         "-p", "--precision", type=str, default="float16", choices=["float16", "float32"], help="fp16 or fp32"
     )  # 还没接入
+    parser.add_argument("-b", "--batch_size", type=int, default=16, help="Number of files per FunASR call.")
     cmd = parser.parse_args()
     execute_asr(
         input_folder=cmd.input_folder,
         output_folder=cmd.output_folder,
         model_size=cmd.model_size,
         language=cmd.language,
+        batch_size=cmd.batch_size,
     )
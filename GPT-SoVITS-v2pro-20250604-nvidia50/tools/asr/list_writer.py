@@ -0,0 +1,45 @@
+import os
+import threading
+
+
+class ListWriter:
+    """
+    ASR 标注结果边识别边写: 每条结果立即追加到 <list>.partial 并 flush, 任务中断后重新运行会读取它并跳过已标注的音频;
+    close() 时按音频路径排序写出最终的 .list(与原来一次性写出的格式一致)并删除 .partial
+    """
+
+    def __init__(self, output_file_path):
+        self.output_file_path = output_file_path
+        self.partial_path = output_file_path + ".partial"
+        self.lock = threading.Lock()
+        self.lines = {}  # 音频路径 -> 标注行
+        if os.path.exists(self.partial_path):
+            with open(self.partial_path, "r", encoding="utf-8") as f:
+                content = f.read()
+            for line in content.split("\n"):
+                if len(line.split("|", 3)) == 4:
+                    self.lines[line.split("|", 1)[0]] = line
+            print(f"从上次中断处继续: 已标注 {len(self.lines)} 条")
+            if content and not content.endswith("\n"):
+                with open(self.partial_path, "a", encoding="utf-8") as f:
+                    f.write("\n")
+        self.file = open(self.partial_path, "a", encoding="utf-8")
+
+    def __contains__(self, file_path):
+        return file_path in self.lines
+
+    def write(self, file_path, speaker, language, text):
+        line = f"{file_path}|{speaker}|{language}|{text}".replace("\n", " ")
+        with self.lock:
+            self.lines[file_path] = line
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+            tmp_path = self.output_file_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write("\n".join(self.lines[file_path] for file_path in sorted(self.lines)))
+            os.replace(tmp_path, self.output_file_path)
+            os.remove(self.partial_path)
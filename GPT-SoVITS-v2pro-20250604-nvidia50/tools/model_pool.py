@@ -0,0 +1,136 @@
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class ModelPool:
+    """
+    常驻模型池: 按 key(一般为 (gpt 权重路径, sovits 权重路径))缓存加载好的模型, 切换音色不用重新读盘。
+
+    - 未命中的 key 在后台线程中加载, 同一个 key 并发请求只加载一次, 加载期间不影响其他音色的请求
+    - 数量超过 max_models 或占用超过 memory_budget(字节, 0 为不限)时按最近最少使用淘汰,
+      正在使用(acquire 中)和 pin 住的模型不淘汰, 刚加载的模型也不会被立即淘汰
+    """
+
+    def __init__(self, loader, max_models=4, memory_budget=0, size_fn=None, on_evict=None, num_workers=1):
+        self.loader = loader
+        self.max_models = max(1, max_models)
+        self.memory_budget = memory_budget
+        self.size_fn = size_fn
+        self.on_evict = on_evict
+        self.entries = OrderedDict()  # key -> {"model", "size", "refs"}
+        self.loading = {}  # key -> Future
+        self.pinned = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(num_workers, thread_name_prefix="ModelPool")
+
+    def put(self, key, model):
+        """登记一个已经加载好的模型(如启动时的默认模型)"""
+        with self.lock:
+            self.entries[key] = {"model": model, "size": self._size(model), "refs": 0}
+            self.entries.move_to_end(key)
+            self._evict(keep=key)
+
+    def load(self, key) -> Future:
+        """返回一个 Future, 模型已常驻时立即完成, 否则在后台加载"""
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                future = Future()
+                future.set_result(self.entries[key]["model"])
+                return future
+            if key not in self.loading:
+                self.misses += 1
+                self.loading[key] = self.pool.submit(self._load, key)
+            return self.loading[key]
+
+    def get(self, key):
+        return self.load(key).result()
+
+    @contextmanager
+    def acquire(self, key):
+        """使用期间引用计数加一, 不会被淘汰"""
+        while True:
+            model = self.get(key)
+            with self.lock:
+                # get 与加锁之间可能刚好被淘汰, 重新加载
+                if key in self.entries and self.entries[key]["model"] is model:
+                    self.entries[key]["refs"] += 1
+                    self.entries.move_to_end(key)
+                    break
+        try:
+            yield model
+        finally:
+            with self.lock:
+                if key in self.entries:
+                    self.entries[key]["refs"] -= 1
+                self._evict()
+
+    def pin(self, key):
+        with self.lock:
+            self.pinned.add(key)
+
+    def unpin(self, key):
+        with self.lock:
+            self.pinned.discard(key)
+            self._evict()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "models": [
+                    {"key": list(key), "size_mb": round(entry["size"] / 1024**2, 1), "in_use": entry["refs"]}
+                    for key, entry in self.entries.items()
+                ],
+                "loading": [list(key) for key in self.loading],
+                "max_models": self.max_models,
+                "memory_budget_mb": round(self.memory_budget / 1024**2, 1),
+                "memory_mb": round(sum(entry["size"] for entry in self.entries.values()) / 1024**2, 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _size(self, model):
+        return self.size_fn(model) if self.size_fn is not None else 0
+
+    def _load(self, key):
+        try:
+            model = self.loader(key)
+            size = self._size(model)
+            with self.lock:
+                self.entries[key] = {"model": model, "size": size, "refs": 0}
+                self._evict(keep=key)
+            return model
+        except Exception:
+            traceback.print_exc()
+            raise
+        finally:
+            with self.lock:
+                self.loading.pop(key, None)
+
+    def _evict(self, keep=None):
+        # 调用方持有 self.lock
+        while True:
+            memory = sum(entry["size"] for entry in self.entries.values())
+            over_budget = self.memory_budget > 0 and memory > self.memory_budget
+            if len(self.entries) <= self.max_models and not over_budget:
+                return
+            candidates = [
+                key
+                for key, entry in self.entries.items()
+                if entry["refs"] == 0 and key not in self.pinned and key != keep
+            ]
+            if not candidates:
+                return
+            entry = self.entries.pop(candidates[0])
+            self.evictions += 1
+            print("模型池淘汰: %s" % (candidates[0],))
+            if self.on_evict is not None:
+                self.on_evict(entry["model"])
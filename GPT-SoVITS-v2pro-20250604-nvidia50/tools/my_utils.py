@@ -37,6 +37,37 @@ def load_audio(file, sr):
     return np.frombuffer(out, np.float32).flatten()
 
 
+def load_audio_stream(file, sr, block_size=None):
+    """
+    load_audio 的流式版本, ffmpeg 解码结果按块 yield, 长录音不必整段读进内存; 默认每块 10 秒
+    """
+    file = clean_path(file)  # 防止小白拷路径头尾带了空格和"和回车
+    if os.path.exists(file) is False:
+        raise RuntimeError("You input a wrong audio path that does not exists, please fix it!")
+    block_bytes = (block_size or sr * 10) * 4
+    process = (
+        ffmpeg.input(file, threads=0)
+        .output("-", format="f32le", acodec="pcm_f32le", ac=1, ar=sr)
+        .global_args("-loglevel", "error")
+        .run_async(cmd=["ffmpeg", "-nostdin"], pipe_stdout=True)
+    )
+    try:
+        rest = b""
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            data = rest + data
+            n_bytes = len(data) // 4 * 4
+            rest = data[n_bytes:]
+            if n_bytes:
+                yield np.frombuffer(data[:n_bytes], np.float32)
+    finally:
+        process.stdout.close()
+        if process.wait() != 0:
+            raise RuntimeError(i18n("音频加载失败"))
+
+
 def clean_path(path_str: str):
     if path_str.endswith(("\\", "/")):
         return clean_path(path_str[0:-1])
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+prepare_datasets 特征提取的流水线工具:
+    prefetch        多线程解码/读取, 与 GPU 前向重叠
+    background      后台线程迭代一个生成器(如流式解码), 有界预取
+    bucket_batches  按长度分桶拼 batch, 控制 padding 比例
+    AsyncWriter     后台线程落盘, 不阻塞下一个 batch
+"""
+
+import os
+import queue
+import shutil
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import time as ttime
+
+import torch
+
+
+def prefetch(func, items, num_workers=4, max_pending=32):
+    """
+    多线程执行 func(item), 按输入顺序 yield (item, result, error), 出错时 result 为 None
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append((item, pool.submit(func, item)))
+            if len(pending) >= max_pending:
+                yield _pop_result(pending)
+        while pending:
+            yield _pop_result(pending)
+
+
+def _pop_result(pending):
+    item, future = pending.popleft()
+    try:
+        return item, future.result(), None
+    except Exception:
+        return item, None, traceback.format_exc()
+
+
+def background(iterable, max_pending=4):
+    """
+    在后台线程里迭代 iterable, 最多预取 max_pending 项; 迭代中的异常在消费端重新抛出
+    """
+    q = queue.Queue(max_pending)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def worker():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((None, e))
+            return
+        put((end, None))
+
+    threading.Thread(target=worker, daemon=True).start()
+    try:
+        while True:
+            item, e = q.get()
+            if e is not None:
+                raise e
+            if item is end:
+                return
+            yield item
+    finally:
+        # 消费端提前退出时让后台线程结束
+        stop.set()
+
+
+def bucket_batches(samples, get_len, batch_size=8, max_pad_ratio=0.1, window=64):
+    """
+    每攒够 window 条按长度排序, 贪心切成不超过 batch_size 条、最长不超过最短 (1+max_pad_ratio) 倍的 batch
+    """
+    buffer = []
+    for sample in samples:
+        buffer.append(sample)
+        if len(buffer) >= window:
+            yield from _split_buckets(buffer, get_len, batch_size, max_pad_ratio)
+            buffer = []
+    if buffer:
+        yield from _split_buckets(buffer, get_len, batch_size, max_pad_ratio)
+
+
+def _split_buckets(buffer, get_len, batch_size, max_pad_ratio):
+    buffer = sorted(buffer, key=get_len)
+    batch = []
+    for sample in buffer:
+        if batch and (len(batch) >= batch_size or get_len(sample) > get_len(batch[0]) * (1 + max_pad_ratio)):
+            yield batch
+            batch = []
+        batch.append(sample)
+    if batch:
+        yield batch
+
+
+def pad_stack(tensors, dim=-1):
+    """
+    沿 dim 右侧补零到同一长度后 stack, 返回 (batch, 各自长度)
+    """
+    lengths = [t.shape[dim] for t in tensors]
+    max_len = max(lengths)
+    padded = []
+    for t in tensors:
+        pad = [0, 0] * (t.dim() - 1 - (dim % t.dim()))
+        padded.append(torch.nn.functional.pad(t, pad + [0, max_len - t.shape[dim]]))
+    return torch.stack(padded), lengths
+
+
+class AsyncWriter:
+    """
+    后台线程执行写文件, 队列满时阻塞, 避免结果堆积占内存
+    """
+
+    def __init__(self, num_workers=2, max_pending=64, tag=""):
+        self.tag = tag
+        self.pool = ThreadPoolExecutor(max_workers=num_workers)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.counter = 0
+        self.errors = []
+
+    def submit(self, func, *args):
+        self.slots.acquire()
+        future = self.pool.submit(func, *args)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        self.slots.release()
+        e = future.exception()
+        if e is not None:
+            error = "".join(traceback.format_exception(type(e), e, e.__traceback__))
+            print(error)
+            self.errors.append(error)
+
+    def save(self, fea, path):
+        return self.submit(self._save, fea, path)
+
+    def _save(self, fea, path):  #####fix issue: torch.save doesn't support chinese path
+        with self.lock:
+            self.counter += 1
+            tmp_path = "%s%s_%s.pth" % (ttime(), self.tag, self.counter)
+        torch.save(fea, tmp_path)
+        shutil.move(tmp_path, "%s/%s" % (os.path.dirname(path), os.path.basename(path)))
+
+    def close(self):
+        self.pool.shutdown(wait=True)
@@ -6,10 +6,24 @@ from scipy.io import wavfile
 
 # parent_directory = os.path.dirname(os.path.abspath(__file__))
 # sys.path.append(parent_directory)
-from tools.my_utils import load_audio
+from tools.my_utils import load_audio_stream
+from tools.prepare_pipeline import AsyncWriter
 from slicer2 import Slicer
 
 
+def write_chunk(path, chunk, _max, alpha):
+    tmp_max = np.abs(chunk).max()
+    if tmp_max > 1:
+        chunk /= tmp_max
+    chunk = (chunk / tmp_max * (_max * alpha)) + (1 - alpha) * chunk
+    wavfile.write(
+        path,
+        32000,
+        # chunk.astype(np.float32),
+        (chunk * 32767).astype(np.int16),
+    )
+
+
 def slice(inp, opt_root, threshold, min_length, min_interval, hop_size, max_sil_kept, _max, alpha, i_part, all_part):
     os.makedirs(opt_root, exist_ok=True)
     if os.path.isfile(inp):
@@ -28,25 +42,17 @@ def slice(inp, opt_root, threshold, min_length, min_interval, hop_size, max_sil_
     )
     _max = float(_max)
     alpha = float(alpha)
+    # 边解码边切, 切好的片段交给线程池写盘; 几个小时的直播录音也只占用一段切片的内存
+    writer = AsyncWriter(num_workers=4, max_pending=32)
     for inp_path in input[int(i_part) :: int(all_part)]:
         # print(inp_path)
         try:
             name = os.path.basename(inp_path)
-            audio = load_audio(inp_path, 32000)
-            # print(audio.shape)
-            for chunk, start, end in slicer.slice(audio):  # start和end是帧数
-                tmp_max = np.abs(chunk).max()
-                if tmp_max > 1:
-                    chunk /= tmp_max
-                chunk = (chunk / tmp_max * (_max * alpha)) + (1 - alpha) * chunk
-                wavfile.write(
-                    "%s/%s_%010d_%010d.wav" % (opt_root, name, start, end),
-                    32000,
-                    # chunk.astype(np.float32),
-                    (chunk * 32767).astype(np.int16),
-                )
+            for chunk, start, end in slicer.slice_stream(load_audio_stream(inp_path, 32000)):  # start和end是帧数
+                writer.submit(write_chunk, "%s/%s_%010d_%010d.wav" % (opt_root, name, start, end), chunk, _max, alpha)
         except:
             print(inp_path, "->fail->", traceback.format_exc())
+    writer.close()
     return "执行完毕，请检查输出文件"
 
 
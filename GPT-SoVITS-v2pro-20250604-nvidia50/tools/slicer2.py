@@ -10,7 +10,11 @@ def get_rms(
 ):
     padding = (int(frame_length // 2), int(frame_length // 2))
     y = np.pad(y, padding, mode=pad_mode)
+    return _frame_rms(y, frame_length, hop_length)
 
+
+def _frame_rms(y, frame_length, hop_length):
+    # 对已经 pad 好的 y 分帧求 RMS, 分块调用时每帧结果与整段调用一致
     axis = -1
     # put our new within-frame axis at the end for now
     out_strides = y.strides + tuple([y.strides[axis]])
@@ -35,7 +39,109 @@ def get_rms(
     return np.sqrt(power)
 
 
+class _SilenceTagger:
+    """
+    增量版的静音切点查找: 逐块喂入 RMS, 只在静音段结束(遇到第一个非静音帧)时做判断,
+    判断只回看不超过 2*max_sil_kept 帧, 因此无需预读, 切点与整段逐帧循环完全一致
+    """
+
+    def __init__(self, slicer):
+        self.threshold = slicer.threshold
+        self.min_length = slicer.min_length
+        self.min_interval = slicer.min_interval
+        self.max_sil_kept = slicer.max_sil_kept
+        self.rms = None
+        self.total_frames = 0
+        self.silence_start = None
+        self.clip_start = 0
+        self.prev_silent = False
+
+    def feed(self, rms_block):
+        """
+        追加一段 RMS, 返回新确定的 sil_tags
+        """
+        start = self.total_frames
+        end = start + rms_block.shape[0]
+        if self.rms is None:
+            self.rms = np.zeros(max(end, 1 << 16), dtype=rms_block.dtype)
+        elif end > self.rms.shape[0]:
+            rms = np.zeros(max(end, self.rms.shape[0] * 2), dtype=self.rms.dtype)
+            rms[:start] = self.rms[:start]
+            self.rms = rms
+        self.rms[start:end] = rms_block
+        self.total_frames = end
+        if end == start:
+            return []
+
+        silent = rms_block < self.threshold
+        prev = np.concatenate(([self.prev_silent], silent[:-1]))
+        self.prev_silent = bool(silent[-1])
+        tags = []
+        # 只遍历静音/非静音的交界处
+        for i in np.flatnonzero(silent != prev) + start:
+            if silent[i - start]:
+                # Record start of silent frames.
+                self.silence_start = i
+            else:
+                tag = self._on_silence_end(i)
+                if tag is not None:
+                    tags.append(tag)
+        return tags
+
+    def _on_silence_end(self, i):
+        # self.rms 末尾有补零的预留空间, 只看已写入的部分
+        rms_list = self.rms[: self.total_frames]
+        silence_start = self.silence_start
+        self.silence_start = None
+        # Clear recorded silence start if interval is not enough or clip is too short
+        is_leading_silence = silence_start == 0 and i > self.max_sil_kept
+        need_slice_middle = i - silence_start >= self.min_interval and i - self.clip_start >= self.min_length
+        if not is_leading_silence and not need_slice_middle:
+            return None
+        # Need slicing. Record the range of silent frames to be removed.
+        if i - silence_start <= self.max_sil_kept:
+            pos = rms_list[silence_start : i + 1].argmin() + silence_start
+            if silence_start == 0:
+                tag = (0, pos)
+            else:
+                tag = (pos, pos)
+            self.clip_start = pos
+        elif i - silence_start <= self.max_sil_kept * 2:
+            pos = rms_list[i - self.max_sil_kept : silence_start + self.max_sil_kept + 1].argmin()
+            pos += i - self.max_sil_kept
+            pos_l = rms_list[silence_start : silence_start + self.max_sil_kept + 1].argmin() + silence_start
+            pos_r = rms_list[i - self.max_sil_kept : i + 1].argmin() + i - self.max_sil_kept
+            if silence_start == 0:
+                tag = (0, pos_r)
+                self.clip_start = pos_r
+            else:
+                tag = (min(pos_l, pos), max(pos_r, pos))
+                self.clip_start = max(pos_r, pos)
+        else:
+            pos_l = rms_list[silence_start : silence_start + self.max_sil_kept + 1].argmin() + silence_start
+            pos_r = rms_list[i - self.max_sil_kept : i + 1].argmin() + i - self.max_sil_kept
+            if silence_start == 0:
+                tag = (0, pos_r)
+            else:
+                tag = (pos_l, pos_r)
+            self.clip_start = pos_r
+        return tag
+
+    def finish(self):
+        # Deal with trailing silence.
+        total_frames = self.total_frames
+        silence_start = self.silence_start
+        if silence_start is not None and total_frames - silence_start >= self.min_interval:
+            silence_end = min(total_frames, silence_start + self.max_sil_kept)
+            pos = self.rms[:total_frames][silence_start : silence_end + 1].argmin() + silence_start
+            return [(pos, total_frames + 1)]
+        return []
+
+
 class Slicer:
+    # 流式处理时每次求 RMS 的最大帧数, 控制分帧临时数组的大小
+    rms_block_frames = 4096
+
     def __init__(
         self,
         sr: int,
@@ -63,6 +169,24 @@ class Slicer:
         else:
             return waveform[begin * self.hop_size : min(waveform.shape[0], end * self.hop_size)]
 
+    def _iter_rms(self, blocks):
+        """
+        对依次到来的音频块求 RMS, 等价于 get_rms(整段), 每次只保留不足一帧的尾巴
+        """
+        pad = int(self.win_size // 2)
+        pending = np.zeros(pad, dtype=np.float32)
+        max_len = (self.rms_block_frames - 1) * self.hop_size + self.win_size
+        for block in blocks:
+            pending = np.concatenate((pending, block))
+            while pending.shape[0] >= self.win_size:
+                n_frames = (min(pending.shape[0], max_len) - self.win_size) // self.hop_size + 1
+                frames = pending[: (n_frames - 1) * self.hop_size + self.win_size]
+                yield _frame_rms(frames, self.win_size, self.hop_size)[0]
+                pending = pending[n_frames * self.hop_size :]
+        pending = np.concatenate((pending, np.zeros(pad, dtype=np.float32)))
+        if pending.shape[0] >= self.win_size:
+            yield _frame_rms(pending, self.win_size, self.hop_size)[0]
+
     # @timeit
     def slice(self, waveform):
         if len(waveform.shape) > 1:
@@ -71,60 +195,14 @@ class Slicer:
             samples = waveform
         if samples.shape[0] <= self.min_length:
             return [waveform]
-        rms_list = get_rms(y=samples, frame_length=self.win_size, hop_length=self.hop_size).squeeze(0)
+        block_size = self.rms_block_frames * self.hop_size
+        blocks = (samples[i : i + block_size] for i in range(0, samples.shape[0], block_size))
+        tagger = _SilenceTagger(self)
         sil_tags = []
-        silence_start = None
-        clip_start = 0
-        for i, rms in enumerate(rms_list):
-            # Keep looping while frame is silent.
-            if rms < self.threshold:
-                # Record start of silent frames.
-                if silence_start is None:
-                    silence_start = i
-                continue
-            # Keep looping while frame is not silent and silence start has not been recorded.
-            if silence_start is None:
-                continue
-            # Clear recorded silence start if interval is not enough or clip is too short
-            is_leading_silence = silence_start == 0 and i > self.max_sil_kept
-            need_slice_middle = i - silence_start >= self.min_interval and i - clip_start >= self.min_length
-            if not is_leading_silence and not need_slice_middle:
-                silence_start = None
-                continue
-            # Need slicing. Record the range of silent frames to be removed.
-            if i - silence_start <= self.max_sil_kept:
-                pos = rms_list[silence_start : i + 1].argmin() + silence_start
-                if silence_start == 0:
-                    sil_tags.append((0, pos))
-                else:
-                    sil_tags.append((pos, pos))
-                clip_start = pos
-            elif i - silence_start <= self.max_sil_kept * 2:
-                pos = rms_list[i - self.max_sil_kept : silence_start + self.max_sil_kept + 1].argmin()
-                pos += i - self.max_sil_kept
-                pos_l = rms_list[silence_start : silence_start + self.max_sil_kept + 1].argmin() + silence_start
-                pos_r = rms_list[i - self.max_sil_kept : i + 1].argmin() + i - self.max_sil_kept
-                if silence_start == 0:
-                    sil_tags.append((0, pos_r))
-                    clip_start = pos_r
-                else:
-                    sil_tags.append((min(pos_l, pos), max(pos_r, pos)))
-                    clip_start = max(pos_r, pos)
-            else:
-                pos_l = rms_list[silence_start : silence_start + self.max_sil_kept + 1].argmin() + silence_start
-                pos_r = rms_list[i - self.max_sil_kept : i + 1].argmin() + i - self.max_sil_kept
-                if silence_start == 0:
-                    sil_tags.append((0, pos_r))
-                else:
-                    sil_tags.append((pos_l, pos_r))
-                clip_start = pos_r
-            silence_start = None
-        # Deal with trailing silence.
-        total_frames = rms_list.shape[0]
-        if silence_start is not None and total_frames - silence_start >= self.min_interval:
-            silence_end = min(total_frames, silence_start + self.max_sil_kept)
-            pos = rms_list[silence_start : silence_end + 1].argmin() + silence_start
-            sil_tags.append((pos, total_frames + 1))
+        for rms_block in self._iter_rms(blocks):
+            sil_tags.extend(tagger.feed(rms_block))
+        sil_tags.extend(tagger.finish())
+        total_frames = tagger.total_frames
         # Apply and return slices.
         ####音频+起始时间+终止时间
         if len(sil_tags) == 0:
@@ -151,6 +229,64 @@ class Slicer:
                 )
             return chunks
 
+    def slice_stream(self, blocks):
+        """
+        slice 的流式版本, 输入为依次到来的单声道音频块,
+        切点确定后立即 yield [音频, 起始, 终止]。内存中只保留上一个切点之后的音频, 切点与 slice 完全一致
+        """
+        buffer = []  # 上一个切点之后的音频块
+        buffer_start = 0  # buffer 第一个采样点的下标
+        num_samples = 0
+        prev_end = None  # 上一个 sil_tag 的结束帧, None 表示还没有切点
+
+        def take(begin, end):
+            nonlocal buffer, buffer_start
+            # 取出 [begin, end) 帧对应的音频, 并丢弃 end 之前的部分
+            audio = np.concatenate(buffer) if len(buffer) > 1 else (buffer[0] if buffer else np.zeros(0, np.float32))
+            begin_sample = begin * self.hop_size - buffer_start
+            end_sample = min(num_samples, end * self.hop_size) - buffer_start
+            chunk = audio[begin_sample:end_sample].copy()
+            buffer = [audio[max(end_sample, 0) :].copy()]
+            buffer_start = buffer_start + max(end_sample, 0)
+            return chunk
+
+        def on_tag(tag):
+            nonlocal prev_end
+            chunk = None
+            if prev_end is None:
+                if tag[0] > 0:
+                    chunk = [take(0, tag[0]), 0, int(tag[0] * self.hop_size)]
+            else:
+                chunk = [take(prev_end, tag[0]), int(prev_end * self.hop_size), int(tag[0] * self.hop_size)]
+            prev_end = tag[1]
+            return chunk
+
+        def iter_blocks():
+            nonlocal num_samples
+            for block in blocks:
+                buffer.append(block)
+                num_samples += block.shape[0]
+                yield block
+
+        tagger = _SilenceTagger(self)
+        for rms_block in self._iter_rms(iter_blocks()):
+            for tag in tagger.feed(rms_block):
+                chunk = on_tag(tag)
+                if chunk is not None:
+                    yield chunk
+        if num_samples <= self.min_length:
+            yield [take(0, tagger.total_frames), 0, num_samples]
+            return
+        for tag in tagger.finish():
+            chunk = on_tag(tag)
+            if chunk is not None:
+                yield chunk
+        total_frames = tagger.total_frames
+        if prev_end is None:
+            yield [take(0, total_frames), 0, int(total_frames * self.hop_size)]
+        elif prev_end < total_frames:
+            yield [take(prev_end, total_frames), int(prev_end * self.hop_size), int(total_frames * self.hop_size)]
+
 
 def main():
     import os.path
@@ -1,6 +1,8 @@
 # This code is modified from https://github.com/ZFTurbo/
 import os
+import traceback
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import librosa
 import numpy as np
@@ -10,9 +12,36 @@ import torch.nn as nn
 import yaml
 from tqdm import tqdm
 
+from tools.prepare_pipeline import AsyncWriter, background
+
 warnings.filterwarnings("ignore")
 
 
+def reflect_pad_blocks(blocks, pad):
+    """
+    对分块到来的音频整体做两端 reflect pad, 结果与整段 F.pad(mode="reflect") 一致;
+    末尾始终扣住 pad+1 个采样, 等输入结束后再补右端
+    """
+    if pad == 0:
+        yield from blocks
+        return
+    tail = None
+    head_done = False
+    for block in blocks:
+        block = torch.as_tensor(block, dtype=torch.float32)
+        tail = block if tail is None else torch.cat([tail, block], dim=-1)
+        if not head_done:
+            if tail.shape[-1] <= pad:
+                continue
+            yield tail[..., 1 : pad + 1].flip(-1)
+            head_done = True
+        if tail.shape[-1] > pad + 1:
+            yield tail[..., : -(pad + 1)]
+            tail = tail[..., -(pad + 1) :]
+    yield tail
+    yield tail[..., -pad - 1 : -1].flip(-1)
+
+
 class Roformer_Loader:
     def get_config(self, config_path):
         with open(config_path, "r", encoding="utf-8") as f:
@@ -108,93 +137,136 @@ class Roformer_Loader:
             model = None
         return model
 
-    def demix_track(self, model, mix, device):
+    def get_windows(self, chunk_size, fade_size, device):
+        # Prepare windows arrays (do 1 time for speed up). This trick repairs click problems on the edges of segment
+        fadein = torch.linspace(0, 1, fade_size)
+        fadeout = torch.linspace(1, 0, fade_size)
+        window_start = torch.ones(chunk_size)
+        window_middle = torch.ones(chunk_size)
+        window_finish = torch.ones(chunk_size)
+        window_start[-fade_size:] *= fadeout  # First audio chunk, no fadein
+        window_finish[:fade_size] *= fadein  # Last audio chunk, no fadeout
+        window_middle[-fade_size:] *= fadeout
+        window_middle[:fade_size] *= fadein
+        return window_start.to(device), window_middle.to(device), window_finish.to(device)
+
+    def get_instruments(self):
+        if self.config["training"]["target_instrument"] is None:
+            return self.config["training"]["instruments"]
+        return [self.config["training"]["target_instrument"]]
+
+    def demix_stream(self, model, blocks, length_init, device):
+        """
+        流式分离: blocks 依次给出 (声道, 采样) 的音频块, length_init 为总采样数。
+        滑窗结果直接在 device 上 overlap-add, 每跑完一个 batch 就把之后不会再被覆盖的部分 yield 出来,
+        yield (原始音频段, {乐器: 分离结果段}), 占用内存只与 chunk_size * batch_size 有关, 与音频总长无关
+        """
         C = self.config["audio"]["chunk_size"]  # chunk_size
         N = self.config["inference"]["num_overlap"]
         fade_size = C // 10
         step = int(C // N)
         border = C - step
         batch_size = self.config["inference"]["batch_size"]
-
-        length_init = mix.shape[-1]
-        progress_bar = tqdm(total=length_init // step + 1, desc="Processing", leave=False)
+        instruments = self.get_instruments()
 
         # Do pad from the beginning and end to account floating window results better
-        if length_init > 2 * border and (border > 0):
-            mix = nn.functional.pad(mix, (border, border), mode="reflect")
+        pad = border if length_init > 2 * border and (border > 0) else 0
+        total = length_init + 2 * pad
+        progress_bar = tqdm(total=(total - 1) // step + 1, desc="Processing", leave=False)
+        window_start, window_middle, window_finish = self.get_windows(C, fade_size, device)
 
-        # Prepare windows arrays (do 1 time for speed up). This trick repairs click problems on the edges of segment
-        window_size = C
-        fadein = torch.linspace(0, 1, fade_size)
-        fadeout = torch.linspace(1, 0, fade_size)
-        window_start = torch.ones(window_size)
-        window_middle = torch.ones(window_size)
-        window_finish = torch.ones(window_size)
-        window_start[-fade_size:] *= fadeout  # First audio chunk, no fadein
-        window_finish[:fade_size] *= fadein  # Last audio chunk, no fadeout
-        window_middle[-fade_size:] *= fadeout
-        window_middle[:fade_size] *= fadein
+        padded_blocks = iter(reflect_pad_blocks(blocks, pad))
+        inp = None  # 补边后的输入中 [inp_start, ...) 这一段
+        inp_start = 0
+        result = counter = None  # device 上的累加区, 对应 [out_start, ...)
+        out_start = 0
 
         with torch.amp.autocast("cuda"):
             with torch.inference_mode():
-                if self.config["training"]["target_instrument"] is None:
-                    req_shape = (len(self.config["training"]["instruments"]),) + tuple(mix.shape)
-                else:
-                    req_shape = (1,) + tuple(mix.shape)
-
-                result = torch.zeros(req_shape, dtype=torch.float32)
-                counter = torch.zeros(req_shape, dtype=torch.float32)
                 i = 0
                 batch_data = []
                 batch_locations = []
-                while i < mix.shape[1]:
-                    part = mix[:, i : i + C].to(device)
+                while i < total:
+                    while inp is None or inp_start + inp.shape[-1] < min(i + C, total):
+                        block = torch.as_tensor(next(padded_blocks), dtype=torch.float32)
+                        inp = block if inp is None else torch.cat([inp, block], dim=-1)
+                    part = inp[..., i - inp_start : i - inp_start + C]
                     length = part.shape[-1]
                     if length < C:
                         if length > C // 2 + 1:
-                            part = nn.functional.pad(input=part, pad=(0, C - length), mode="reflect")
+                            part = nn.functional.pad(input=part.unsqueeze(0), pad=(0, C - length), mode="reflect")[0]
                         else:
-                            part = nn.functional.pad(input=part, pad=(0, C - length, 0, 0), mode="constant", value=0)
-                    if self.is_half:
-                        part = part.half()
+                            part = nn.functional.pad(input=part, pad=(0, C - length), mode="constant", value=0)
                     batch_data.append(part)
                     batch_locations.append((i, length))
                     i += step
                     progress_bar.update(1)
 
-                    if len(batch_data) >= batch_size or (i >= mix.shape[1]):
-                        arr = torch.stack(batch_data, dim=0)
-                        # print(23333333,arr.dtype)
-                        x = model(arr)
-
-                        window = window_middle
-                        if i - step == 0:  # First audio chunk, no fadein
-                            window = window_start
-                        elif i >= mix.shape[1]:  # Last audio chunk, no fadeout
-                            window = window_finish
-
-                        for j in range(len(batch_locations)):
-                            start, l = batch_locations[j]
-                            result[..., start : start + l] += x[j][..., :l].cpu() * window[..., :l]
-                            counter[..., start : start + l] += window[..., :l]
-
+                    if len(batch_data) >= batch_size or (i >= total):
+                        arr = torch.stack(batch_data, dim=0).to(device)
+                        if self.is_half:
+                            arr = arr.half()
+                        x = model(arr).float()
+
+                        need = batch_locations[-1][0] + batch_locations[-1][1] - out_start
+                        if result is None:
+                            result = torch.zeros((len(instruments),) + tuple(part.shape[:-1]) + (need,), device=device)
+                            counter = torch.zeros(need, device=device)
+                        elif result.shape[-1] < need:
+                            grow = need - result.shape[-1]
+                            result = nn.functional.pad(result, (0, grow))
+                            counter = nn.functional.pad(counter, (0, grow))
+                        for j, (start, l) in enumerate(batch_locations):
+                            window = window_middle
+                            if start == 0:  # First audio chunk, no fadein
+                                window = window_start
+                            elif start + step >= total:  # Last audio chunk, no fadeout
+                                window = window_finish
+                            result[..., start - out_start : start - out_start + l] += x[j][..., :l] * window[:l]
+                            counter[start - out_start : start - out_start + l] += window[:l]
                         batch_data = []
                         batch_locations = []
 
-                estimated_sources = result / counter
-                estimated_sources = estimated_sources.cpu().numpy()
-                np.nan_to_num(estimated_sources, copy=False, nan=0.0)
-
-                if length_init > 2 * border and (border > 0):
-                    # Remove pad
-                    estimated_sources = estimated_sources[..., border:-border]
+                        # 之后的 chunk 都从 i 开始, i 之前的结果已经不会再变
+                        ready = min(i, total)
+                        seg_start, seg_end = max(out_start, pad), min(ready, pad + length_init)
+                        if seg_end > seg_start:
+                            estimated_sources = (
+                                result[..., seg_start - out_start : seg_end - out_start]
+                                / counter[seg_start - out_start : seg_end - out_start]
+                            )
+                            estimated_sources = estimated_sources.cpu().numpy()
+                            np.nan_to_num(estimated_sources, copy=False, nan=0.0)
+                            mix = inp[..., seg_start - inp_start : seg_end - inp_start].numpy()
+                            yield mix, {k: v for k, v in zip(instruments, estimated_sources)}
+                        result = result[..., ready - out_start :]
+                        counter = counter[ready - out_start :]
+                        inp = inp[..., ready - inp_start :]
+                        out_start = inp_start = ready
 
         progress_bar.close()
 
-        if self.config["training"]["target_instrument"] is None:
-            return {k: v for k, v in zip(self.config["training"]["instruments"], estimated_sources)}
-        else:
-            return {k: v for k, v in zip([self.config["training"]["target_instrument"]], estimated_sources)}
+    def demix_track(self, model, mix, device):
+        res = {}
+        for _, sources in self.demix_stream(model, [mix], mix.shape[-1], device):
+            for k, v in sources.items():
+                res.setdefault(k, []).append(v)
+        return {k: np.concatenate(v, axis=-1) for k, v in res.items()}
+
+    def read_blocks(self, path, sample_rate, block_size=441000):
+        """
+        返回 (总采样数, 音频块生成器); 采样率一致且 soundfile 能直接读的文件分块读取, 否则整段 librosa 解码
+        """
+        try:
+            info = sf.info(path)
+        except Exception:
+            info = None
+        if info is not None and info.samplerate == sample_rate:
+            blocks = sf.blocks(path, blocksize=block_size, dtype="float32", always_2d=True)
+            return info.frames, (np.ascontiguousarray(block.T) for block in blocks)
+        mix, sr = librosa.load(path, sr=sample_rate, mono=False)
+        mix = np.atleast_2d(mix)
+        return mix.shape[-1], (mix[..., i : i + block_size] for i in range(0, mix.shape[-1], block_size))
 
     def run_folder(self, input, vocal_root, others_root, format):
         self.model.eval()
@@ -208,7 +280,7 @@ class Roformer_Loader:
             sample_rate = self.config["audio"]["sample_rate"]
 
         try:
-            mix, sr = librosa.load(path, sr=sample_rate, mono=False)
+            length, blocks = self.read_blocks(path, sample_rate)
         except Exception as e:
             print("Can read track: {}".format(path))
             print("Error message: {}".format(str(e)))
@@ -216,34 +288,74 @@ class Roformer_Loader:
 
         # in case if model only supports mono tracks
         isstereo = self.config["model"].get("stereo", True)
-        if not isstereo and len(mix.shape) != 1:
-            mix = np.mean(mix, axis=0)  # if more than 2 channels, take mean
-            print("Warning: Track has more than 1 channels, but model is mono, taking mean of all channels.")
-
-        mix_orig = mix.copy()
+        if not isstereo:
+            blocks = (np.mean(block, axis=0) if block.shape[0] != 1 else block[0] for block in blocks)
 
-        mixture = torch.tensor(mix, dtype=torch.float32)
-        res = self.demix_track(self.model, mixture, self.device)
-
-        if self.config["training"]["target_instrument"] is not None:
+        outputs = {}  # 乐器 -> 输出路径
+        target_instrument = self.config["training"]["target_instrument"]
+        if target_instrument is not None:
             # if target instrument is specified, save target instrument as vocal and other instruments as others
             # other instruments are caculated by subtracting target instrument from mixture
-            target_instrument = self.config["training"]["target_instrument"]
             other_instruments = [i for i in self.config["training"]["instruments"] if i != target_instrument]
-            other = mix_orig - res[target_instrument]  # caculate other instruments
-
-            path_vocal = "{}/{}_{}.wav".format(vocal_root, file_base_name, target_instrument)
-            path_other = "{}/{}_{}.wav".format(others_root, file_base_name, other_instruments[0])
-            self.save_audio(path_vocal, res[target_instrument].T, sr, format)
-            self.save_audio(path_other, other.T, sr, format)
+            outputs[target_instrument] = "{}/{}_{}.wav".format(vocal_root, file_base_name, target_instrument)
+            outputs[None] = "{}/{}_{}.wav".format(others_root, file_base_name, other_instruments[0])
         else:
             # if target instrument is not specified, save the first instrument as vocal and the rest as others
             vocal_inst = self.config["training"]["instruments"][0]
-            path_vocal = "{}/{}_{}.wav".format(vocal_root, file_base_name, vocal_inst)
-            self.save_audio(path_vocal, res[vocal_inst].T, sr, format)
+            outputs[vocal_inst] = "{}/{}_{}.wav".format(vocal_root, file_base_name, vocal_inst)
             for other in self.config["training"]["instruments"][1:]:  # save other instruments
-                path_other = "{}/{}_{}.wav".format(others_root, file_base_name, other)
-                self.save_audio(path_other, res[other].T, sr, format)
+                outputs[other] = "{}/{}_{}.wav".format(others_root, file_base_name, other)
+
+        # 解码(后台线程) -> 推理 -> 写盘(后台单线程, 保证顺序) 三段流水
+        writer = AsyncWriter(num_workers=1, max_pending=8)
+        files = {}
+        try:
+            for mix, res in self.demix_stream(self.model, background(blocks), length, self.device):
+                if target_instrument is not None:
+                    res[None] = mix - res[target_instrument]  # caculate other instruments
+                writer.submit(self.write_segment, files, outputs, res, sample_rate, format)
+        finally:
+            writer.close()
+            for f in files.values():
+                f.close()
+        if writer.errors:
+            # 写盘线程出错时输出不完整, 不能报成功
+            raise RuntimeError("write failed for %s:\n%s" % (path, writer.errors[0]))
+        for path_out in outputs.values():
+            self.convert_audio(path_out, format)
+
+    def write_segment(self, files, outputs, res, sr, format):
+        for k, path_out in outputs.items():
+            data = res[k]
+            if k not in files:
+                if format == "flac":
+                    path_out = path_out[:-3] + "flac"
+                channels = 1 if data.ndim == 1 else data.shape[0]
+                files[k] = sf.SoundFile(path_out, "w", samplerate=sr, channels=channels)
+            files[k].write(data.T)
+
+    def convert_audio(self, path, format):
+        # input path should be endwith '.wav', write_segment 已经写好 wav/flac, 其他格式再用 ffmpeg 转
+        if format not in ["wav", "flac"]:
+            os.system('ffmpeg -i "{}" -vn "{}" -q:a 2 -y'.format(path, path[:-3] + format))
+            try:
+                os.remove(path)
+            except:
+                pass
+
+    def run_files(self, paths, vocal_root, others_root, format, num_workers=2):
+        """
+        多个文件分给 num_workers 个线程并行处理, 共用同一个模型(只读推理), CPU 机器上可以把核吃满
+        按输入顺序逐个 yield 每个文件的处理结果, 供 webui 刷新进度
+        """
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            futures = [(path, pool.submit(self.run_folder, path, vocal_root, others_root, format)) for path in paths]
+            for path, future in futures:
+                try:
+                    future.result()
+                    yield "%s->Success" % (os.path.basename(path))
+                except Exception:
+                    yield "%s->%s" % (os.path.basename(path), traceback.format_exc())
 
     def save_audio(self, path, data, sr, format):
         # input path should be endwith '.wav'
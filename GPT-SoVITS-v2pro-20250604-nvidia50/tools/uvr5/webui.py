@@ -76,36 +76,45 @@ def uvr(model_name, inp_root, save_root_vocal, paths, save_root_ins, agg, format
             paths = [os.path.join(inp_root, name) for name in os.listdir(inp_root)]
         else:
             paths = [path.name for path in paths]
-        for path in paths:
-            inp_path = os.path.join(inp_root, path)
-            if os.path.isfile(inp_path) == False:
-                continue
-            need_reformat = 1
-            done = 0
-            try:
-                info = ffmpeg.probe(inp_path, cmd="ffprobe")
-                if info["streams"][0]["channels"] == 2 and info["streams"][0]["sample_rate"] == "44100":
-                    need_reformat = 0
-                    pre_fun._path_audio_(inp_path, save_root_ins, save_root_vocal, format0, is_hp3)
-                    done = 1
-            except:
-                need_reformat = 1
-                traceback.print_exc()
-            if need_reformat == 1:
-                tmp_path = "%s/%s.reformatted.wav" % (
-                    os.path.join(os.environ["TEMP"]),
-                    os.path.basename(inp_path),
-                )
-                os.system(f'ffmpeg -i "{inp_path}" -vn -acodec pcm_s16le -ac 2 -ar 44100 "{tmp_path}" -y')
-                inp_path = tmp_path
-            try:
-                if done == 0:
-                    pre_fun._path_audio_(inp_path, save_root_ins, save_root_vocal, format0, is_hp3)
-                infos.append("%s->Success" % (os.path.basename(inp_path)))
-                yield "\n".join(infos)
-            except:
-                infos.append("%s->%s" % (os.path.basename(inp_path), traceback.format_exc()))
+        if isinstance(pre_fun, Roformer_Loader):
+            # Roformer 自行解码任意格式和采样率, 无需先转 44.1k 双声道; 多个文件分给 uvr5_workers 个线程并行处理
+            inp_paths = [os.path.join(inp_root, path) for path in paths]
+            inp_paths = [path for path in inp_paths if os.path.isfile(path)]
+            num_workers = int(os.environ.get("uvr5_workers", "2"))
+            for info in pre_fun.run_files(inp_paths, save_root_vocal, save_root_ins, format0, num_workers):
+                infos.append(info)
                 yield "\n".join(infos)
+        else:
+            for path in paths:
+                inp_path = os.path.join(inp_root, path)
+                if os.path.isfile(inp_path) == False:
+                    continue
+                need_reformat = 1
+                done = 0
+                try:
+                    info = ffmpeg.probe(inp_path, cmd="ffprobe")
+                    if info["streams"][0]["channels"] == 2 and info["streams"][0]["sample_rate"] == "44100":
+                        need_reformat = 0
+                        pre_fun._path_audio_(inp_path, save_root_ins, save_root_vocal, format0, is_hp3)
+                        done = 1
+                except:
+                    need_reformat = 1
+                    traceback.print_exc()
+                if need_reformat == 1:
+                    tmp_path = "%s/%s.reformatted.wav" % (
+                        os.path.join(os.environ["TEMP"]),
+                        os.path.basename(inp_path),
+                    )
+                    os.system(f'ffmpeg -i "{inp_path}" -vn -acodec pcm_s16le -ac 2 -ar 44100 "{tmp_path}" -y')
+                    inp_path = tmp_path
+                try:
+                    if done == 0:
+                        pre_fun._path_audio_(inp_path, save_root_ins, save_root_vocal, format0, is_hp3)
+                    infos.append("%s->Success" % (os.path.basename(inp_path)))
+                    yield "\n".join(infos)
+                except:
+                    infos.append("%s->%s" % (os.path.basename(inp_path), traceback.format_exc()))
+                    yield "\n".join(infos)
     except:
         infos.append(traceback.format_exc())
         yield "\n".join(infos)
@@ -3,16 +3,21 @@
 处理图片展示相关的 API
 """
 
-from fastapi import APIRouter, HTTPException, Response, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Request, Response, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import requests
 import json
 import os
+import re
+import time
+import uuid
 import asyncio
 import aiohttp
 import aiofiles
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from urllib.parse import quote
 import hashlib
 from datetime import datetime
 
@@ -32,6 +37,11 @@ sync_status = {
     "is_syncing": False,
     "progress": 0,
     "total": 0,
+    "failed": 0,
+    "bytes_done": 0,
+    "bytes_total": 0,
+    "speed": 0,
+    "current_files": {},
     "message": "未开始同步"
 }
 
@@ -39,6 +49,26 @@ class GalleryListRequest(BaseModel):
     """图片列表请求模型"""
     path: str
 
+# 共享的 aiohttp 会话（长连接），首次使用时创建
+_session: aiohttp.ClientSession = None
+
+def get_session() -> aiohttp.ClientSession:
+    """获取共享的 Alist 会话"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=None, connect=10, sock_read=30),
+            connector=aiohttp.TCPConnector(limit=32)
+        )
+    return _session
+
+async def close_session():
+    """关闭共享会话（供main.py在关闭时调用）"""
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
 @router.post("/list")
 async def get_gallery_list(request: GalleryListRequest):
     """
@@ -46,170 +76,286 @@ async def get_gallery_list(request: GalleryListRequest):
     """
     try:
         # 调用 Alist API
-        response = requests.post(
+        async with get_session().post(
             ALIST_API_URL,
             json={"path": request.path, "password": "", "page": 1, "per_page": 0},
             headers={"Content-Type": "application/json"},
-            timeout=10
+            timeout=aiohttp.ClientTimeout(total=10)
+        ) as response:
+            # 返回响应
+            if response.status == 200:
+                return await response.json()
+            else:
+                raise HTTPException(
+                    status_code=response.status,
+                    detail=f"Alist API 返回错误: {await response.text()}"
+                )
+
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"请求 Alist API 失败: {str(e)}"
         )
 
-        # 返回响应
-        if response.status_code == 200:
-            return response.json()
-        else:
+# ---------------- 图片代理缓存 ----------------
+# raw_url（带签名）与远程文件信息的缓存时间，秒；磁盘缓存的图片最多每隔这么久向 Alist 核对一次是否已更新
+RAW_URL_TTL = 300
+# 图片磁盘缓存目录与容量上限
+IMAGE_PROXY_CACHE_DIR = Path(__file__).parent / "cache" / "gallery_proxy"
+IMAGE_PROXY_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+# 分块读写大小
+CHUNK_SIZE = 64 * 1024
+
+# {path: (过期时间, {"raw_url", "modified", "size"})}
+_raw_url_cache: Dict[str, tuple] = {}
+# 磁盘缓存索引（按最近使用排序）{cache_name: size}
+_image_cache_index: "OrderedDict[str, int]" = None
+# 正在拉取的路径，并发请求共享同一个任务 {path: Task}
+_inflight_fetches: Dict[str, asyncio.Task] = {}
+
+async def get_remote_info(path: str) -> dict:
+    """通过 Alist /api/fs/get 获取带签名的 raw_url 及远程修改时间、大小，结果按 TTL 缓存"""
+    cached = _raw_url_cache.get(path)
+    if cached is not None and cached[0] > time.time():
+        return cached[1]
+
+    async with get_session().post(
+        f"{ALIST_BASE_URL}/api/fs/get",
+        json={"path": path},
+        headers={"Content-Type": "application/json"},
+        timeout=aiohttp.ClientTimeout(total=10)
+    ) as info_response:
+        if info_response.status != 200:
             raise HTTPException(
-                status_code=response.status_code,
-                detail=f"Alist API 返回错误: {response.text}"
+                status_code=info_response.status,
+                detail="获取文件信息失败"
             )
+        info_data = await info_response.json()
 
-    except requests.exceptions.RequestException as e:
+    if info_data.get("code") != 200:
         raise HTTPException(
             status_code=500,
-            detail=f"请求 Alist API 失败: {str(e)}"
+            detail=f"获取文件信息失败: {info_data.get('message', '未知错误')}"
         )
 
-@router.get("/image")
-async def get_image(path: str):
-    """
-    代理获取图片内容 - 使用Alist的get接口
-    """
-    try:
-        # 先获取文件信息以获得sign
-        get_api_url = f"{ALIST_BASE_URL}/api/fs/get"
-
-        # 请求文件信息
-        info_response = requests.post(
-            get_api_url,
-            json={"path": path},
-            headers={"Content-Type": "application/json"},
-            timeout=10
-        )
-
-        if info_response.status_code != 200:
+    # 获取文件的raw_url
+    file_info = info_data.get("data", {})
+    raw_url = file_info.get("raw_url")
+    sign = file_info.get("sign", "")
+
+    if not raw_url:
+        # 如果没有raw_url，尝试构造URL
+        raw_url = f"{ALIST_BASE_URL}/d{path}"
+        if sign:
+            raw_url += f"?sign={sign}"
+
+    info = {"raw_url": raw_url, "modified": file_info.get("modified"), "size": file_info.get("size")}
+    _raw_url_cache[path] = (time.time() + RAW_URL_TTL, info)
+    return info
+
+async def resolve_raw_url(path: str) -> str:
+    """带签名的 raw_url"""
+    return (await get_remote_info(path))["raw_url"]
+
+def load_image_cache_index() -> "OrderedDict[str, int]":
+    """扫描磁盘缓存目录，按访问时间建立 LRU 索引"""
+    global _image_cache_index
+    if _image_cache_index is None:
+        IMAGE_PROXY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for file in IMAGE_PROXY_CACHE_DIR.glob("*.bin"):
+            stat = file.stat()
+            entries.append((stat.st_atime, file.stem, stat.st_size))
+        entries.sort()
+        _image_cache_index = OrderedDict((name, size) for _, name, size in entries)
+    return _image_cache_index
+
+def evict_image_cache():
+    """超出容量时删除最久未使用的图片"""
+    index = load_image_cache_index()
+    total = sum(index.values())
+    while total > IMAGE_PROXY_CACHE_MAX_BYTES and len(index) > 1:
+        name, size = index.popitem(last=False)
+        try:
+            (IMAGE_PROXY_CACHE_DIR / f"{name}.bin").unlink()
+            (IMAGE_PROXY_CACHE_DIR / f"{name}.json").unlink()
+        except OSError:
+            # Windows 下正在被读取的文件无法删除，留到下次淘汰
+            pass
+        total -= size
+
+async def fetch_to_cache(path: str, cache_name: str) -> dict:
+    """从 Alist 拉取图片写入磁盘缓存（先写临时文件再替换），返回元信息"""
+    info = await get_remote_info(path)
+    async with get_session().get(info["raw_url"]) as response:
+        if response.status != 200:
+            # 签名可能已过期，下次重新获取
+            _raw_url_cache.pop(path, None)
             raise HTTPException(
-                status_code=info_response.status_code,
-                detail="获取文件信息失败"
+                status_code=response.status,
+                detail=f"获取图片失败: HTTP {response.status}"
             )
 
-        info_data = info_response.json()
+        bin_path = IMAGE_PROXY_CACHE_DIR / f"{cache_name}.bin"
+        tmp_path = IMAGE_PROXY_CACHE_DIR / f"{cache_name}.{uuid.uuid4().hex}.tmp"
+        sha = hashlib.sha1()
+        size = 0
+        try:
+            async with aiofiles.open(tmp_path, 'wb') as f:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    sha.update(chunk)
+                    size += len(chunk)
+                    await f.write(chunk)
+            os.replace(tmp_path, bin_path)
+        except BaseException:
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+            raise
+
+        meta = {
+            "content_type": response.headers.get('content-type', 'image/jpeg'),
+            "etag": f'"{sha.hexdigest()}"',
+            "size": size,
+            # 远程文件的修改时间与大小，命中时据此判断缓存是否过期
+            "remote_modified": info["modified"],
+            "remote_size": info["size"]
+        }
 
-        if info_data.get("code") != 200:
-            raise HTTPException(
-                status_code=500,
-                detail=f"获取文件信息失败: {info_data.get('message', '未知错误')}"
-            )
+    async with aiofiles.open(IMAGE_PROXY_CACHE_DIR / f"{cache_name}.json", 'w', encoding='utf-8') as f:
+        await f.write(json.dumps(meta))
 
-        # 获取文件的raw_url
-        file_info = info_data.get("data", {})
-        raw_url = file_info.get("raw_url")
-        sign = file_info.get("sign", "")
-
-        if not raw_url:
-            # 如果没有raw_url，尝试构造URL
-            raw_url = f"{ALIST_BASE_URL}/d{path}"
-            if sign:
-                raw_url += f"?sign={sign}"
-
-        # 获取图片内容
-        response = requests.get(raw_url, timeout=30, stream=True)
-
-        if response.status_code == 200:
-            # 获取内容类型
-            content_type = response.headers.get('content-type', 'image/jpeg')
-
-            # 返回图片
-            return Response(
-                content=response.content,
-                media_type=content_type,
-                headers={
-                    "Cache-Control": "public, max-age=31536000",
-                    "Access-Control-Allow-Origin": "*"
-                }
-            )
-        else:
-            raise HTTPException(
-                status_code=response.status_code,
-                detail=f"获取图片失败: HTTP {response.status_code}"
-            )
+    index = load_image_cache_index()
+    index[cache_name] = size
+    index.move_to_end(cache_name)
+    evict_image_cache()
+    return meta
 
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"获取图片失败: {str(e)}"
-        )
+async def is_cache_current(path: str, meta: dict) -> bool:
+    """远程文件在同一路径被替换（修改时间或大小变化）时缓存失效；Alist 暂时不可用时继续使用缓存"""
+    try:
+        info = await get_remote_info(path)
+    except (HTTPException, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"核对图片缓存失败，继续使用缓存 {path}: {e}")
+        return True
+    return meta.get("remote_modified") == info["modified"] and meta.get("remote_size") == info["size"]
 
-@router.get("/download")
-async def download_image(path: str):
+async def get_cached_image(path: str) -> tuple:
     """
-    代理下载图片 - 使用Alist的get接口
+    返回 (缓存文件路径, 元信息)。未命中时拉取，同一路径的并发请求共享一次拉取
     """
+    cache_name = hashlib.sha1(path.encode('utf-8')).hexdigest()
+    bin_path = IMAGE_PROXY_CACHE_DIR / f"{cache_name}.bin"
+    index = load_image_cache_index()
+
+    if cache_name in index:
+        try:
+            async with aiofiles.open(IMAGE_PROXY_CACHE_DIR / f"{cache_name}.json", 'r', encoding='utf-8') as f:
+                meta = json.loads(await f.read())
+            if bin_path.exists() and await is_cache_current(path, meta):
+                index.move_to_end(cache_name)
+                return bin_path, meta
+        except (OSError, ValueError):
+            pass
+        index.pop(cache_name, None)
+
+    task = _inflight_fetches.get(path)
+    if task is None:
+        task = asyncio.create_task(fetch_to_cache(path, cache_name))
+        _inflight_fetches[path] = task
+        task.add_done_callback(lambda _: _inflight_fetches.pop(path, None))
+    # shield: 某个浏览器断开不会取消其他请求共享的拉取
+    meta = await asyncio.shield(task)
+    return bin_path, meta
+
+def parse_range(range_header: str, size: int):
+    """解析单段 Range 头，返回 (start, end)；不合法返回 None"""
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+    if not match or (match.group(1) == "" and match.group(2) == ""):
+        return None
+    if match.group(1) == "":
+        # 后缀范围: bytes=-500
+        length = int(match.group(2))
+        if length == 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else size - 1
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+async def iter_file(file_path: Path, start: int, length: int):
+    """分块读取文件"""
+    async with aiofiles.open(file_path, 'rb') as f:
+        await f.seek(start)
+        while length > 0:
+            chunk = await f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+async def serve_image(request: Request, path: str, headers: Dict[str, str]) -> Response:
+    """从磁盘缓存流式返回图片，支持 ETag 与 Range"""
     try:
-        # 先获取文件信息以获得sign
-        get_api_url = f"{ALIST_BASE_URL}/api/fs/get"
-
-        # 请求文件信息
-        info_response = requests.post(
-            get_api_url,
-            json={"path": path},
-            headers={"Content-Type": "application/json"},
-            timeout=10
+        bin_path, meta = await get_cached_image(path)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"获取图片失败: {str(e)}"
         )
 
-        if info_response.status_code != 200:
-            raise HTTPException(
-                status_code=info_response.status_code,
-                detail="获取文件信息失败"
-            )
+    size = meta["size"]
+    headers = dict(headers)
+    headers.update({
+        "ETag": meta["etag"],
+        "Accept-Ranges": "bytes",
+        "Access-Control-Allow-Origin": "*"
+    })
+
+    if request.headers.get("if-none-match") == meta["etag"]:
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", meta["etag"]) == meta["etag"]:
+        byte_range = parse_range(range_header, size)
+        if byte_range is None:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            iter_file(bin_path, start, end - start + 1),
+            status_code=206,
+            media_type=meta["content_type"],
+            headers=headers
+        )
 
-        info_data = info_response.json()
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(iter_file(bin_path, 0, size), media_type=meta["content_type"], headers=headers)
 
-        if info_data.get("code") != 200:
-            raise HTTPException(
-                status_code=500,
-                detail=f"获取文件信息失败: {info_data.get('message', '未知错误')}"
-            )
-
-        # 获取文件的raw_url
-        file_info = info_data.get("data", {})
-        raw_url = file_info.get("raw_url")
-        sign = file_info.get("sign", "")
-
-        if not raw_url:
-            # 如果没有raw_url，尝试构造URL
-            raw_url = f"{ALIST_BASE_URL}/d{path}"
-            if sign:
-                raw_url += f"?sign={sign}"
-
-        # 获取图片内容
-        response = requests.get(raw_url, timeout=30, stream=True)
-
-        if response.status_code == 200:
-            # 获取文件名
-            filename = os.path.basename(path)
-
-            # 获取内容类型
-            content_type = response.headers.get('content-type', 'application/octet-stream')
-
-            # 返回图片
-            return Response(
-                content=response.content,
-                media_type=content_type,
-                headers={
-                    "Content-Disposition": f'attachment; filename="{filename}"',
-                    "Access-Control-Allow-Origin": "*"
-                }
-            )
-        else:
-            raise HTTPException(
-                status_code=response.status_code,
-                detail=f"下载图片失败: HTTP {response.status_code}"
-            )
+@router.get("/image")
+async def get_image(path: str, request: Request):
+    """
+    代理获取图片内容 - 使用Alist的get接口，经本地磁盘缓存流式返回
+    """
+    return await serve_image(request, path, {"Cache-Control": "public, max-age=31536000"})
 
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"下载图片失败: {str(e)}"
-        )
+@router.get("/download")
+async def download_image(path: str, request: Request):
+    """
+    代理下载图片 - 使用Alist的get接口，经本地磁盘缓存流式返回
+    """
+    # 获取文件名（中文文件名按 RFC 5987 编码）
+    filename = os.path.basename(path)
+    return await serve_image(
+        request,
+        path,
+        {"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"}
+    )
 
 # 健康检查
 @router.get("/status")
@@ -219,14 +365,15 @@ async def gallery_status():
     """
     try:
         # 测试 Alist API 连接
-        response = requests.post(
+        async with get_session().post(
             ALIST_API_URL,
             json={"path": "/", "password": "", "page": 1, "per_page": 1},
             headers={"Content-Type": "application/json"},
-            timeout=5
-        )
+            timeout=aiohttp.ClientTimeout(total=5)
+        ) as response:
+            status_code = response.status
 
-        if response.status_code == 200:
+        if status_code == 200:
             return {
                 "status": "ok",
                 "service": "gallery",
@@ -238,7 +385,7 @@ async def gallery_status():
                 "status": "warning",
                 "service": "gallery",
                 "alist_api": "error",
-                "message": f"Alist API 返回错误: {response.status_code}"
+                "message": f"Alist API 返回错误: {status_code}"
             }
 
     except Exception as e:
@@ -249,68 +396,228 @@ async def gallery_status():
             "message": f"无法连接到 Alist API: {str(e)}"
         }
 
+# ---------------- 本地画室索引 ----------------
+# 索引持久化文件与缩略图目录（缩略图不放在 static/gallery 下，避免被同步清理）
+GALLERY_CATALOG_FILE = Path(__file__).parent / "cache" / "gallery_catalog.json"
+GALLERY_THUMB_DIR = Path(__file__).parent / "static" / "gallery_thumbs"
+THUMB_SIZE = (400, 400)
+PREVIEW_COUNT = 4
+CATALOG_SAVE_DELAY = 2
+
+# {文件夹名: {相对路径: 图片信息}}
+_catalog: Dict[str, Dict[str, dict]] = {}
+# 每个文件夹按路径排序后的图片列表，变更时失效
+_catalog_sorted: Dict[str, List[dict]] = {}
+_catalog_save_handle = None
+_catalog_observer = None
+_preview_tasks = set()
+
+def make_image_info(relative_path: str, stat: os.stat_result) -> dict:
+    """图片信息"""
+    url = f"/static/gallery/{relative_path}"
+    return {
+        "name": os.path.basename(relative_path),
+        "path": relative_path,
+        "size": stat.st_size,
+        "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+        "url": url,
+        "downloadUrl": url,
+        "thumbUrl": url
+    }
+
+def top_folder_of(relative_path: str):
+    """顶级文件夹名，根目录下的文件返回 None"""
+    parts = relative_path.split('/')
+    return parts[0] if len(parts) > 1 else None
+
+def get_sorted_images(folder: str) -> List[dict]:
+    """文件夹内按路径排序的图片列表"""
+    images = _catalog_sorted.get(folder)
+    if images is None:
+        images = [_catalog[folder][key] for key in sorted(_catalog.get(folder, {}))]
+        _catalog_sorted[folder] = images
+    return images
+
+def ensure_thumbnail(info: dict) -> str:
+    """生成缩略图，返回其 URL；没有安装 Pillow 或生成失败时返回原图 URL"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return info["url"]
+
+    thumb_name = f"{hashlib.sha1(info['path'].encode('utf-8')).hexdigest()}_{info['size']}.jpg"
+    thumb_path = GALLERY_THUMB_DIR / thumb_name
+    if not thumb_path.exists():
+        try:
+            GALLERY_THUMB_DIR.mkdir(parents=True, exist_ok=True)
+            with Image.open(GALLERY_CACHE_DIR / info["path"]) as image:
+                image.thumbnail(THUMB_SIZE)
+                tmp_path = thumb_path.with_suffix('.tmp')
+                image.convert('RGB').save(tmp_path, format='JPEG', quality=80)
+            os.replace(tmp_path, thumb_path)
+        except Exception as e:
+            print(f"生成缩略图失败 {info['path']}: {e}")
+            return info["url"]
+    return f"/static/gallery_thumbs/{thumb_name}"
+
+async def refresh_previews(folder: str):
+    """
+    为文件夹的预览图生成缩略图
+    索引只在事件循环上读写：先取预览图信息的副本，线程里只生成缩略图文件，结果回到事件循环再写入索引
+    """
+    pending = [dict(info) for info in get_sorted_images(folder)[:PREVIEW_COUNT] if info["thumbUrl"] == info["url"]]
+    if not pending:
+        return
+    thumb_urls = await asyncio.to_thread(lambda: [ensure_thumbnail(info) for info in pending])
+    changed = False
+    for info, thumb_url in zip(pending, thumb_urls):
+        current = _catalog.get(folder, {}).get(info["path"])
+        # 生成期间文件可能已被替换或删除
+        if current is None or current["size"] != info["size"] or current["modified"] != info["modified"]:
+            continue
+        if current["thumbUrl"] != thumb_url:
+            current["thumbUrl"] = thumb_url
+            changed = True
+    if changed:
+        schedule_catalog_save()
+
+def schedule_refresh_previews(folder: str):
+    """在事件循环上启动后台缩略图任务（保留引用，避免任务被回收）"""
+    task = asyncio.get_running_loop().create_task(refresh_previews(folder))
+    _preview_tasks.add(task)
+    task.add_done_callback(_preview_tasks.discard)
+
+def save_catalog():
+    """写回索引（先写临时文件再替换）"""
+    global _catalog_save_handle
+    _catalog_save_handle = None
+    GALLERY_CATALOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = GALLERY_CATALOG_FILE.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(_catalog, f, ensure_ascii=False)
+    os.replace(tmp_path, GALLERY_CATALOG_FILE)
+
+def schedule_catalog_save():
+    """合并短时间内的多次变更，延迟写盘"""
+    global _catalog_save_handle
+    if _catalog_save_handle is None:
+        _catalog_save_handle = asyncio.get_running_loop().call_later(CATALOG_SAVE_DELAY, save_catalog)
+
+def build_catalog() -> Dict[str, Dict[str, dict]]:
+    """遍历 gallery 目录建立索引（仅在没有持久化索引时执行一次）"""
+    catalog = {}
+    for root, dirs, files in os.walk(GALLERY_CACHE_DIR):
+        for file in files:
+            if file.startswith('.') or not file.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            file_path = Path(root) / file
+            relative_path = str(file_path.relative_to(GALLERY_CACHE_DIR)).replace('\\', '/')
+            folder = top_folder_of(relative_path)
+            if folder is None:
+                continue
+            catalog.setdefault(folder, {})[relative_path] = make_image_info(relative_path, file_path.stat())
+    return catalog
+
+def catalog_update(relative_path: str):
+    """按文件当前状态更新索引（新增、修改或删除）"""
+    relative_path = relative_path.replace('\\', '/')
+    name = os.path.basename(relative_path)
+    folder = top_folder_of(relative_path)
+    if folder is None or name.startswith('.') or not name.lower().endswith(IMAGE_EXTENSIONS):
+        return
+
+    file_path = GALLERY_CACHE_DIR / relative_path
+    try:
+        stat = file_path.stat()
+    except OSError:
+        stat = None
+
+    if stat is not None:
+        _catalog.setdefault(folder, {})[relative_path] = make_image_info(relative_path, stat)
+        _catalog_sorted.pop(folder, None)
+    elif relative_path in _catalog.get(folder, {}):
+        del _catalog[folder][relative_path]
+        if not _catalog[folder]:
+            del _catalog[folder]
+        _catalog_sorted.pop(folder, None)
+    else:
+        return
+
+    if folder in _catalog:
+        # 预览图可能变化，后台补齐缩略图
+        schedule_refresh_previews(folder)
+    schedule_catalog_save()
+
+def start_catalog_watcher(loop: asyncio.AbstractEventLoop):
+    """监听 gallery 目录变化（需要 watchdog，未安装时仅依赖同步任务更新索引）"""
+    global _catalog_observer
+    try:
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+    except ImportError:
+        print("⚠️  未安装 watchdog，画室索引只在同步时更新")
+        return
+
+    class CatalogEventHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.is_directory:
+                return
+            for path in (getattr(event, 'src_path', None), getattr(event, 'dest_path', None)):
+                if not path:
+                    continue
+                try:
+                    relative_path = str(Path(path).relative_to(GALLERY_CACHE_DIR))
+                except ValueError:
+                    continue
+                loop.call_soon_threadsafe(catalog_update, relative_path)
+
+    _catalog_observer = Observer()
+    _catalog_observer.schedule(CatalogEventHandler(), str(GALLERY_CACHE_DIR), recursive=True)
+    _catalog_observer.daemon = True
+    _catalog_observer.start()
+
+@router.on_event("startup")
+async def load_catalog():
+    """启动时读取索引（没有则遍历目录建立），并开始监听目录变化"""
+    global _catalog
+    try:
+        with open(GALLERY_CATALOG_FILE, 'r', encoding='utf-8') as f:
+            _catalog = json.load(f)
+    except (OSError, ValueError):
+        _catalog = await asyncio.to_thread(build_catalog)
+        save_catalog()
+    _catalog_sorted.clear()
+    print(f"🖼️  画室索引: {len(_catalog)} 个文件夹, {sum(len(v) for v in _catalog.values())} 张图片")
+
+    for folder in list(_catalog):
+        schedule_refresh_previews(folder)
+    start_catalog_watcher(asyncio.get_running_loop())
+
+@router.on_event("shutdown")
+async def stop_catalog_watcher():
+    """停止目录监听并写回索引"""
+    if _catalog_observer is not None:
+        _catalog_observer.stop()
+    save_catalog()
+
 # 获取本地缓存的文件列表
 @router.get("/local-list")
 async def get_local_gallery_list():
     """
-    获取本地缓存的所有图片列表（按文件夹分组）
+    获取本地缓存的文件夹摘要（数量与预览图），图片列表通过 /local-folder 分页获取
     """
-    folders = {}
+    folder_list = []
     total_count = 0
-
-    # 遍历gallery目录，按文件夹分组
-    for root, dirs, files in os.walk(GALLERY_CACHE_DIR):
-        # 获取相对路径作为文件夹名
-        relative_root = Path(root).relative_to(GALLERY_CACHE_DIR)
-        folder_name = str(relative_root).replace('\\', '/')
-
-        # 跳过根目录的文件
-        if folder_name == '.':
-            continue
-
-        # 如果是子文件夹，获取顶级文件夹名
-        folder_parts = folder_name.split('/')
-        top_folder = folder_parts[0]
-
-        # 初始化文件夹数据
-        if top_folder not in folders:
-            folders[top_folder] = {
-                "name": top_folder,
-                "count": 0,
-                "preview_images": [],
-                "all_images": []
-            }
-
-        # 收集该文件夹中的图片
-        for file in files:
-            # 检查是否为图片文件
-            if file.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')):
-                file_path = Path(root) / file
-                relative_path = file_path.relative_to(GALLERY_CACHE_DIR)
-
-                # 获取文件信息
-                stat = file_path.stat()
-
-                image_info = {
-                    "name": file,
-                    "path": str(relative_path).replace('\\', '/'),
-                    "size": stat.st_size,
-                    "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                    "url": f"/static/gallery/{str(relative_path).replace(os.sep, '/')}",
-                    "downloadUrl": f"/static/gallery/{str(relative_path).replace(os.sep, '/')}"
-                }
-
-                folders[top_folder]["all_images"].append(image_info)
-                folders[top_folder]["count"] += 1
-                total_count += 1
-
-                # 只取前4张作为预览
-                if len(folders[top_folder]["preview_images"]) < 4:
-                    folders[top_folder]["preview_images"].append(image_info["url"])
-
-    # 转换为列表并按文件夹名排序
-    folder_list = list(folders.values())
-    folder_list.sort(key=lambda x: x["name"])
+    for folder in sorted(_catalog):
+        previews = get_sorted_images(folder)[:PREVIEW_COUNT]
+        count = len(_catalog[folder])
+        total_count += count
+        folder_list.append({
+            "name": folder,
+            "count": count,
+            "preview_images": [info["thumbUrl"] for info in previews],
+            "previews": previews
+        })
 
     return {
         "status": "ok",
@@ -319,11 +626,89 @@ async def get_local_gallery_list():
         "folders": folder_list
     }
 
+@router.get("/local-folder")
+async def get_local_folder_images(name: str, page: int = 1, page_size: int = 60):
+    """
+    分页获取某个文件夹的图片列表
+    """
+    if name not in _catalog:
+        raise HTTPException(status_code=404, detail="文件夹不存在")
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 500)
+
+    images = get_sorted_images(name)
+    start = (page - 1) * page_size
+    return {
+        "status": "ok",
+        "name": name,
+        "count": len(images),
+        "page": page,
+        "page_size": page_size,
+        "has_more": start + page_size < len(images),
+        "images": images[start:start + page_size]
+    }
+
+# ---------------- 同步引擎 ----------------
+# 远程画室根目录
+GALLERY_REMOTE_ROOT = "/asunny0/画栈/小垚的世界"
+# 并发列目录 / 并发下载数
+SYNC_LIST_CONCURRENCY = 4
+SYNC_DOWNLOAD_CONCURRENCY = 6
+# 同步清单：记录已完整下载的文件（size/modified），中断后重启据此续传
+# 放在 cache 目录下，不随 /static 对外提供
+SYNC_MANIFEST_FILE = Path(__file__).parent / "cache" / "gallery_sync_manifest.json"
+# 旧版本放在 static/gallery 下的清单，读取时迁移并删除
+LEGACY_SYNC_MANIFEST_FILE = GALLERY_CACHE_DIR / ".sync_manifest.json"
+# 清单写盘间隔，秒
+SYNC_MANIFEST_SAVE_INTERVAL = 5
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')
+
+def load_sync_manifest() -> Dict[str, dict]:
+    """读取同步清单；没有清单时以本地已有文件（仅大小）初始化"""
+    manifest = None
+    for manifest_file in (SYNC_MANIFEST_FILE, LEGACY_SYNC_MANIFEST_FILE):
+        try:
+            with open(manifest_file, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            break
+        except (OSError, ValueError):
+            pass
+    LEGACY_SYNC_MANIFEST_FILE.unlink(missing_ok=True)
+    if manifest is not None:
+        return manifest
+
+    manifest = {}
+    for root, dirs, files in os.walk(GALLERY_CACHE_DIR):
+        for file in files:
+            if not file.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            file_path = Path(root) / file
+            relative_path = str(file_path.relative_to(GALLERY_CACHE_DIR)).replace('\\', '/')
+            manifest[relative_path] = {"size": file_path.stat().st_size, "modified": None}
+    return manifest
+
+def save_sync_manifest(manifest: Dict[str, dict]):
+    """写回同步清单（先写临时文件再替换）"""
+    SYNC_MANIFEST_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = SYNC_MANIFEST_FILE.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, SYNC_MANIFEST_FILE)
+
+def local_size(relative_path: str) -> Optional[int]:
+    """本地文件大小，不存在时返回 None；续传时据此确认清单里的文件确实完整在盘上"""
+    try:
+        return (GALLERY_CACHE_DIR / relative_path).stat().st_size
+    except OSError:
+        return None
+
 # 异步下载文件
-async def download_file(session: aiohttp.ClientSession, url: str, local_path: Path):
+async def download_file(session: aiohttp.ClientSession, url: str, local_path: Path, progress: dict = None):
     """
-    异步下载文件到本地
+    异步下载文件到本地：先写临时文件，完整后再重命名，中断不会留下残缺图片
+    成功返回 True
     """
+    tmp_path = local_path.with_name(f".{local_path.name}.{uuid.uuid4().hex}.part")
     try:
         async with session.get(url) as response:
             if response.status == 200:
@@ -331,59 +716,112 @@ async def download_file(session: aiohttp.ClientSession, url: str, local_path: Pa
                 local_path.parent.mkdir(parents=True, exist_ok=True)
 
                 # 写入文件
-                async with aiofiles.open(local_path, 'wb') as f:
-                    async for chunk in response.content.iter_chunked(8192):
+                async with aiofiles.open(tmp_path, 'wb') as f:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
                         await f.write(chunk)
+                        if progress is not None:
+                            progress["downloaded"] += len(chunk)
+                            sync_status["bytes_done"] += len(chunk)
+                os.replace(tmp_path, local_path)
                 return True
     except Exception as e:
         print(f"下载文件失败 {url}: {e}")
+    try:
+        tmp_path.unlink()
+    except OSError:
+        pass
     return False
 
-# 递归获取远程文件列表
-async def get_remote_files(session: aiohttp.ClientSession, path: str, base_path: str = "") -> List[Dict]:
+# 并发获取远程文件列表
+async def get_remote_files(
+    session: aiohttp.ClientSession,
+    path: str,
+    base_path: str = "",
+    semaphore: asyncio.Semaphore = None
+) -> List[Dict]:
     """
-    递归获取远程所有文件信息
+    递归获取远程所有文件信息，子目录并发列出（由 semaphore 限制并发数）
     """
+    semaphore = semaphore or asyncio.Semaphore(SYNC_LIST_CONCURRENCY)
     files = []
+    sub_dirs = []
 
     try:
-        async with session.post(
-            ALIST_API_URL,
-            json={"path": path, "password": "", "page": 1, "per_page": 0},
-            headers={"Content-Type": "application/json"}
-        ) as response:
-            if response.status == 200:
-                data = await response.json()
-
-                if data.get("code") == 200:
-                    # 确保 items 不是 None
-                    items = data.get("data", {}).get("content")
-                    if items is None:
-                        items = []
-
-                    for item in items:
-                        if item.get("is_dir"):
-                            # 递归处理子文件夹
-                            sub_path = f"{path}/{item['name']}"
-                            sub_base = f"{base_path}/{item['name']}" if base_path else item['name']
-                            sub_files = await get_remote_files(session, sub_path, sub_base)
-                            files.extend(sub_files)
-                        else:
-                            # 检查是否为图片
-                            name = item['name'].lower()
-                            if name.endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')):
-                                relative_path = f"{base_path}/{item['name']}" if base_path else item['name']
-                                files.append({
-                                    "name": item['name'],
-                                    "path": relative_path,
-                                    "size": item.get('size', 0),
-                                    "remote_path": f"{path}/{item['name']}"
-                                })
+        async with semaphore:
+            async with session.post(
+                ALIST_API_URL,
+                json={"path": path, "password": "", "page": 1, "per_page": 0},
+                headers={"Content-Type": "application/json"}
+            ) as response:
+                data = await response.json() if response.status == 200 else {}
+
+        if data.get("code") == 200:
+            # 确保 items 不是 None
+            items = data.get("data", {}).get("content")
+            if items is None:
+                items = []
+
+            for item in items:
+                if item.get("is_dir"):
+                    sub_path = f"{path}/{item['name']}"
+                    sub_base = f"{base_path}/{item['name']}" if base_path else item['name']
+                    sub_dirs.append((sub_path, sub_base))
+                elif item['name'].lower().endswith(IMAGE_EXTENSIONS):
+                    # 检查是否为图片
+                    relative_path = f"{base_path}/{item['name']}" if base_path else item['name']
+                    files.append({
+                        "name": item['name'],
+                        "path": relative_path,
+                        "size": item.get('size', 0),
+                        "modified": item.get('modified'),
+                        "sign": item.get('sign', ""),
+                        "remote_path": f"{path}/{item['name']}"
+                    })
     except Exception as e:
         print(f"获取远程文件列表失败 {path}: {e}")
 
+    # 并发处理子文件夹
+    results = await asyncio.gather(*[
+        get_remote_files(session, sub_path, sub_base, semaphore) for sub_path, sub_base in sub_dirs
+    ])
+    for sub_files in results:
+        files.extend(sub_files)
+
     return files
 
+async def sync_one_file(session: aiohttp.ClientSession, remote_file: Dict, manifest: Dict[str, dict]):
+    """下载单个文件并登记到清单"""
+    progress = {"size": remote_file['size'], "downloaded": 0}
+    sync_status["current_files"][remote_file['path']] = progress
+    local_path = GALLERY_CACHE_DIR / remote_file['path']
+    try:
+        # 列表里已带签名，直接走 /d 下载，省去一次 /api/fs/get
+        raw_url = f"{ALIST_BASE_URL}/d{remote_file['remote_path']}"
+        if remote_file['sign']:
+            raw_url += f"?sign={remote_file['sign']}"
+        ok = await download_file(session, raw_url, local_path, progress)
+        if not ok:
+            # 回退到 /api/fs/get 获取 raw_url
+            sync_status["bytes_done"] -= progress["downloaded"]
+            progress["downloaded"] = 0
+            ok = await download_file(session, await resolve_raw_url(remote_file['remote_path']), local_path, progress)
+
+        if ok:
+            manifest[remote_file['path']] = {
+                "size": remote_file['size'],
+                "modified": remote_file['modified']
+            }
+            catalog_update(remote_file['path'])
+            sync_status["message"] = f"下载: {remote_file['name']}"
+        else:
+            sync_status["failed"] += 1
+    except Exception as e:
+        print(f"下载文件失败 {remote_file['name']}: {e}")
+        sync_status["failed"] += 1
+    finally:
+        del sync_status["current_files"][remote_file['path']]
+        sync_status["progress"] += 1
+
 # 执行同步任务
 async def sync_gallery_task():
     """
@@ -392,95 +830,86 @@ async def sync_gallery_task():
     global sync_status
 
     try:
-        sync_status["is_syncing"] = True
-        sync_status["message"] = "开始同步..."
-
-        async with aiohttp.ClientSession() as session:
-            # 1. 获取远程文件列表
-            sync_status["message"] = "获取远程文件列表..."
-            remote_files = await get_remote_files(session, "/asunny0/画栈/小垚的世界")
-
-            # 2. 获取本地文件列表
-            local_files = {}
-            for root, dirs, files in os.walk(GALLERY_CACHE_DIR):
-                for file in files:
-                    file_path = Path(root) / file
-                    relative_path = file_path.relative_to(GALLERY_CACHE_DIR)
-                    stat = file_path.stat()
-                    local_files[str(relative_path).replace('\\', '/')] = {
-                        "path": file_path,
-                        "size": stat.st_size
-                    }
-
-            # 3. 比较差异
-            to_download = []
-            to_delete = []
-
-            # 检查需要下载或更新的文件
-            for remote_file in remote_files:
-                local_key = remote_file['path']
-
-                if local_key in local_files:
-                    # 比较大小
-                    if remote_file['size'] != local_files[local_key]['size']:
-                        # 大小不同，需要重新下载
-                        to_delete.append(local_files[local_key]['path'])
-                        to_download.append(remote_file)
-                else:
-                    # 本地不存在，需要下载
-                    to_download.append(remote_file)
-
-            # 检查需要删除的文件（本地有但远程没有）
-            remote_paths = {f['path'] for f in remote_files}
-            for local_path, local_info in local_files.items():
-                if local_path not in remote_paths:
-                    to_delete.append(local_info['path'])
-
-            sync_status["total"] = len(to_download) + len(to_delete)
-            sync_status["progress"] = 0
-
-            # 4. 删除旧文件
-            for file_path in to_delete:
+        sync_status.update({
+            "is_syncing": True,
+            "progress": 0,
+            "total": 0,
+            "failed": 0,
+            "bytes_done": 0,
+            "bytes_total": 0,
+            "speed": 0,
+            "current_files": {},
+            "message": "开始同步..."
+        })
+
+        session = get_session()
+
+        # 1. 获取远程文件列表
+        sync_status["message"] = "获取远程文件列表..."
+        remote_files = await get_remote_files(session, GALLERY_REMOTE_ROOT)
+
+        # 2. 读取本地清单（上次同步中断时已完成的文件也在其中）
+        manifest = load_sync_manifest()
+
+        # 3. 比较差异
+        to_download = []
+        remote_paths = set()
+        for remote_file in remote_files:
+            remote_paths.add(remote_file['path'])
+            entry = manifest.get(remote_file['path'])
+            if (
+                entry is None
+                or entry['size'] != remote_file['size']
+                or (entry['modified'] not in (None, remote_file['modified']))
+                or local_size(remote_file['path']) != remote_file['size']
+            ):
+                to_download.append(remote_file)
+            elif entry['modified'] is None:
+                # 旧版本同步下来的文件，补登修改时间
+                entry['modified'] = remote_file['modified']
+
+        # 本地有但远程没有的文件
+        to_delete = [path for path in manifest if path not in remote_paths]
+
+        sync_status["total"] = len(to_download) + len(to_delete)
+        sync_status["bytes_total"] = sum(f['size'] for f in to_download)
+
+        # 4. 删除旧文件
+        for path in to_delete:
+            try:
+                (GALLERY_CACHE_DIR / path).unlink(missing_ok=True)
+                del manifest[path]
+                catalog_update(path)
+                sync_status["message"] = f"删除文件: {os.path.basename(path)}"
+            except Exception as e:
+                print(f"删除文件失败 {path}: {e}")
+            sync_status["progress"] += 1
+        save_sync_manifest(manifest)
+
+        # 5. 并发下载新文件，定期保存清单并统计速度
+        semaphore = asyncio.Semaphore(SYNC_DOWNLOAD_CONCURRENCY)
+
+        async def bounded_sync(remote_file):
+            async with semaphore:
+                await sync_one_file(session, remote_file, manifest)
+
+        download_task = asyncio.gather(*[bounded_sync(f) for f in to_download])
+        start_time = time.time()
+        try:
+            while True:
                 try:
-                    file_path.unlink()
-                    sync_status["progress"] += 1
-                    sync_status["message"] = f"删除文件: {file_path.name}"
-                except Exception as e:
-                    print(f"删除文件失败 {file_path}: {e}")
-
-            # 5. 下载新文件
-            for remote_file in to_download:
-                try:
-                    # 获取文件信息和下载URL
-                    get_api_url = f"{ALIST_BASE_URL}/api/fs/get"
-
-                    async with session.post(
-                        get_api_url,
-                        json={"path": remote_file['remote_path']},
-                        headers={"Content-Type": "application/json"}
-                    ) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            if data.get("code") == 200:
-                                file_info = data.get("data", {})
-                                raw_url = file_info.get("raw_url")
-                                sign = file_info.get("sign", "")
-
-                                if not raw_url:
-                                    raw_url = f"{ALIST_BASE_URL}/d{remote_file['remote_path']}"
-                                    if sign:
-                                        raw_url += f"?sign={sign}"
-
-                                # 下载文件
-                                local_path = GALLERY_CACHE_DIR / remote_file['path']
-                                await download_file(session, raw_url, local_path)
-
-                                sync_status["progress"] += 1
-                                sync_status["message"] = f"下载: {remote_file['name']}"
-                except Exception as e:
-                    print(f"下载文件失败 {remote_file['name']}: {e}")
-                    sync_status["progress"] += 1
-
+                    await asyncio.wait_for(asyncio.shield(download_task), timeout=SYNC_MANIFEST_SAVE_INTERVAL)
+                    break
+                except asyncio.TimeoutError:
+                    save_sync_manifest(manifest)
+                    sync_status["speed"] = int(sync_status["bytes_done"] / max(time.time() - start_time, 1e-6))
+        finally:
+            save_sync_manifest(manifest)
+        sync_status["speed"] = int(sync_status["bytes_done"] / max(time.time() - start_time, 1e-6))
+
+        if sync_status["failed"]:
+            sync_status["message"] = f"同步完成，{sync_status['failed']} 个文件失败"
+        else:
             sync_status["message"] = "同步完成"
 
     except Exception as e:
@@ -488,6 +917,7 @@ async def sync_gallery_task():
         print(f"同步任务失败: {e}")
     finally:
         sync_status["is_syncing"] = False
+        sync_status["current_files"] = {}
 
 # 触发同步
 @router.post("/sync")
@@ -14,10 +14,10 @@ import sys
 import requests
 
 # 导入服务模块
-from tts_service import router as tts_router, get_outputs_dir
+from tts_service import router as tts_router, get_outputs_dir, close_client as close_tts_client
 from recording_service import router as recording_router, get_recordings_dir
 from friends_service import router as friends_router
-from gallery_service import router as gallery_router
+from gallery_service import router as gallery_router, close_session as close_gallery_session
 from emotion_config import MODEL_CONFIG, EMOTION_CONFIGS, GPT_SOVITS_DIR
 
 # 创建 FastAPI 应用
@@ -113,7 +113,9 @@ async def startup_event():
             "-dr", default_emotion["ref_audio"],
             "-dt", default_emotion["ref_text"],
             "-dl", "zh",
-            "-p", "9880"
+            "-p", "9880",
+            "-rcd", os.path.join(GPT_SOVITS_DIR, "TEMP", "refer_cache"),
+            "-fcd", os.path.join(GPT_SOVITS_DIR, "TEMP", "frontend_cache")
         ]
 
         # 不使用 CREATE_NO_WINDOW，让输出显示
@@ -171,6 +173,8 @@ async def startup_event():
 async def shutdown_event():
     """关闭时停止 GPT-SoVITS API"""
     global gpt_sovits_process
+    await close_tts_client()
+    await close_gallery_session()
     if gpt_sovits_process:
         print("\n🛑 正在关闭 GPT-SoVITS API 服务...")
         gpt_sovits_process.terminate()
@@ -5,7 +5,11 @@
 
 from fastapi import APIRouter, HTTPException
 import os
-from datetime import datetime
+import time
+import asyncio
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
 
 # 创建路由
 router = APIRouter(prefix="/api", tags=["录播"])
@@ -20,86 +24,250 @@ RECORDINGS_DIR = os.path.join(
     'SL_林木垚Meow'
 )
 
+VIDEO_EXTENSIONS = ('.mp4', '.ts', '.flv')
+DANMAKU_EXTENSIONS = ('.json',)
+# 相邻视频间隔超过该值视为新的一场
+SESSION_GAP = timedelta(hours=3)
+# 弹幕文件允许早于场次开始的时间
+DANMAKU_LEAD = timedelta(hours=1)
+# 没有 watchdog 时索引的最长复用时间，秒（目录有增删时立即重建）
+INDEX_REFRESH_INTERVAL = 60
+
+# {文件名: 文件信息}，只在启动和目录变化时更新，避免每次请求都遍历目录、解析文件名
+_index: Dict[str, dict] = {}
+# 按场次分组的结果（正序），索引变更时失效
+_sessions: Optional[List[dict]] = None
+_index_observer = None
+_index_built_at = 0.0
+_index_dir_mtime = None
+
+def parse_recorded_time(filename: str, stat: os.stat_result):
+    """
+    解析文件名获取真实录制时间，返回 (datetime, 原始日期字符串)
+    格式1: SL_林木垚Meow_2025-10-08_15-02-38.mp4
+    格式2: SL_林木垚Meow_2025-10-08_15-02-38_000.mp4（带序号）
+    格式3: SL_林木垚Meow_2025-10-08_15-02-38.json（弹幕文件）
+    解析失败时使用文件创建时间
+    """
+    parts = filename.rsplit('.', 1)[0].split('_')
+    if len(parts) >= 4:
+        # 倒数第二个或第三个是日期
+        date_str = parts[-2] if not parts[-1].isdigit() else parts[-3]
+        time_str = parts[-1] if not parts[-1].isdigit() else parts[-2]
+        datetime_str = f"{date_str} {time_str.replace('-', ':')}"
+        try:
+            return datetime.strptime(datetime_str, "%Y-%m-%d %H:%M:%S"), datetime_str
+        except ValueError:
+            return datetime.fromtimestamp(stat.st_ctime), datetime_str
+    return datetime.fromtimestamp(stat.st_ctime), ""
+
+def make_file_info(filename: str, stat: os.stat_result) -> Optional[dict]:
+    """视频或弹幕文件信息，其他文件返回 None"""
+    lower_name = filename.lower()
+    if lower_name.endswith(VIDEO_EXTENSIONS):
+        kind = "video"
+    elif lower_name.endswith(DANMAKU_EXTENSIONS):
+        kind = "danmaku"
+    else:
+        return None
+    recorded_time, datetime_str = parse_recorded_time(filename, stat)
+    return {
+        "kind": kind,
+        "filename": filename,
+        "url": f"/recordings/{filename}",
+        "size": stat.st_size,
+        "size_mb": round(stat.st_size / 1024 / 1024, 2),
+        "created_at": recorded_time.isoformat(),  # 使用录制时间而非文件创建时间
+        "date": datetime_str
+    }
+
+def build_index() -> Dict[str, dict]:
+    """遍历录播目录建立索引"""
+    index = {}
+    if not os.path.exists(RECORDINGS_DIR):
+        return index
+    with os.scandir(RECORDINGS_DIR) as entries:
+        for entry in entries:
+            # 跳过目录
+            if not entry.is_file():
+                continue
+            try:
+                info = make_file_info(entry.name, entry.stat())
+            except OSError:
+                continue
+            if info is not None:
+                index[entry.name] = info
+    return index
+
+def get_dir_mtime():
+    try:
+        return os.stat(RECORDINGS_DIR).st_mtime
+    except OSError:
+        return None
+
+def set_index(index: Dict[str, dict]):
+    global _index, _sessions, _index_built_at, _index_dir_mtime
+    _index = index
+    _sessions = None
+    _index_built_at = time.time()
+    _index_dir_mtime = get_dir_mtime()
+
+def index_update(filename: str):
+    """按文件当前状态更新索引（新增、修改或删除）"""
+    global _sessions
+    filepath = os.path.join(RECORDINGS_DIR, filename)
+    try:
+        stat = os.stat(filepath)
+        info = make_file_info(filename, stat) if not os.path.isdir(filepath) else None
+    except OSError:
+        info = None
+
+    if info is not None:
+        _index[filename] = info
+    elif _index.pop(filename, None) is None:
+        return
+    _sessions = None
+
+def group_sessions(index: Dict[str, dict]) -> List[dict]:
+    """
+    按时间间隔把视频分组为场次，并把弹幕文件分配到对应场次（结果按时间正序）
+    弹幕时间在 [场次开始 - 1小时, 场次结束 + 3小时] 内即属于该场次，有重叠时归入较早的场次
+    """
+    videos = sorted((info for info in index.values() if info["kind"] == "video"), key=lambda x: x["created_at"])
+    danmaku_files = sorted(
+        (info for info in index.values() if info["kind"] == "danmaku"), key=lambda x: x["created_at"]
+    )
+
+    sessions = []
+    current = None
+    for video in videos:
+        recorded_time = datetime.fromisoformat(video["created_at"])
+        if current is None or recorded_time - current["end"] > SESSION_GAP:
+            current = {"start": recorded_time, "end": recorded_time, "recordings": [], "danmaku": []}
+            sessions.append(current)
+        current["recordings"].append(video)
+        current["end"] = recorded_time
+
+    # 场次按时间有序，二分查找候选场次，只需检查相邻的两个
+    lower_bounds = [session["start"] - DANMAKU_LEAD for session in sessions]
+    for danmaku in danmaku_files:
+        danmaku_time = datetime.fromisoformat(danmaku["created_at"])
+        i = bisect_right(lower_bounds, danmaku_time) - 1
+        for j in (i - 1, i):
+            if j >= 0 and lower_bounds[j] <= danmaku_time <= sessions[j]["end"] + SESSION_GAP:
+                sessions[j]["danmaku"].append(danmaku)
+                break
+
+    # 每天的场次编号从1开始（按时间顺序）
+    day_counts = {}
+    result = []
+    for session in sessions:
+        date = session["start"].strftime("%Y-%m-%d")
+        day_counts[date] = day_counts.get(date, 0) + 1
+        result.append({
+            "id": session["start"].strftime("%Y-%m-%d_%H-%M-%S"),
+            "date": date,
+            "number": day_counts[date],
+            "start_time": session["start"].isoformat(),
+            "end_time": session["end"].isoformat(),
+            "video_count": len(session["recordings"]),
+            "size_mb": round(sum(video["size"] for video in session["recordings"]) / 1024 / 1024, 2),
+            "recordings": session["recordings"],
+            "danmaku": session["danmaku"]
+        })
+    return result
+
+def get_sessions() -> List[dict]:
+    global _sessions
+    if _sessions is None:
+        _sessions = group_sessions(_index)
+    return _sessions
+
+def start_index_watcher(loop: asyncio.AbstractEventLoop):
+    """监听录播目录变化（需要 watchdog，未安装时请求时按目录修改时间重建索引）"""
+    global _index_observer
+    try:
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+    except ImportError:
+        print("⚠️  未安装 watchdog，录播索引在目录变化后的请求时重建")
+        return
+    if not os.path.isdir(RECORDINGS_DIR):
+        return
+
+    class IndexEventHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.is_directory:
+                return
+            for path in (getattr(event, 'src_path', None), getattr(event, 'dest_path', None)):
+                # 录播目录不含子目录，只处理直接位于其中的文件
+                if path and os.path.dirname(os.path.abspath(path)) == os.path.abspath(RECORDINGS_DIR):
+                    loop.call_soon_threadsafe(index_update, os.path.basename(path))
+
+    _index_observer = Observer()
+    _index_observer.schedule(IndexEventHandler(), RECORDINGS_DIR, recursive=False)
+    _index_observer.daemon = True
+    _index_observer.start()
+
+async def ensure_index_fresh():
+    """没有目录监听时，目录有增删或索引过期后重建（录制中的文件大小会变化）"""
+    if _index_observer is not None:
+        return
+    if get_dir_mtime() != _index_dir_mtime or time.time() - _index_built_at > INDEX_REFRESH_INTERVAL:
+        set_index(await asyncio.to_thread(build_index))
+
+@router.on_event("startup")
+async def load_index():
+    """启动时遍历一次录播目录建立索引，并开始监听目录变化"""
+    set_index(await asyncio.to_thread(build_index))
+    sessions = get_sessions()
+    print(f"📼 录播索引: {len(_index)} 个文件, {len(sessions)} 场")
+    start_index_watcher(asyncio.get_running_loop())
+
+@router.on_event("shutdown")
+async def stop_index_watcher():
+    """停止目录监听"""
+    if _index_observer is not None:
+        _index_observer.stop()
+
 @router.get("/recordings")
-async def get_recordings():
-    """获取录播列表（包括视频和弹幕）"""
+async def get_recordings(
+    page: int = 1,
+    page_size: int = 20,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
+):
+    """
+    获取按场次分组的录播列表（包括视频和弹幕），最新的场次在前
+    start_date / end_date 为 YYYY-MM-DD，按场次开始日期过滤（含两端）
+    """
     try:
-        recordings = []
-        danmaku_files = []
-
-        if os.path.exists(RECORDINGS_DIR):
-            for filename in os.listdir(RECORDINGS_DIR):
-                filepath = os.path.join(RECORDINGS_DIR, filename)
-
-                # 跳过目录
-                if os.path.isdir(filepath):
-                    continue
-
-                stat = os.stat(filepath)
-
-                # 解析文件名获取真实录制时间
-                # 格式1: SL_林木垚Meow_2025-10-08_15-02-38.mp4
-                # 格式2: SL_林木垚Meow_2025-10-08_15-02-38_000.mp4（带序号）
-                # 格式3: SL_林木垚Meow_2025-10-08_15-02-38.json（弹幕文件）
-                try:
-                    # 移除扩展名
-                    name_without_ext = filename.rsplit('.', 1)[0]
-                    parts = name_without_ext.split('_')
-
-                    # 找到日期和时间部分
-                    if len(parts) >= 4:
-                        # 倒数第二个或第三个是日期
-                        date_str = parts[-2] if not parts[-1].isdigit() else parts[-3]
-                        time_str = parts[-1] if not parts[-1].isdigit() else parts[-2]
-
-                        # 构造日期时间字符串
-                        datetime_str = f"{date_str} {time_str.replace('-', ':')}"
-
-                        # 解析为datetime对象，用于场次分组
-                        try:
-                            recorded_time = datetime.strptime(datetime_str, "%Y-%m-%d %H:%M:%S")
-                            created_at = recorded_time.isoformat()
-                        except:
-                            # 解析失败，使用文件创建时间
-                            created_at = datetime.fromtimestamp(stat.st_ctime).isoformat()
-                    else:
-                        datetime_str = ""
-                        created_at = datetime.fromtimestamp(stat.st_ctime).isoformat()
-                except:
-                    datetime_str = ""
-                    created_at = datetime.fromtimestamp(stat.st_ctime).isoformat()
-
-                # 处理视频文件
-                if filename.endswith(('.mp4', '.ts', '.flv')):
-                    recordings.append({
-                        "filename": filename,
-                        "url": f"/recordings/{filename}",
-                        "size": stat.st_size,
-                        "size_mb": round(stat.st_size / 1024 / 1024, 2),
-                        "created_at": created_at,  # 使用录制时间而非文件创建时间
-                        "date": datetime_str
-                    })
-
-                # 处理弹幕JSON文件
-                elif filename.endswith('.json'):
-                    danmaku_files.append({
-                        "filename": filename,
-                        "url": f"/recordings/{filename}",
-                        "size": stat.st_size,
-                        "size_mb": round(stat.st_size / 1024 / 1024, 2),
-                        "created_at": created_at,
-                        "date": datetime_str
-                    })
-
-        # 按创建时间倒序排序
-        recordings.sort(key=lambda x: x["created_at"], reverse=True)
-        danmaku_files.sort(key=lambda x: x["created_at"], reverse=True)
+        await ensure_index_fresh()
+        sessions = get_sessions()
+        if start_date or end_date:
+            sessions = [
+                session for session in sessions
+                if (not start_date or session["date"] >= start_date) and (not end_date or session["date"] <= end_date)
+            ]
+        page = max(page, 1)
+        page_size = min(max(page_size, 1), 200)
+
+        # 倒序分页，不复制整个列表
+        total = len(sessions)
+        start = (page - 1) * page_size
+        page_sessions = [sessions[total - 1 - i] for i in range(start, min(start + page_size, total))]
 
+        all_sessions = get_sessions()
         return {
             "success": True,
             "data": {
-                "videos": recordings,
-                "danmaku": danmaku_files
+                "sessions": page_sessions,
+                "total": total,
+                "page": page,
+                "page_size": page_size,
+                "has_more": start + page_size < total,
+                "first_date": all_sessions[0]["date"] if all_sessions else None,
+                "last_date": all_sessions[-1]["date"] if all_sessions else None
             }
         }
 
@@ -143,36 +143,32 @@ async function generateSpeech() {
     showLoading(true);
     hidePlayer();
 
-    try {
-        const response = await fetch('/api/generate', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                text: text,
-                emotion: selectedEmotion
-            })
-        });
-
-        const result = await response.json();
-
-        if (result.success) {
-            // 显示音频播放器
-            showAudioPlayer(result.data);
-            showToast('语音生成成功!', 'success');
-
-            // 刷新历史记录
-            setTimeout(() => loadHistory(), 500);
-        } else {
-            showToast('生成失败: ' + (result.detail || '未知错误'), 'danger');
-        }
-    } catch (error) {
-        console.error('生成失败:', error);
-        showToast('生成失败，请检查服务是否正常运行', 'danger');
-    } finally {
+    // 流式生成：音频边合成边播放，结束后写入历史记录
+    const params = new URLSearchParams({ text: text, emotion: selectedEmotion });
+    const streamUrl = `/api/generate/stream?${params.toString()}`;
+    const audio = document.getElementById('audioElement');
+    const streamHref = new URL(streamUrl, window.location.href).href;
+
+    // 只处理本次流的事件（切换到历史音频后不再触发）
+    audio.onplaying = () => {
+        if (audio.src === streamHref) showLoading(false);
+    };
+    audio.onerror = () => {
+        if (audio.src !== streamHref) return;
         showLoading(false);
-    }
+        showToast('生成失败，请检查服务是否正常运行', 'danger');
+    };
+    audio.onended = () => {
+        if (audio.src !== streamHref) return;
+        showToast('语音生成成功!', 'success');
+        // 刷新历史记录
+        loadHistory();
+    };
+
+    showAudioPlayer({
+        audio_url: streamUrl,
+        filename: `tts_${Date.now()}.wav`
+    });
 }
 
 // 显示/隐藏加载动画
@@ -416,93 +412,43 @@ function parseRtfContent(rtfContent) {
     return html;
 }
 
-// 按时间间隔分组录播为场次
-function groupRecordingsBySessions(recordings, danmakuFiles = []) {
-    // 间隔阈值：3小时 = 10800000 毫秒
-    const SESSION_GAP_MS = 3 * 60 * 60 * 1000;
-
-    // 先按时间正序排序（最早的在前）
-    const sorted = [...recordings].sort((a, b) =>
-        new Date(a.created_at) - new Date(b.created_at)
-    );
-
-    const sessions = [];
-    let currentSession = null;
-
-    sorted.forEach(recording => {
-        const recordingTime = new Date(recording.created_at);
-
-        if (!currentSession) {
-            // 第一个录播，创建第一个场次
-            currentSession = {
-                recordings: [recording],
-                danmaku: [],
-                startTime: recordingTime,
-                endTime: recordingTime
-            };
-        } else {
-            // 计算与当前场次最后一个录播的时间差
-            const timeDiff = recordingTime - currentSession.endTime;
-
-            if (timeDiff > SESSION_GAP_MS) {
-                // 间隔超过1小时，保存当前场次，创建新场次
-                sessions.push(currentSession);
-                currentSession = {
-                    recordings: [recording],
-                    danmaku: [],
-                    startTime: recordingTime,
-                    endTime: recordingTime
-                };
-            } else {
-                // 间隔小于1小时，加入当前场次
-                currentSession.recordings.push(recording);
-                currentSession.endTime = recordingTime;
-            }
-        }
-    });
-
-    // 保存最后一个场次
-    if (currentSession) {
-        sessions.push(currentSession);
-    }
-
-    // 将弹幕文件分配到对应的场次
-    danmakuFiles.forEach(danmaku => {
-        const danmakuTime = new Date(danmaku.created_at);
+const RECORDINGS_PAGE_SIZE = 20;  // 每页加载的场次数（场次分组由后端索引完成）
+let recordingsNextPage = 1;
+let recordingsRenderedCount = 0;  // 已渲染的场次数，用于生成场次元素 id
 
-        // 找到弹幕所属的场次（弹幕时间在场次的startTime和endTime + SESSION_GAP_MS范围内）
-        for (let session of sessions) {
-            const sessionStart = session.startTime.getTime() - (60 * 60 * 1000); // 向前容差1小时
-            const sessionEnd = session.endTime.getTime() + SESSION_GAP_MS;
-
-            if (danmakuTime.getTime() >= sessionStart && danmakuTime.getTime() <= sessionEnd) {
-                session.danmaku.push(danmaku);
-                break;
-            }
-        }
-    });
-
-    // 场次倒序（最新的场次在前）
-    return sessions.reverse();
-}
-
-// 加载录播列表
-async function loadRecordings() {
+// 加载录播列表，append 为 true 时加载下一页
+async function loadRecordings(append = false) {
     const container = document.getElementById('recordingsList');
+    const oldMoreButton = container.querySelector('.recordings-load-more');
+    if (oldMoreButton) oldMoreButton.remove();
 
-    try {
+    if (!append) {
+        recordingsNextPage = 1;
+        recordingsRenderedCount = 0;
         container.innerHTML = `
             <div class="text-center text-muted py-5">
                 <div class="spinner-border" role="status"></div>
                 <p class="mt-3">加载中...</p>
             </div>
         `;
+    }
 
-        const response = await fetch('/api/recordings');
+    try {
+        const params = new URLSearchParams({
+            page: recordingsNextPage,
+            page_size: RECORDINGS_PAGE_SIZE
+        });
+        const startDate = document.getElementById('recordingsStartDate').value;
+        const endDate = document.getElementById('recordingsEndDate').value;
+        if (startDate) params.set('start_date', startDate);
+        if (endDate) params.set('end_date', endDate);
+
+        const response = await fetch(`/api/recordings?${params.toString()}`);
         const result = await response.json();
 
         if (result.success) {
-            renderRecordings(result.data);
+            recordingsNextPage += 1;
+            renderRecordings(result.data, append);
         } else {
             container.innerHTML = `
                 <div class="text-center text-danger py-5">
@@ -513,6 +459,10 @@ async function loadRecordings() {
         }
     } catch (error) {
         console.error('加载录播列表失败:', error);
+        if (append) {
+            showToast('加载录播失败，请稍后重试', 'danger');
+            return;
+        }
         container.innerHTML = `
             <div class="text-center text-danger py-5">
                 <i class="bi bi-exclamation-circle display-4"></i>
@@ -522,6 +472,13 @@ async function loadRecordings() {
     }
 }
 
+// 清除日期筛选并重新加载
+function clearRecordingsFilter() {
+    document.getElementById('recordingsStartDate').value = '';
+    document.getElementById('recordingsEndDate').value = '';
+    loadRecordings();
+}
+
 // 格式化场次日期
 function formatSessionDate(date) {
     const year = date.getFullYear();
@@ -817,60 +774,40 @@ function applyDanmakuFilters(danmakuId) {
     });
 }
 
-// 渲染录播列表（按场次分组）
-function renderRecordings(data) {
+// 渲染录播列表（后端已按场次分组、分页，最新的场次在前）
+function renderRecordings(data, append = false) {
     const container = document.getElementById('recordingsList');
+    const sessions = data.sessions || [];
 
-    // 适配新的数据格式
-    const videos = data.videos || data;  // 兼容旧格式
-    const danmaku = data.danmaku || [];
-
-    if (videos.length === 0) {
-        container.innerHTML = `
-            <div class="text-center text-muted py-5">
-                <i class="bi bi-camera-video display-4"></i>
-                <p class="mt-3">暂无录播</p>
-            </div>
-        `;
-        return;
-    }
-
-    // 按场次分组（传入视频和弹幕文件）
-    const sessions = groupRecordingsBySessions(videos, danmaku);
-
-    container.innerHTML = '';
-
-    // 第一步：统计每个日期的场次总数
-    const dateCounts = {};
-    sessions.forEach(session => {
-        const dateStr = formatSessionDate(session.startTime);
-        dateCounts[dateStr] = (dateCounts[dateStr] || 0) + 1;
+    // 日期选择范围限定在有录播的日期内
+    ['recordingsStartDate', 'recordingsEndDate'].forEach(id => {
+        const input = document.getElementById(id);
+        if (data.first_date) input.min = data.first_date;
+        if (data.last_date) input.max = data.last_date;
     });
 
-    // 第二步：渲染场次，每天的场次编号从1开始
-    const dateIndices = {};
-
-    sessions.forEach((session, index) => {
-        // 获取场次日期
-        const sessionDate = formatSessionDate(session.startTime);
-
-        // 初始化该日期的索引
-        if (!(sessionDate in dateIndices)) {
-            dateIndices[sessionDate] = 0;
+    if (!append) {
+        container.innerHTML = '';
+        if (sessions.length === 0) {
+            container.innerHTML = `
+                <div class="text-center text-muted py-5">
+                    <i class="bi bi-camera-video display-4"></i>
+                    <p class="mt-3">暂无录播</p>
+                </div>
+            `;
+            return;
         }
+    }
 
-        // 计算当天的场次编号（倒序：最新的编号最大）
-        const sessionNumber = dateCounts[sessionDate] - dateIndices[sessionDate];
-        dateIndices[sessionDate]++;
-
-        // 计算场次统计数据
-        const videoCount = session.recordings.length;
-        const totalSizeMB = session.recordings.reduce((sum, r) => sum + r.size_mb, 0).toFixed(2);
+    sessions.forEach(session => {
+        const sessionStart = new Date(session.start_time);
+        const sessionEnd = new Date(session.end_time);
+        const sessionDate = formatSessionDate(sessionStart);
 
         // 格式化时间
-        const startTime = formatSessionTime(session.startTime);
-        const endTime = formatSessionTime(session.endTime);
-        const timeRange = session.startTime.getTime() === session.endTime.getTime()
+        const startTime = formatSessionTime(sessionStart);
+        const endTime = formatSessionTime(sessionEnd);
+        const timeRange = sessionStart.getTime() === sessionEnd.getTime()
             ? startTime
             : `${startTime} - ${endTime}`;
 
@@ -878,24 +815,24 @@ function renderRecordings(data) {
         const sessionCard = document.createElement('div');
         sessionCard.className = 'session-card';
 
-        const sessionId = `session-${index}`;
+        const sessionId = `session-${recordingsRenderedCount++}`;
 
         sessionCard.innerHTML = `
             <div class="session-header" onclick="toggleSession('${sessionId}')">
                 <div class="session-info">
                     <h5 class="session-title">
                         <i class="bi bi-camera-video-fill me-2"></i>
-                        ${sessionDate} · 第 ${sessionNumber} 场
+                        ${sessionDate} · 第 ${session.number} 场
                     </h5>
                     <div class="session-meta">
                         <span class="me-3">
                             <i class="bi bi-clock"></i> ${timeRange}
                         </span>
                         <span class="me-3">
-                            <i class="bi bi-collection-play"></i> ${videoCount} 个视频
+                            <i class="bi bi-collection-play"></i> ${session.video_count} 个视频
                         </span>
                         <span>
-                            <i class="bi bi-hdd"></i> ${totalSizeMB} MB
+                            <i class="bi bi-hdd"></i> ${session.size_mb.toFixed(2)} MB
                         </span>
                     </div>
                 </div>
@@ -928,6 +865,14 @@ function renderRecordings(data) {
             loadDanmaku(danmakuId, fileUrls);
         }
     });
+
+    if (data.has_more) {
+        const moreButton = document.createElement('button');
+        moreButton.className = 'btn btn-outline-secondary w-100 mt-3 recordings-load-more';
+        moreButton.innerHTML = '<i class="bi bi-arrow-down-circle"></i> 加载更多场次';
+        moreButton.onclick = () => loadRecordings(true);
+        container.appendChild(moreButton);
+    }
 }
 
 // 切换场次展开/折叠
@@ -1591,8 +1536,10 @@ function clearChatState() {
 // 画室功能相关代码
 // ===========================
 
-let galleryImages = [];  // 存储所有图片信息
+let galleryImages = [];  // 存储已加载的图片信息
+let galleryImageIndex = {};  // 图片URL -> galleryImages 中的索引
 let galleryFolders = [];  // 存储文件夹分组数据
+const GALLERY_PAGE_SIZE = 60;  // 展开文件夹时每页加载的图片数
 let currentImageIndex = 0;  // 当前预览的图片索引
 
 // 主加载函数 - 文件夹分组版本
@@ -1622,13 +1569,18 @@ async function loadGallery() {
             return;
         }
 
-        // 存储文件夹数据
+        // 存储文件夹数据（图片列表在展开时分页加载）
         galleryFolders = data.folders;
+        galleryFolders.forEach(folder => {
+            folder.nextPage = 1;
+            folder.hasMore = folder.count > folder.previews.length;
+        });
 
-        // 构建扁平化的图片数组用于预览导航
+        // 已加载的图片用于预览导航，先放入各文件夹的预览图
         galleryImages = [];
+        galleryImageIndex = {};
         data.folders.forEach(folder => {
-            galleryImages.push(...folder.all_images);
+            folder.previews.forEach(registerGalleryImage);
         });
 
         // 渲染文件夹分组视图
@@ -1642,6 +1594,15 @@ async function loadGallery() {
     }
 }
 
+// 登记已加载的图片，返回其在 galleryImages 中的索引
+function registerGalleryImage(image) {
+    if (!(image.url in galleryImageIndex)) {
+        galleryImageIndex[image.url] = galleryImages.length;
+        galleryImages.push(image);
+    }
+    return galleryImageIndex[image.url];
+}
+
 // 渲染图片瀑布流 - 简化版
 function renderGalleryImages() {
     const container = document.getElementById('galleryContainer');
@@ -1713,21 +1674,20 @@ function renderGalleryFolders() {
         const previewGrid = document.createElement('div');
         previewGrid.className = 'folder-preview-grid';
 
-        // 显示前4张预览图
-        const previewImages = folder.all_images.slice(0, 4);
+        // 显示前4张预览图（使用缩略图）
+        const previewImages = folder.previews;
         previewImages.forEach(image => {
             const previewItem = document.createElement('div');
             previewItem.className = 'preview-item';
 
             const img = document.createElement('img');
             img.className = 'preview-image';
-            img.src = image.url;
+            img.src = image.thumbUrl || image.url;
             img.alt = image.name;
             img.title = image.name;
             img.loading = 'lazy';
 
-            // 查找图片在全局数组中的索引
-            const globalIndex = galleryImages.findIndex(img => img.url === image.url);
+            const globalIndex = galleryImageIndex[image.url];
             img.onclick = () => openImagePreview(globalIndex);
 
             previewItem.appendChild(img);
@@ -1758,19 +1718,49 @@ function renderGalleryFolders() {
 }
 
 // 展开文件夹显示所有图片
-function expandFolder(folderIndex) {
+async function expandFolder(folderIndex) {
     const folder = galleryFolders[folderIndex];
     const expandedContent = document.getElementById(`folder-expanded-${folderIndex}`);
     const button = event.target.closest('button');
 
     if (expandedContent.style.display === 'none') {
-        // 渲染所有图片
-        expandedContent.innerHTML = '';
-        const allImagesGrid = document.createElement('div');
-        allImagesGrid.className = 'folder-all-images-grid mt-3';
+        if (!expandedContent.querySelector('.folder-all-images-grid')) {
+            const allImagesGrid = document.createElement('div');
+            allImagesGrid.className = 'folder-all-images-grid mt-3';
+            expandedContent.appendChild(allImagesGrid);
+            await loadFolderPage(folderIndex);
+        }
+        expandedContent.style.display = 'block';
+        button.innerHTML = '<i class="bi bi-chevron-up"></i> 收起';
+    } else {
+        // 收起
+        expandedContent.style.display = 'none';
+        button.innerHTML = '<i class="bi bi-grid-3x3-gap"></i> 查看全部';
+    }
+}
+
+// 分页加载文件夹中的图片
+async function loadFolderPage(folderIndex) {
+    const folder = galleryFolders[folderIndex];
+    const expandedContent = document.getElementById(`folder-expanded-${folderIndex}`);
+    const allImagesGrid = expandedContent.querySelector('.folder-all-images-grid');
+    const oldMoreButton = expandedContent.querySelector('.folder-load-more');
+    if (oldMoreButton) oldMoreButton.remove();
 
-        // 从第5张开始显示（前4张已经在预览中）
-        folder.all_images.slice(4).forEach(image => {
+    try {
+        const params = new URLSearchParams({
+            name: folder.name,
+            page: folder.nextPage,
+            page_size: GALLERY_PAGE_SIZE
+        });
+        const response = await fetch(`/api/gallery/local-folder?${params.toString()}`);
+        const data = await response.json();
+        folder.nextPage += 1;
+        folder.hasMore = data.has_more;
+
+        // 前4张已经在预览中
+        const previewUrls = new Set(folder.previews.map(image => image.url));
+        data.images.filter(image => !previewUrls.has(image.url)).forEach(image => {
             const imageItem = document.createElement('div');
             imageItem.className = 'all-images-item';
 
@@ -1781,21 +1771,23 @@ function expandFolder(folderIndex) {
             img.title = image.name;
             img.loading = 'lazy';
 
-            // 查找图片在全局数组中的索引
-            const globalIndex = galleryImages.findIndex(img => img.url === image.url);
+            const globalIndex = registerGalleryImage(image);
             img.onclick = () => openImagePreview(globalIndex);
 
             imageItem.appendChild(img);
             allImagesGrid.appendChild(imageItem);
         });
+    } catch (error) {
+        console.error('加载文件夹图片失败:', error);
+        showToast('加载图片失败，请稍后重试', 'danger');
+    }
 
-        expandedContent.appendChild(allImagesGrid);
-        expandedContent.style.display = 'block';
-        button.innerHTML = '<i class="bi bi-chevron-up"></i> 收起';
-    } else {
-        // 收起
-        expandedContent.style.display = 'none';
-        button.innerHTML = '<i class="bi bi-grid-3x3-gap"></i> 查看全部';
+    if (folder.hasMore) {
+        const moreButton = document.createElement('button');
+        moreButton.className = 'btn btn-outline-secondary btn-sm mt-3 folder-load-more';
+        moreButton.innerHTML = '<i class="bi bi-arrow-down-circle"></i> 加载更多';
+        moreButton.onclick = () => loadFolderPage(folderIndex);
+        expandedContent.appendChild(moreButton);
     }
 }
 
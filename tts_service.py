@@ -4,15 +4,23 @@ TTS 语音生成服务模块
 """
 
 from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
-import requests
+import asyncio
+import hashlib
+import httpx
+import json
 import os
+import re
+import struct
+import unicodedata
 from datetime import datetime
-from typing import Dict
+from typing import Dict, Optional
+import time
 import uuid
 
 # 导入情感配置
-from emotion_config import EMOTION_CONFIGS
+from emotion_config import EMOTION_CONFIGS, MODEL_CONFIG
 
 # 创建路由
 router = APIRouter(prefix="/api", tags=["TTS"])
@@ -23,6 +31,33 @@ OUTPUTS_DIR = os.path.join(os.path.dirname(__file__), 'outputs')
 # GPT-SoVITS API 配置
 GPT_SOVITS_API_URL = "http://127.0.0.1:9880"
 
+# 同时发往 GPT-SoVITS 的合成请求上限，超出的请求在本进程内排队
+# api.py 内部逐个合成（固定种子的结果才可复现），这里多放一个请求只是让下一条在 api.py 处提前排好
+TTS_MAX_CONCURRENCY = 2
+# 检查浏览器是否已断开的间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# 共享的异步客户端（长连接池），首次使用时创建
+_client: httpx.AsyncClient = None
+_tts_semaphore = asyncio.Semaphore(TTS_MAX_CONCURRENCY)
+# 排队中 / 合成中的请求数
+tts_stats = {"queued": 0, "running": 0}
+
+# 合成结果缓存：相同文本 + 情感参数 + 模型 + 种子 直接复用已生成的文件
+RESULT_CACHE_FILE = os.path.join(OUTPUTS_DIR, '.result_cache.json')
+RESULT_CACHE_MAX_BYTES = 500 * 1024 * 1024
+# 缓存索引延迟写盘的时间（秒），合并短时间内的多次变更
+RESULT_CACHE_SAVE_DELAY = 2
+# 固定随机种子（可选）：设置环境变量 TTS_PINNED_SEED 后，未指定种子的请求使用该种子，结果可复现、可走缓存
+# 默认不设置，未指定种子的请求每次随机生成，且不走缓存
+PINNED_SEED: Optional[int] = int(os.environ["TTS_PINNED_SEED"]) if os.environ.get("TTS_PINNED_SEED") else None
+
+# {key: {"filename", "size", "last_used"}}
+result_cache: Dict[str, dict] = {}
+_result_cache_save_handle = None
+# 文件哈希缓存 {path: ((size, mtime_ns), sha256)}
+_file_hashes: Dict[str, tuple] = {}
+
 # 用户历史记录存储 {session_id: [filename1, filename2, ...]}
 user_history: Dict[str, list] = {}
 
@@ -30,6 +65,231 @@ user_history: Dict[str, list] = {}
 class GenerateRequest(BaseModel):
     text: str
     emotion: str = "平静"
+    seed: Optional[int] = None
+
+def get_client() -> httpx.AsyncClient:
+    """获取共享的 GPT-SoVITS 异步客户端"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=GPT_SOVITS_API_URL,
+            timeout=httpx.Timeout(60.0, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=TTS_MAX_CONCURRENCY * 2,
+                max_keepalive_connections=TTS_MAX_CONCURRENCY
+            ),
+        )
+    return _client
+
+async def close_client():
+    """关闭共享客户端（供main.py在关闭时调用）"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def acquire_tts_slot():
+    """排队等待合成名额"""
+    tts_stats["queued"] += 1
+    try:
+        await _tts_semaphore.acquire()
+    finally:
+        tts_stats["queued"] -= 1
+    tts_stats["running"] += 1
+
+def release_tts_slot():
+    """释放合成名额"""
+    tts_stats["running"] -= 1
+    _tts_semaphore.release()
+
+async def request_tts(req: Request, params: dict) -> httpx.Response:
+    """排队调用 GPT-SoVITS，浏览器断开时取消请求"""
+    await acquire_tts_slot()
+    try:
+        task = asyncio.ensure_future(get_client().get("/", params=params))
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await req.is_disconnected():
+                task.cancel()
+                print("⚠️  客户端已断开，取消语音生成")
+                raise HTTPException(status_code=499, detail="客户端已断开")
+    finally:
+        release_tts_slot()
+
+class ClosingStreamingResponse(StreamingResponse):
+    """响应结束时总会执行 on_close：包括响应体还没开始发送客户端就断开、发送失败等情况"""
+
+    def __init__(self, *args, on_close=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.on_close is not None:
+                await self.on_close()
+
+def hash_file(path: str) -> str:
+    """计算文件的 sha256，按 (大小, 修改时间) 记忆，文件不存在时退化为路径"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path
+    stamp = (stat.st_size, stat.st_mtime_ns)
+    cached = _file_hashes.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+    _file_hashes[path] = (stamp, digest)
+    return digest
+
+def normalize_text(text: str) -> str:
+    """归一化文本：全角转半角、合并空白"""
+    text = unicodedata.normalize('NFKC', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+def make_cache_key(text: str, emotion_config: dict, seed: int) -> str:
+    """由归一化文本、情感参数、模型与参考音频哈希、种子生成缓存键"""
+    payload = {
+        "text": normalize_text(text),
+        "emotion": {k: emotion_config[k] for k in ("ref_text", "speed", "temperature", "top_k", "top_p")},
+        "ref_audio": hash_file(emotion_config["ref_audio"]),
+        "gpt_model": hash_file(MODEL_CONFIG["gpt_model"]),
+        "sovits_model": hash_file(MODEL_CONFIG["sovits_model"]),
+        "seed": seed
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+def load_result_cache():
+    """从 outputs 目录读取缓存索引"""
+    global result_cache
+    try:
+        with open(RESULT_CACHE_FILE, 'r', encoding='utf-8') as f:
+            result_cache = json.load(f)
+    except (OSError, ValueError):
+        result_cache = {}
+
+def save_result_cache():
+    """写回缓存索引（先写临时文件再替换）"""
+    global _result_cache_save_handle
+    _result_cache_save_handle = None
+    tmp_path = RESULT_CACHE_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(result_cache, f, ensure_ascii=False)
+    os.replace(tmp_path, RESULT_CACHE_FILE)
+
+def schedule_result_cache_save():
+    """延迟写盘，命中缓存时只更新内存中的 last_used"""
+    global _result_cache_save_handle
+    if _result_cache_save_handle is None:
+        _result_cache_save_handle = asyncio.get_running_loop().call_later(RESULT_CACHE_SAVE_DELAY, save_result_cache)
+
+def get_cached_result(key: str) -> Optional[dict]:
+    """命中则返回缓存条目，文件已被删除时移除该条目"""
+    entry = result_cache.get(key)
+    if entry is None:
+        return None
+    if not os.path.exists(os.path.join(OUTPUTS_DIR, entry["filename"])):
+        del result_cache[key]
+        schedule_result_cache_save()
+        return None
+    entry["last_used"] = time.time()
+    schedule_result_cache_save()
+    return entry
+
+def put_cached_result(key: str, filename: str, size: int, timestamp: str):
+    """登记新结果，超出容量时按最近使用时间淘汰旧文件"""
+    result_cache[key] = {"filename": filename, "size": size, "timestamp": timestamp, "last_used": time.time()}
+    total = sum(entry["size"] for entry in result_cache.values())
+    for old_key, entry in sorted(result_cache.items(), key=lambda item: item[1]["last_used"]):
+        if total <= RESULT_CACHE_MAX_BYTES or old_key == key:
+            break
+        try:
+            os.remove(os.path.join(OUTPUTS_DIR, entry["filename"]))
+        except OSError:
+            pass
+        total -= entry["size"]
+        del result_cache[old_key]
+        print(f"🧹 缓存淘汰: {entry['filename']}")
+    schedule_result_cache_save()
+
+def add_user_history(session_id: str, filename: str):
+    """将文件名添加到用户历史记录"""
+    if session_id not in user_history:
+        user_history[session_id] = []
+    if filename in user_history[session_id]:
+        user_history[session_id].remove(filename)
+    user_history[session_id].insert(0, filename)  # 插入到开头
+    # 只保留最近10条
+    user_history[session_id] = user_history[session_id][:10]
+
+def validate_request(text: str, emotion: str) -> dict:
+    """校验文本和情感类型，返回情感配置"""
+    # 验证情感类型
+    if emotion not in EMOTION_CONFIGS:
+        raise HTTPException(status_code=400, detail="无效的情感类型")
+
+    # 验证文本
+    if not text or len(text.strip()) == 0:
+        raise HTTPException(status_code=400, detail="文本不能为空")
+
+    if len(text) > 500:
+        raise HTTPException(status_code=400, detail="文本长度不能超过500字")
+
+    return EMOTION_CONFIGS[emotion]
+
+def build_tts_params(text: str, emotion_config: dict, seed: Optional[int]) -> dict:
+    """GPT-SoVITS API 请求参数"""
+    return {
+        "text": text,
+        "text_language": "zh",
+        "refer_wav_path": emotion_config["ref_audio"],
+        "prompt_text": emotion_config["ref_text"],
+        "prompt_language": "zh",
+        "top_k": emotion_config["top_k"],
+        "top_p": emotion_config["top_p"],
+        "temperature": emotion_config["temperature"],
+        "speed": emotion_config["speed"],
+        "seed": seed if seed is not None else -1
+    }
+
+def new_output_file() -> tuple:
+    """
+    原子地创建输出文件，返回 (timestamp, filename, 已打开的文件对象)
+    同一秒内的并发请求文件名冲突时加随机后缀重试，不会写到别的请求（或缓存条目）正在使用的文件
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"tts_{timestamp}.wav"
+    while True:
+        try:
+            return timestamp, filename, open(os.path.join(OUTPUTS_DIR, filename), 'xb')
+        except FileExistsError:
+            filename = f"tts_{timestamp}_{uuid.uuid4().hex[:6]}.wav"
+
+def wav_header(sample_rate: int, sample_width: int, data_size: int = 0xFFFFFFFF - 36) -> bytes:
+    """单声道 PCM WAV 文件头；流式输出时长度未知，先写最大值"""
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', min(data_size + 36, 0xFFFFFFFF), b'WAVE',
+        b'fmt ', 16, 1, 1, sample_rate, sample_rate * sample_width, sample_width, sample_width * 8,
+        b'data', data_size
+    )
+
+load_result_cache()
+
+@router.on_event("shutdown")
+async def flush_result_cache():
+    """退出前写回尚未落盘的缓存索引"""
+    if _result_cache_save_handle is not None:
+        _result_cache_save_handle.cancel()
+        save_result_cache()
 
 def get_or_create_session(request: Request, response: Response) -> str:
     """获取或创建会话ID"""
@@ -63,63 +323,54 @@ async def generate_speech(request: GenerateRequest, req: Request, response: Resp
     session_id = get_or_create_session(req, response)
 
     try:
-        # 验证情感类型
-        if request.emotion not in EMOTION_CONFIGS:
-            raise HTTPException(status_code=400, detail="无效的情感类型")
-
-        # 验证文本
-        if not request.text or len(request.text.strip()) == 0:
-            raise HTTPException(status_code=400, detail="文本不能为空")
-
-        if len(request.text) > 500:
-            raise HTTPException(status_code=400, detail="文本长度不能超过500字")
-
-        # 获取情感配置
-        emotion_config = EMOTION_CONFIGS[request.emotion]
+        # 验证并获取情感配置
+        emotion_config = validate_request(request.text, request.emotion)
+
+        # 查询结果缓存（仅在种子固定时）
+        seed = request.seed if request.seed is not None else PINNED_SEED
+        cache_key = None
+        if seed is not None and seed != -1:
+            cache_key = await asyncio.to_thread(make_cache_key, request.text, emotion_config, seed)
+            cached = get_cached_result(cache_key)
+            if cached is not None:
+                print(f"♻️  命中缓存: {cached['filename']}")
+                add_user_history(session_id, cached["filename"])
+                return {
+                    "success": True,
+                    "data": {
+                        "audio_url": f"/outputs/{cached['filename']}",
+                        "filename": cached["filename"],
+                        "text": request.text,
+                        "emotion": emotion_config["name"],
+                        "timestamp": cached["timestamp"],
+                        "cached": True
+                    }
+                }
 
         # 准备请求参数
-        params = {
-            "text": request.text,
-            "text_language": "zh",
-            "refer_wav_path": emotion_config["ref_audio"],
-            "prompt_text": emotion_config["ref_text"],
-            "prompt_language": "zh",
-            "top_k": emotion_config["top_k"],
-            "top_p": emotion_config["top_p"],
-            "temperature": emotion_config["temperature"],
-            "speed": emotion_config["speed"]
-        }
+        params = build_tts_params(request.text, emotion_config, seed)
 
         # 调用 GPT-SoVITS API
-        print(f"\n🎵 正在生成语音...")
+        print(f"\n🎵 正在生成语音... (排队 {tts_stats['queued']}, 进行中 {tts_stats['running']})")
         print(f"📝 文本: {request.text[:50]}...")
         print(f"😊 情感: {emotion_config['name']}")
 
-        response_api = requests.get(
-            f"{GPT_SOVITS_API_URL}/",
-            params=params,
-            timeout=60
-        )
+        response_api = await request_tts(req, params)
 
         if response_api.status_code != 200:
             raise HTTPException(status_code=500, detail="语音生成失败")
 
         # 保存生成的音频
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"tts_{timestamp}.wav"
-        filepath = os.path.join(OUTPUTS_DIR, filename)
-
-        with open(filepath, 'wb') as f:
+        timestamp, filename, f = new_output_file()
+        with f:
             f.write(response_api.content)
 
         print(f"✅ 语音生成成功: {filename}")
 
-        # 将文件名添加到用户历史记录
-        if session_id not in user_history:
-            user_history[session_id] = []
-        user_history[session_id].insert(0, filename)  # 插入到开头
-        # 只保留最近10条
-        user_history[session_id] = user_history[session_id][:10]
+        if cache_key is not None:
+            put_cached_result(cache_key, filename, len(response_api.content), timestamp)
+
+        add_user_history(session_id, filename)
 
         return {
             "success": True,
@@ -128,17 +379,122 @@ async def generate_speech(request: GenerateRequest, req: Request, response: Resp
                 "filename": filename,
                 "text": request.text,
                 "emotion": emotion_config["name"],
-                "timestamp": timestamp
+                "timestamp": timestamp,
+                "cached": False
             }
         }
 
-    except requests.exceptions.RequestException as e:
+    except HTTPException:
+        raise
+    except httpx.HTTPError as e:
         print(f"❌ API 调用失败: {e}")
         raise HTTPException(status_code=503, detail="语音服务暂时不可用，请稍后重试")
     except Exception as e:
         print(f"❌ 生成失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/generate/stream")
+async def generate_speech_stream(req: Request, text: str, emotion: str = "平静", seed: Optional[int] = None):
+    """流式生成语音：逐句转发 WAV 流到浏览器，同时写入 outputs 目录"""
+    emotion_config = validate_request(text, emotion)
+
+    seed = seed if seed is not None else PINNED_SEED
+    cache_key = None
+    if seed is not None and seed != -1:
+        cache_key = await asyncio.to_thread(make_cache_key, text, emotion_config, seed)
+        cached = get_cached_result(cache_key)
+        if cached is not None:
+            print(f"♻️  命中缓存: {cached['filename']}")
+            response = FileResponse(
+                os.path.join(OUTPUTS_DIR, cached["filename"]),
+                media_type="audio/wav",
+                headers={"X-Filename": cached["filename"]}
+            )
+            add_user_history(get_or_create_session(req, response), cached["filename"])
+            return response
+
+    # 后端逐句返回 raw PCM，采样率由响应头给出
+    params = build_tts_params(text, emotion_config, seed)
+    params["streaming_mode"] = True
+    params["media_type"] = "raw"
+
+    print(f"\n🎵 正在流式生成语音... (排队 {tts_stats['queued']}, 进行中 {tts_stats['running']})")
+    print(f"📝 文本: {text[:50]}...")
+    print(f"😊 情感: {emotion_config['name']}")
+
+    await acquire_tts_slot()
+    try:
+        client = get_client()
+        upstream = await client.send(client.build_request("GET", "/", params=params), stream=True)
+    except httpx.HTTPError as e:
+        release_tts_slot()
+        print(f"❌ API 调用失败: {e}")
+        raise HTTPException(status_code=503, detail="语音服务暂时不可用，请稍后重试")
+    if upstream.status_code != 200:
+        release_tts_slot()
+        await upstream.aclose()
+        raise HTTPException(status_code=500, detail="语音生成失败")
+
+    sample_rate = int(upstream.headers.get("X-Sample-Rate", 32000))
+    sample_width = int(upstream.headers.get("X-Sample-Width", 2))
+    timestamp, filename, f = new_output_file()
+    filepath = os.path.join(OUTPUTS_DIR, filename)
+
+    released = False
+
+    async def release():
+        """释放名额并关闭上游连接（只执行一次）"""
+        nonlocal released
+        if released:
+            return
+        released = True
+        release_tts_slot()
+        await upstream.aclose()
+
+    async def relay():
+        completed = False
+        data_size = 0
+        try:
+            header = wav_header(sample_rate, sample_width)
+            f.write(header)
+            yield header
+            async for chunk in upstream.aiter_raw():
+                f.write(chunk)
+                data_size += len(chunk)
+                yield chunk
+            completed = True
+        finally:
+            # 浏览器断开时生成器被关闭，同样走到这里：释放名额并删除不完整的文件
+            await release()
+            if completed:
+                f.seek(0)
+                f.write(wav_header(sample_rate, sample_width, data_size))
+                f.close()
+                if cache_key is not None:
+                    put_cached_result(cache_key, filename, data_size + 44, timestamp)
+                add_user_history(session_id, filename)
+                print(f"✅ 语音流式生成成功: {filename}")
+            else:
+                f.close()
+                os.remove(filepath)
+                print(f"⚠️  流式生成中断: {filename}")
+
+    body = relay()
+
+    async def close():
+        # 响应体没开始发送时生成器的 finally 不会执行，这里兜底关闭生成器、释放名额并删除空文件
+        await body.aclose()
+        await release()
+        if not f.closed:
+            f.close()
+            os.remove(filepath)
+
+    response = ClosingStreamingResponse(
+        body, media_type="audio/wav", headers={"X-Filename": filename}, on_close=close
+    )
+    session_id = get_or_create_session(req, response)
+    return response
+
 @router.get("/history")
 async def get_history(request: Request, response: Response):
     """获取当前用户的历史生成记录"""
@@ -176,7 +532,7 @@ async def get_status():
     """检查服务状态"""
     try:
         # 检查 GPT-SoVITS API 是否在线
-        response = requests.get(f"{GPT_SOVITS_API_URL}/", timeout=5)
+        response = await get_client().get("/", timeout=5)
         api_online = response.status_code == 200 or response.status_code == 400
     except:
         api_online = False
@@ -185,7 +541,9 @@ async def get_status():
         "success": True,
         "data": {
             "api_online": api_online,
-            "emotions_count": len(EMOTION_CONFIGS)
+            "emotions_count": len(EMOTION_CONFIGS),
+            "tts_queued": tts_stats["queued"],
+            "tts_running": tts_stats["running"]
         }
     }
 